@@ -1,10 +1,22 @@
-import streamlit as st
-import anthropic
+from startup import STARTUP, timed_import
+with STARTUP.timed("import:streamlit"):
+    import streamlit as st
 import json
-import toml
+import os
 from pathlib import Path
-from typing import List, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import threading
 import traceback
+import time
+from model_clients import build_anthropic_client, build_bedrock_client, client_stats
+from metrics import REGISTRY, SALVAGE, observe_phase
+from lens_cache import LensCache, cache_key
+from lens_parser import FOLLOWUP_TOKENS_PER_LENS, LensArrayParser, LensCompletion, extract_lens_objects, followup_request, merge_lenses, usable_lenses, validate_lenses
+from lens_rules import normalize_stage, rank_lenses
+from semantic_cache import SemanticCache, idea_text
+from providers import ClaudeProvider, NovaProvider, Prompt, build_output_budget, build_router
 
 # Configure page
 st.set_page_config(
@@ -26,7 +38,7 @@ def get_api_key():
         # Fallback to .env file (for local development)
         env_path = Path(".env")
         if env_path.exists():
-            env_content = toml.load(env_path)
+            env_content = timed_import("toml").load(env_path)
             api_key = env_content.get("anthropic", {}).get("api_key")
             if api_key and api_key.strip():
                 return api_key.strip()
@@ -35,14 +47,57 @@ def get_api_key():
     
     raise Exception("API key not found. Please add ANTHROPIC_API_KEY to Streamlit secrets or .env file")
 
-# Initialize Anthropic client
+# === Model Router ===
+CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+# Claude is always available; Nova joins when LENS_PROVIDERS lists it and AWS
+# credentials are configured. MODEL_HEDGING=1 hedges late first chunks.
+LENS_PROVIDERS = os.environ.get("LENS_PROVIDERS", "claude").split(",")
+NOVA_MODEL_ID = os.environ.get(
+    "NOVA_MODEL_ID", "arn:aws:bedrock:ap-south-1:069717477936:inference-profile/apac.amazon.nova-micro-v1:0"
+)
+
+# Clients are built on first use, or by the warm-up started after the first
+# render, so opening the page doesn't wait on SDK imports
 @st.cache_resource
-def get_anthropic_client():
-    try:
-        return anthropic.Client(api_key=get_api_key())
-    except Exception as e:
-        st.error(f"Failed to initialize Anthropic client: {e}")
-        return None
+def get_router(_api_key):
+    providers = [ClaudeProvider(CLAUDE_MODEL, client_factory=lambda: build_anthropic_client(_api_key))]
+    if "nova" in LENS_PROVIDERS:
+        region = os.environ.get("NOVA_REGION", "ap-south-1")
+        providers.append(NovaProvider(NOVA_MODEL_ID, client_factory=lambda: build_bedrock_client(region)))
+    return build_router(providers)
+
+# === Response Cache ===
+# Bump whenever build_prompt changes so cached rankings from the old prompt are ignored
+PROMPT_VERSION = "2"
+
+# Rule-based rankings at or above this confidence skip the Claude call
+RULES_CONFIDENCE_THRESHOLD = float(os.environ.get("RULES_CONFIDENCE_THRESHOLD", "0.8"))
+
+@st.cache_resource
+def get_lens_cache():
+    return LensCache(
+        max_entries=int(os.environ.get("LENS_CACHE_SIZE", "1024")),
+        ttl_seconds=float(os.environ.get("LENS_CACHE_TTL", "86400")),
+        db_path=os.environ.get("LENS_CACHE_DB"),
+        max_disk_entries=int(os.environ.get("LENS_CACHE_DISK_SIZE", "100000")),
+    )
+
+@st.cache_resource
+def get_semantic_cache():
+    return SemanticCache(
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.75")),
+        max_entries=int(os.environ.get("SEMANTIC_CACHE_SIZE", "10000")),
+        dim=int(os.environ.get("SEMANTIC_CACHE_DIM", "1024")),
+        backend=os.environ.get("SEMANTIC_CACHE_BACKEND", "numpy"),
+    )
+
+# Claude's max_tokens per stage follows the answer lengths seen so far, never
+# above CLAUDE_MAX_TOKENS; streams stop once all four lenses are in
+CLAUDE_MAX_TOKENS = int(os.environ.get("CLAUDE_MAX_TOKENS", "1500"))
+
+@st.cache_resource
+def get_output_budget():
+    return build_output_budget(CLAUDE_MAX_TOKENS)
 
 # === Startup Stages Configuration ===
 STARTUP_STAGES = {
@@ -105,49 +160,34 @@ STARTUP_STAGES = {
 }
 
 # === Enhanced Prompt Builder ===
-def build_prompt(title: str, description: str, tags: List[str], stage: str):
-    stage_info = STARTUP_STAGES.get(stage, {})
-    key_questions = stage_info.get("key_questions", [])
-    focus_areas = stage_info.get("focus_areas", [])
-    
-    # Create stage-specific context for AI
-    stage_context = ""
-    if stage == "IDEATION & PLANNING":
-        stage_context = """Early stage focusing on idea validation, market research, and planning. 
+# The prompt is split so providers can cache the large fixed part: a static
+# rubric (identical for every call), a short per-stage block, and a small
+# per-idea user message.
+STAGE_CONTEXTS = {
+    "IDEATION & PLANNING": """Early stage focusing on idea validation, market research, and planning. 
         At this stage, you need to validate core assumptions and understand market needs. 
         SME insights help validate technical feasibility, Peer insights provide business model validation,
-        Survey helps quantify market demand, Social reveals organic market conversations."""
-    elif stage == "PROTOTYPE DEVELOPMENT":
-        stage_context = """Building MVP stage focusing on product development and team coordination. 
+        Survey helps quantify market demand, Social reveals organic market conversations.""",
+    "PROTOTYPE DEVELOPMENT": """Building MVP stage focusing on product development and team coordination. 
         At this stage, you need technical validation and user experience feedback.
         SME insights crucial for technical decisions, Peer insights for development best practices,
-        Survey for feature prioritization, Social for competitive analysis."""
-    elif stage == "VALIDATION & ITERATION":
-        stage_context = """Testing and refining stage focusing on user feedback and usability. 
+        Survey for feature prioritization, Social for competitive analysis.""",
+    "VALIDATION & ITERATION": """Testing and refining stage focusing on user feedback and usability. 
         At this stage, direct user insights and iteration guidance are critical.
         Survey and Social become more valuable for user feedback, SME for technical optimization,
-        Peer for scaling challenges."""
-    elif stage == "LAUNCH & SCALING":
-        stage_context = """Go-to-market stage focusing on customer acquisition and scaling. 
+        Peer for scaling challenges.""",
+    "LAUNCH & SCALING": """Go-to-market stage focusing on customer acquisition and scaling. 
         At this stage, market strategy and growth insights are paramount.
         Peer insights for go-to-market strategies, Survey for pricing/positioning,
-        Social for brand awareness, SME for operational scaling."""
-    elif stage == "GROWTH & OPTIMIZATION":
-        stage_context = """Mature scaling stage focusing on optimization and expansion. 
+        Social for brand awareness, SME for operational scaling.""",
+    "GROWTH & OPTIMIZATION": """Mature scaling stage focusing on optimization and expansion. 
         At this stage, competitive intelligence and growth optimization are key.
         Survey for market expansion research, Social for competitive intelligence,
-        Peer for scaling strategies, SME for advanced optimizations."""
-
-    return f"""
-You are an expert startup advisor with deep knowledge of research methodologies. Analyze this startup and determine which research method would provide the MOST actionable insights at this specific stage.
-
-STARTUP CONTEXT:
-- Title: {title}
-- Description: {description}
-- Tags: {', '.join(tags)}
-- Current Stage: {stage}
+        Peer for scaling strategies, SME for advanced optimizations.""",
+}
 
-STAGE CONTEXT: {stage_context}
+LENS_RUBRIC = """
+You are an expert startup advisor with deep knowledge of research methodologies. Analyze the startup described in the user message and determine which research method would provide the MOST actionable insights at its specific stage.
 
 RESEARCH LENSES TO ANALYZE:
 
@@ -220,7 +260,7 @@ CONTEXT ANALYSIS REQUIREMENTS:
 
 Return ONLY a valid JSON array with this exact structure:
 [
-  {{
+  {
     "lens": "SME",
     "rank": [1, 2, 3, or 4 - calculated based on value for this specific context],
     "reason": "Brief explanation why this rank for this specific startup/stage considering title, description, tags, and stage",
@@ -229,8 +269,8 @@ Return ONLY a valid JSON array with this exact structure:
     "pros": ["Advantage 1 for this context", "Advantage 2 for this context"],
     "cons": ["Limitation 1 for this context", "Limitation 2 for this context"],
     "stageRelevance": [0.1_TO_1.0]
-  }},
-  {{
+  },
+  {
     "lens": "Peer",
     "rank": [1, 2, 3, or 4 - calculated based on value for this specific context],
     "reason": "Brief explanation why this rank for this specific startup/stage considering title, description, tags, and stage",
@@ -239,8 +279,8 @@ Return ONLY a valid JSON array with this exact structure:
     "pros": ["Advantage 1 for this context", "Advantage 2 for this context"],
     "cons": ["Limitation 1 for this context", "Limitation 2 for this context"],
     "stageRelevance": [0.1_TO_1.0]
-  }},
-  {{
+  },
+  {
     "lens": "Survey",
     "rank": [1, 2, 3, or 4 - calculated based on value for this specific context],
     "reason": "Brief explanation why this rank for this specific startup/stage considering title, description, tags, and stage",
@@ -249,8 +289,8 @@ Return ONLY a valid JSON array with this exact structure:
     "pros": ["Advantage 1 for this context", "Advantage 2 for this context"],
     "cons": ["Limitation 1 for this context", "Limitation 2 for this context"],
     "stageRelevance": [0.1_TO_1.0]
-  }},
-  {{
+  },
+  {
     "lens": "Social",
     "rank": [1, 2, 3, or 4 - calculated based on value for this specific context],
     "reason": "Brief explanation why this rank for this specific startup/stage considering title, description, tags, and stage",
@@ -259,56 +299,336 @@ Return ONLY a valid JSON array with this exact structure:
     "pros": ["Advantage 1 for this context", "Advantage 2 for this context"],
     "cons": ["Limitation 1 for this context", "Limitation 2 for this context"],
     "stageRelevance": [0.1_TO_1.0]
-  }}
+  }
 ]
 
 IMPORTANT: Analyze the specific context deeply and rank based on maximum actionable value. Different startups with different titles, descriptions, tags, and stages should get significantly different rankings. Rankings must be context-sensitive and vary meaningfully.
 """
 
+def build_stage_block(stage: str):
+    return f"""CURRENT STAGE: {stage}
+
+STAGE CONTEXT: {STAGE_CONTEXTS.get(stage, "")}
+"""
+
+# Precompiled at startup unless PRECOMPUTE_PROMPTS=0; otherwise each known
+# stage is built on first use. Unknown stages are never stored.
+PRECOMPUTE_PROMPTS = os.environ.get("PRECOMPUTE_PROMPTS", "1") == "1"
+with STARTUP.timed("init:stage_blocks"):
+    STAGE_BLOCKS = {stage: build_stage_block(stage) for stage in STARTUP_STAGES} if PRECOMPUTE_PROMPTS else {}
+
+def build_prompt(title: str, description: str, tags: List[str], stage: str):
+    # System blocks are (cacheable rubric, stage block)
+    stage_block = STAGE_BLOCKS.get(stage)
+    if stage_block is None:
+        stage_block = build_stage_block(stage)
+        if stage in STARTUP_STAGES:
+            STAGE_BLOCKS[stage] = stage_block
+    user_prompt = f"""STARTUP CONTEXT:
+- Title: {title}
+- Description: {description}
+- Tags: {', '.join(tags)}
+- Current Stage: {stage}
+"""
+    return Prompt((LENS_RUBRIC, stage_block), user_prompt)
+
 # === Claude API Call ===
-def query_claude(prompt_text: str, client):
+# Kept under its old name; the router may answer from another backend when
+# Claude is slow or failing.
+def query_claude(prompt, router, max_tokens=CLAUDE_MAX_TOKENS, stop_when=None):
     try:
-        response = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=1500,
-            temperature=0.4,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt_text
-                }
-            ]
-        )
+        return router.query(prompt, max_tokens, stop_when=stop_when).strip()
+    except Exception as e:
+        raise Exception(f"Claude API error: {str(e)}")
+
+def stream_claude(prompt, router, max_tokens=CLAUDE_MAX_TOKENS, timings=None, stop_when=LensCompletion):
+    try:
+        yield from router.stream(prompt, max_tokens, timings, stop_when)
+    except Exception as e:
+        raise Exception(f"Claude API error: {str(e)}")
+
+def complete_lenses(raw_output, prompt, router, notify=st.info):
+    # Pulls the lens array out of Claude's answer (fences, surrounding prose,
+    # truncation) and asks only for the lenses that didn't come back complete.
+    # Returns JSON text for the parse step, or the raw output if nothing usable.
+    kept, missing = usable_lenses(extract_lens_objects(raw_output))
+    if not missing:
+        return json.dumps(kept)
+    if not kept:
+        SALVAGE.inc(provider="claude", outcome="failed")
+        return raw_output
+    notify(f"ℹ️ Response was incomplete, requesting only the missing lenses: {', '.join(missing)}")
+    try:
+        followup = Prompt(prompt.system, prompt.user + followup_request(kept, missing))
+        answer = query_claude(followup, router, FOLLOWUP_TOKENS_PER_LENS * len(missing), lambda: LensCompletion(lenses=missing))
+        merged = merge_lenses(kept, answer)
+    except Exception:
+        merged = None
+    SALVAGE.inc(provider="claude", outcome="followup" if merged is not None else "failed")
+    return json.dumps(merged) if merged is not None else raw_output
+
+# === Background Analysis ===
+# Analyses run on a shared thread pool, not in the script thread, so a rerun
+# (any widget change) neither blocks on Claude nor starts the call again: the
+# job lives in st.session_state and the next run picks up its progress.
+ANALYSIS_WORKERS = int(os.environ.get("APP_ANALYSIS_WORKERS", "8"))
+ANALYSIS_HISTORY = int(os.environ.get("APP_ANALYSIS_HISTORY", "20"))
+
+@st.cache_resource
+def get_analysis_executor():
+    return ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix="analysis")
+
+class AnalysisJob:
+    # Progress of one analysis, written by the worker thread and read by the
+    # script. No Streamlit calls happen on the worker; messages are queued here.
+
+    def __init__(self, key, title, stage):
+        self.key = key
+        self.title = title
+        self.stage = stage
+        self.lock = threading.Lock()
+        self.lenses = []
+        self.messages = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self.raw_output = None
+        self.details = None
+
+    def add_lens(self, lens):
+        with self.lock:
+            self.lenses.append(lens)
+
+    def notify(self, kind, text):
+        with self.lock:
+            self.messages.append((kind, text))
+
+    def finish(self, result):
+        with self.lock:
+            self.result = result
+            self.lenses = list(result["results"])
+            self.done = True
+
+    def fail(self, error, raw_output=None, details=None):
+        with self.lock:
+            self.error = error
+            self.raw_output = raw_output
+            self.details = details
+            self.done = True
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.lenses), list(self.messages), self.done
+
+def run_analysis(job, router, lens_cache, semantic_cache, output_budget, title, description, tags, stage):
+    try:
+        # Reuse a previous analysis of the same idea/stage if we have one
+        cached = lens_cache.get(job.key)
+        namespace = f"{normalize_stage(stage)}|{PROMPT_VERSION}|{CLAUDE_MODEL}"
+        budget_stage = normalize_stage(stage) or "other"
+        text = idea_text(title, description, tags)
+        near = semantic_cache.lookup(namespace, text) if cached is None else None
+        rules_lenses, rules_confidence = rank_lenses(title, description, tags, stage)
+        source = "model"
+        
+        if cached is not None:
+            raw_output = json.dumps(cached)
+            source = "cache"
+        elif near is not None:
+            # A reworded version of an idea we've already analyzed
+            raw_output = json.dumps(near[0])
+            source = "semantic"
+            job.notify("info", f"ℹ️ Reusing the analysis of a near-identical idea (similarity {near[1]:.2f})")
+        elif rules_lenses is not None and rules_confidence >= RULES_CONFIDENCE_THRESHOLD:
+            # Obvious cases are ranked locally, no API call needed
+            raw_output = json.dumps(rules_lenses)
+            source = "rules"
+        else:
+            # Build prompt
+            started = time.perf_counter()
+            prompt = build_prompt(title, description, tags, stage)
+            observe_phase("build_prompt", time.perf_counter() - started, "claude")
+            
+            # Stream from Claude so lens cards appear as each one completes,
+            # falling back to the local rules if it is unavailable
+            try:
+                parser = LensArrayParser()
+                chunks = []
+                timings = {}
+                for delta in stream_claude(prompt, router, output_budget.max_tokens(budget_stage), timings):
+                    chunks.append(delta)
+                    for lens in parser.feed(delta):
+                        job.add_lens(lens)
+                _, missing = usable_lenses(parser.objects)
+                output_budget.observe(budget_stage, timings.get("output_tokens"), complete=not missing)
+                notify = lambda message: job.notify("info", message)
+                raw_output = complete_lenses("".join(chunks).strip(), prompt, router, notify)
+            except Exception as e:
+                if rules_lenses is None:
+                    raise
+                job.notify("warning", f"⚠️ Claude unavailable, showing rule-based ranking instead: {str(e)}")
+                raw_output = json.dumps(rules_lenses)
+                source = "rules"
+        
+        # Parse JSON response
+        parse_started = time.perf_counter()
+        try:
+            parsed = json.loads(raw_output)
+        except json.JSONDecodeError as e:
+            job.fail(f"❌ Failed to parse AI response as JSON: {str(e)}", raw_output)
+            return
+        
+        # Validate format, required fields and unique 1-4 rankings
+        error = validate_lenses(parsed)
+        if error:
+            job.fail(f"❌ {error}", raw_output)
+            return
         
-        output_string = response.content[0].text.strip()
+        observe_phase("parse", time.perf_counter() - parse_started, "claude")
         
-        # Find JSON array in the response
-        start_idx = output_string.find('[')
-        end_idx = output_string.rfind(']') + 1
+        if source == "model":
+            lens_cache.set(job.key, parsed)
+            semantic_cache.add(namespace, text, parsed)
         
-        if start_idx != -1 and end_idx != -1:
-            json_str = output_string[start_idx:end_idx]
-            return json_str
+        # Calculate summary
+        avg_confidence = sum(item['confidence'] for item in parsed) / len(parsed)
+        high_confidence_lenses = [item['lens'] for item in parsed if item['confidence'] > 0.7]
+        top_lens = min(parsed, key=lambda x: x['rank'])['lens']
         
-        return output_string
+        summary = {
+            "average_confidence": round(avg_confidence, 3),
+            "high_confidence_lenses": high_confidence_lenses,
+            "top_recommendation": top_lens,
+            "stage": stage,
+            "source": source
+        }
         
+        job.finish({
+            "results": sorted(parsed, key=lambda x: x['rank']),
+            "summary": summary
+        })
     except Exception as e:
-        raise Exception(f"Claude API error: {str(e)}")
+        job.fail(f"❌ Analysis failed: {str(e)}", details=traceback.format_exc())
+
+@st.cache_resource
+def start_warm_up(_router):
+    # Once per process: build the model clients off the script thread
+    STARTUP.mark_ready()
+    return get_analysis_executor().submit(_router.warm_up)
+
+def start_analysis(router, title, description, tags, stage):
+    # Returns the session's job for these inputs, starting one only if this
+    # session hasn't analyzed them yet
+    analyses = st.session_state.setdefault("analyses", OrderedDict())
+    key = cache_key(title, description, tags, stage, PROMPT_VERSION, CLAUDE_MODEL)
+    job = analyses.get(key)
+    if job is None or (job.done and job.error):
+        job = analyses[key] = AnalysisJob(key, title, stage)
+        # Shared resources are resolved here; the worker thread has no script context
+        get_analysis_executor().submit(
+            run_analysis, job, router, get_lens_cache(), get_semantic_cache(), get_output_budget(),
+            title, description, tags, stage,
+        )
+        while len(analyses) > ANALYSIS_HISTORY:
+            analyses.popitem(last=False)
+    analyses.move_to_end(key)
+    st.session_state["current_analysis"] = key
+    return job
+
+# === Result Rendering ===
+def render_lens_card(slot, lens):
+    with slot.container():
+        st.subheader(f"#{lens.get('rank', '?')} {lens.get('lens', '')}")
+        confidence = lens.get('confidence')
+        if isinstance(confidence, (int, float)):
+            st.progress(min(max(float(confidence), 0.0), 1.0), text=f"Confidence {confidence:.2f}")
+        st.write(lens.get('reason', ''))
+        for pro in lens.get('pros', []):
+            st.write(f"✅ {pro}")
+        for con in lens.get('cons', []):
+            st.write(f"⚠️ {con}")
+
+# While an analysis runs, the script draws what the worker has so far and
+# finishes; Streamlit reruns the progress block on a timer to pick up new
+# lenses, so the script thread never waits on the worker.
+ANALYSIS_POLL_SECONDS = float(os.environ.get("APP_ANALYSIS_POLL", "0.5"))
+
+def poll_progress(render):
+    # st.fragment(run_every=...) reruns just this block; Streamlit without
+    # fragments reruns the whole script after a short pause instead
+    if hasattr(st, "fragment"):
+        return st.fragment(run_every=ANALYSIS_POLL_SECONDS)(render)
+
+    def render_then_rerun(job):
+        render(job)
+        time.sleep(ANALYSIS_POLL_SECONDS)
+        st.rerun()
+    return render_then_rerun
+
+@poll_progress
+def render_progress(job):
+    lenses, _, done = job.snapshot()
+    if done:
+        st.rerun()  # a full run draws the finished analysis
+    st.info(f"🤖 Analyzing your startup with Claude... {len(lenses)}/4 lenses ready")
+    for column, lens in zip(st.columns(4), lenses):
+        render_lens_card(column, lens)
+
+def render_analysis(job):
+    lenses, messages, done = job.snapshot()
+    if not done:
+        render_progress(job)
+        return
+    for column, lens in zip(st.columns(4), lenses):
+        render_lens_card(column, lens)
+    
+    for kind, text in messages:
+        getattr(st, kind)(text)
+    
+    if job.error:
+        st.error(job.error)
+        if job.raw_output is not None:
+            st.text("Raw response:")
+            st.text(job.raw_output)
+        if job.details:
+            st.text("Full error details:")
+            st.text(job.details)
+        return
+    
+    # Display results
+    st.success("✅ Analysis completed successfully!")
+    
+    # Display JSON output
+    st.header("📋 Analysis Results (JSON)")
+    st.json(job.result)
+    
+    # Option to download JSON
+    st.download_button(
+        label="💾 Download JSON Results",
+        data=json.dumps(job.result, indent=2),
+        file_name=f"research_lens_analysis_{job.title.replace(' ', '_')}.json",
+        mime="application/json"
+    )
 
 # === Streamlit UI ===
 def main():
     st.title("🔍 OUTLAW Research Lens Selector")
     st.markdown("**Version 1.0.0** - Analyze your startup and get research lens recommendations")
     
-    # Initialize client
-    client = get_anthropic_client()
+    # Check the key; the client itself is built lazily
+    try:
+        api_key = get_api_key()
+    except Exception:
+        api_key = None
     
-    if not client:
+    if not api_key:
         st.error("❌ Failed to initialize Anthropic client. Please add ANTHROPIC_API_KEY to Streamlit secrets.")
         st.info("💡 In Streamlit Cloud: Go to App Settings → Secrets → Add your API key as ANTHROPIC_API_KEY")
         st.stop()
     
-    st.success("✅ Anthropic client initialized successfully")
+    st.success("✅ Anthropic API key loaded")
+    router = get_router(api_key)
+    start_warm_up(router)
     
     # Sidebar with stage information
     st.sidebar.header("📊 Available Stages")
@@ -320,6 +640,23 @@ def main():
             st.write("**Focus Areas:**")
             st.write(f"• {', '.join(info['focus_areas'])}")
     
+    # Analyses from this session can be reopened without another API call
+    analyses = st.session_state.get("analyses", {})
+    if analyses:
+        st.sidebar.header("🕘 This Session")
+        for key, job in reversed(list(analyses.items())):
+            label = f"{job.title} ({job.stage})" + ("" if job.done else " …")
+            if st.sidebar.button(label, key=f"history_{key}", use_container_width=True):
+                st.session_state["current_analysis"] = key
+    
+    with st.sidebar.expander("🔌 API client stats"):
+        st.json(client_stats())
+        st.json(router.stats())
+    with st.sidebar.expander("⏱️ Timing & token metrics"):
+        st.code(REGISTRY.render(), language="text")
+    with st.sidebar.expander("🚦 Startup cost"):
+        st.json(STARTUP.report())
+    
     # Main form
     st.header("🚀 Startup Analysis")
     
@@ -363,84 +700,11 @@ def main():
             st.error("❌ Please provide at least one tag")
             return
         
-        # Show analysis in progress
-        with st.spinner("🤖 Analyzing your startup with Claude..."):
-            try:
-                # Build prompt
-                prompt = build_prompt(title, description, tags, stage)
-                
-                # Query Claude
-                raw_output = query_claude(prompt, client)
-                
-                # Parse JSON response
-                try:
-                    parsed = json.loads(raw_output)
-                    
-                    # Validate response format
-                    if not isinstance(parsed, list) or len(parsed) != 4:
-                        st.error("❌ Invalid response format - expected array of 4 items")
-                        return
-                        
-                    # Validate required fields
-                    required_fields = ['lens', 'rank', 'reason', 'confidence', 'pros', 'cons', 'stageRelevance']
-                    for item in parsed:
-                        for field in required_fields:
-                            if field not in item:
-                                st.error(f"❌ Missing field: {field}")
-                                return
-                    
-                    # Validate rankings are unique and 1-4
-                    ranks = [item['rank'] for item in parsed]
-                    if sorted(ranks) != [1, 2, 3, 4]:
-                        st.error("❌ Invalid rankings - must be unique values 1-4")
-                        return
-                    
-                    # Calculate summary
-                    avg_confidence = sum(item['confidence'] for item in parsed) / len(parsed)
-                    high_confidence_lenses = [item['lens'] for item in parsed if item['confidence'] > 0.7]
-                    top_lens = min(parsed, key=lambda x: x['rank'])['lens']
-                    
-                    summary = {
-                        "average_confidence": round(avg_confidence, 3),
-                        "high_confidence_lenses": high_confidence_lenses,
-                        "top_recommendation": top_lens,
-                        "stage": stage
-                    }
-                    
-                    # Create final result
-                    result = {
-                        "results": parsed,
-                        "summary": summary
-                    }
-                    
-                    # Display results
-                    st.success("✅ Analysis completed successfully!")
-                    
-                    # Display JSON output
-                    st.header("📋 Analysis Results (JSON)")
-                    st.json(result)
-                    
-                    # Option to download JSON
-                    st.download_button(
-                        label="💾 Download JSON Results",
-                        data=json.dumps(result, indent=2),
-                        file_name=f"research_lens_analysis_{title.replace(' ', '_')}.json",
-                        mime="application/json"
-                    )
-                    
-                except json.JSONDecodeError as e:
-                    st.error(f"❌ Failed to parse AI response as JSON: {str(e)}")
-                    st.text("Raw response:")
-                    st.text(raw_output)
-                except ValueError as e:
-                    st.error(f"❌ Invalid AI response format: {str(e)}")
-                    st.text("Raw response:")
-                    st.text(raw_output)
-                    
-            except Exception as e:
-                st.error(f"❌ Analysis failed: {str(e)}")
-                st.text("Full error details:")
-                st.text(traceback.format_exc())
+        start_analysis(router, title, description, tags, stage)
+    
+    job = st.session_state.get("analyses", {}).get(st.session_state.get("current_analysis"))
+    if job is not None:
+        render_analysis(job)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
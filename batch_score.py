@@ -0,0 +1,258 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from lens_service import (
+    LensSelectorRequest, build_prompt, query_lenses, query_nova_micro_packed, pack_payloads, lens_max_tokens,
+    observe_output, query_missing_lenses, request_cache_key, local_lenses, remember_lenses, NOVA_REQUIRED_FIELDS,
+)
+from lens_parser import extract_lens_objects, usable_lenses
+from result_store import ResultStore
+
+# Offline bulk scoring: streams a JSONL of LensSelectorRequests through the
+# model on a worker pool and appends one JSONL result row per input line.
+#
+#   python batch_score.py ideas.jsonl results.jsonl --workers 16
+#   python batch_score.py ideas.jsonl results.jsonl --pack 5   # several ideas per model call
+#
+# Progress is checkpointed next to the output, so re-running the same command
+# after a crash skips every row that already has a result. Results go to the
+# output file only, unless --results-db names a result history (the API's
+# RESULT_STORE_DB, say) to append them to as well.
+
+LATENCY_SAMPLE_SIZE = 10000
+
+
+# ==== Checkpointing ====
+def read_checkpoint(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return json.load(f).get("watermark", 0)
+
+def write_checkpoint(path, watermark):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"watermark": watermark}, f)
+    os.replace(tmp_path, path)
+
+def completed_after(output_path, watermark):
+    # Rows finished past the watermark when the last run stopped. Only the
+    # in-flight window can be here, so this set stays small.
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path) as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn last line from a crash
+            if row.get("line", -1) >= watermark:
+                done.add(row["line"])
+    return done
+
+
+# ==== Scoring ====
+def score_with_model(row, payload, key):
+    row["source"] = "model"
+    prompt = build_prompt(payload.idea, payload.stage)
+    timings = {}
+    raw_output = query_lenses(prompt, lens_max_tokens(payload.stage), timings)
+    objects = extract_lens_objects(raw_output)
+    observe_output(payload.stage, timings, objects)
+    parsed, missing = usable_lenses(objects, NOVA_REQUIRED_FIELDS)
+    if missing:
+        parsed = query_missing_lenses(prompt, parsed, missing) if parsed else None
+    if parsed is None:
+        row["error"] = "Could not parse JSON from model"
+        row["raw_output"] = raw_output
+        return
+    row["result"] = parsed
+    remember_lenses(payload, key, parsed)
+
+def score_group(entries, store=None):
+    # Scores [(line_no, text)] and returns one result row per entry. With more
+    # than one idea left after the local lookups, they share packed model calls;
+    # lenses the packed answer got wrong are asked for on their own, and ideas
+    # with nothing usable are re-run alone.
+    started = time.perf_counter()
+    rows, pending, parsed = [], [], []
+    for line_no, text in entries:
+        row = {"line": line_no}
+        rows.append(row)
+        try:
+            data = json.loads(text)
+            row["id"] = data.get("id")
+            payload = LensSelectorRequest(**{k: v for k, v in data.items() if k != "id"})
+            row["studyId"] = payload.studyId
+            key = request_cache_key(payload)
+            parsed.append((row, payload, key))
+            lenses, meta = local_lenses(payload, key)
+            if lenses is not None:
+                row["result"] = lenses
+                row["source"] = meta["source"]
+            else:
+                pending.append((row, payload, key))
+        except Exception as e:
+            row["error"] = str(e)
+
+    retry = pending
+    if len(pending) > 1:
+        retry = []
+        for group in pack_payloads(pending, payload_of=lambda entry: entry[1]):
+            try:
+                packed = query_nova_micro_packed([payload for _, payload, _ in group])
+            except Exception:
+                packed = [[]] * len(group)
+            for (row, payload, key), kept in zip(group, packed):
+                lenses, missing = usable_lenses(kept, NOVA_REQUIRED_FIELDS)
+                if missing and lenses:
+                    try:
+                        lenses = query_missing_lenses(build_prompt(payload.idea, payload.stage), lenses, missing)
+                    except Exception:
+                        lenses = None
+                if not lenses:
+                    retry.append((row, payload, key))
+                    continue
+                row["result"] = lenses
+                row["source"] = "model-packed"
+                remember_lenses(payload, key, lenses)
+
+    for row, payload, key in retry:
+        try:
+            score_with_model(row, payload, key)
+        except Exception as e:
+            row["error"] = str(e)
+
+    if store is not None:
+        for row, payload, key in parsed:
+            if "result" in row:
+                idea = payload.idea
+                store.append(payload.studyId, idea.title, idea.description, idea.tags, payload.stage, row["result"],
+                             row["source"], key)
+
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    for row in rows:
+        row["latency_ms"] = latency_ms
+    return rows
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def run(input_path, output_path, workers, checkpoint_path, resume, checkpoint_every, pack=1, store=None):
+    watermark = read_checkpoint(checkpoint_path) if resume else 0
+    done = completed_after(output_path, watermark) if resume else set()
+    if not resume:
+        open(output_path, "w").close()
+    elif os.path.exists(output_path) and os.path.getsize(output_path):
+        # Terminate a torn last line so the next row starts cleanly
+        with open(output_path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+    stats = {"scored": 0, "errors": 0, "skipped": 0}
+    latencies = []
+    started = time.perf_counter()
+    last_checkpoint = started
+    max_in_flight = workers * 2
+
+    with open(input_path) as source, open(output_path, "a") as sink, ThreadPoolExecutor(max_workers=workers) as pool:
+        in_flight = {}
+
+        def drain(return_when):
+            nonlocal watermark, last_checkpoint
+            finished, _ = wait(in_flight, return_when=return_when)
+            for future in finished:
+                del in_flight[future]
+                for row in future.result():
+                    sink.write(json.dumps(row) + "\n")
+                    done.add(row["line"])
+                    stats["scored"] += 1
+                    if "error" in row:
+                        stats["errors"] += 1
+                    # Reservoir sample keeps percentile memory flat on huge inputs
+                    if len(latencies) < LATENCY_SAMPLE_SIZE:
+                        latencies.append(row["latency_ms"])
+                    else:
+                        slot = random.randrange(stats["scored"])
+                        if slot < LATENCY_SAMPLE_SIZE:
+                            latencies[slot] = row["latency_ms"]
+
+            while watermark in done:
+                done.discard(watermark)
+                watermark += 1
+            if time.perf_counter() - last_checkpoint >= checkpoint_every:
+                sink.flush()
+                write_checkpoint(checkpoint_path, watermark)
+                last_checkpoint = time.perf_counter()
+
+        group = []
+        for line_no, text in enumerate(source):
+            if line_no < watermark or line_no in done or not text.strip():
+                if line_no >= watermark:
+                    done.add(line_no)
+                stats["skipped"] += 1
+                continue
+            group.append((line_no, text))
+            if len(group) < pack:
+                continue
+            in_flight[pool.submit(score_group, group, store)] = group
+            group = []
+            if len(in_flight) >= max_in_flight:
+                drain(FIRST_COMPLETED)
+        if group:
+            in_flight[pool.submit(score_group, group, store)] = group
+        while in_flight:
+            drain(FIRST_COMPLETED)
+
+        while watermark in done:
+            done.discard(watermark)
+            watermark += 1
+        sink.flush()
+        write_checkpoint(checkpoint_path, watermark)
+    if store is not None:
+        store.flush()
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        **stats,
+        "elapsed_s": round(elapsed, 2),
+        "rows_per_s": round(stats["scored"] / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(stats["errors"] / stats["scored"], 4) if stats["scored"] else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-score a JSONL of lens-selector requests")
+    parser.add_argument("input", help="JSONL file, one LensSelectorRequest per line (optional 'id' field)")
+    parser.add_argument("output", help="JSONL file to append results to")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent model calls")
+    parser.add_argument("--checkpoint", help="checkpoint file (default: <output>.ckpt)")
+    parser.add_argument("--checkpoint-every", type=float, default=5.0, help="seconds between checkpoints")
+    parser.add_argument("--no-resume", action="store_true", help="ignore any checkpoint and start over")
+    parser.add_argument("--pack", type=int, default=1, help="ideas per worker task, packed into shared model calls")
+    parser.add_argument("--results-db", help="also append results to this result-history database")
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or args.output + ".ckpt"
+    store = ResultStore(args.results_db) if args.results_db else None
+    report = run(args.input, args.output, args.workers, checkpoint_path, not args.no_resume, args.checkpoint_every,
+                 max(1, args.pack), store)
+    print(json.dumps(report, indent=2), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
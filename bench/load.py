@@ -0,0 +1,185 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import uuid
+
+import httpx
+
+# Drives /api/ai/lens-selector against the local model stand-ins at a fixed
+# concurrency and reports RPS, latency percentiles and event-loop lag.
+#
+#   python -m bench.load --requests 500 --concurrency 32
+#   python -m bench.load --save-baseline bench/baselines/local.json
+#   python -m bench.load --compare bench/baselines/local.json   # exits 1 on regression
+#
+# Runs the app in-process by default; --url targets a running server instead
+# (e.g. one started with `python -m bench.serve_mock`).
+
+from bench.mock_models import add_mock_arguments, config_from_args, install_mocks
+
+ENDPOINTS = {
+    "single": "/api/ai/lens-selector",
+    "stream": "/api/ai/lens-selector/stream",
+}
+COMPARED = {"rps": "higher", "p50_ms": "lower", "p95_ms": "lower", "p99_ms": "lower", "loop_lag_p99_ms": "lower"}
+
+
+def make_payload(unique: bool):
+    suffix = uuid.uuid4().hex[:8] if unique else "fixed"
+    return {
+        "studyId": f"bench-{random.randint(1, 20)}",
+        "idea": {
+            "title": f"Benchmark idea {suffix}",
+            "description": "A marketplace connecting local tutors with parents, with scheduling and payments.",
+            "tags": ["edtech", "marketplace", "consumer"],
+        },
+        "stage": random.choice(["idea", "prototype", "beta"]),
+    }
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return round(ordered[index], 2)
+
+
+# ==== Event Loop Lag ====
+async def measure_loop_lag(samples, stop, interval=0.01):
+    # Oversleep of a short timer approximates how long the loop was blocked
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append((time.perf_counter() - started - interval) * 1000)
+
+
+# ==== Load Generation ====
+async def run_load(client, endpoint, total, concurrency, unique):
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(make_payload(unique))
+
+    async def worker():
+        nonlocal errors
+        while True:
+            try:
+                payload = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                response = await client.post(endpoint, json=payload)
+                body = response.text  # streaming endpoints finish here
+                if response.status_code != 200 or '"error"' in body:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+async def benchmark(args):
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=120)
+    else:
+        import main
+        install_mocks(main, config_from_args(args))
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=120)
+
+    lag_samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(measure_loop_lag(lag_samples, stop))
+    async with client:
+        if args.warmup:
+            await run_load(client, ENDPOINTS[args.endpoint], args.warmup, args.concurrency, args.unique)
+            lag_samples.clear()
+        latencies, errors, elapsed = await run_load(
+            client, ENDPOINTS[args.endpoint], args.requests, args.concurrency, args.unique
+        )
+    stop.set()
+    await lag_task
+
+    return {
+        "endpoint": args.endpoint,
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "errors": errors,
+        "error_rate": round(errors / args.requests, 4) if args.requests else 0.0,
+        "elapsed_s": round(elapsed, 2),
+        "rps": round(args.requests / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": round(statistics.mean(latencies), 2) if latencies else 0.0,
+        "loop_lag_p99_ms": percentile(lag_samples, 99),
+        "loop_lag_max_ms": round(max(lag_samples), 2) if lag_samples else 0.0,
+        "mock": None if args.url else {
+            "first_chunk_latency": args.first_chunk_latency,
+            "tokens_per_second": args.tokens_per_second,
+            "error_rate": args.error_rate,
+            "throttle_rate": args.throttle_rate,
+        },
+        "python": platform.python_version(),
+    }
+
+
+# ==== Baselines ====
+def compare(report, baseline, tolerance):
+    regressions = []
+    for metric, better in COMPARED.items():
+        old, new = baseline.get(metric), report.get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        if (better == "higher" and change < -tolerance) or (better == "lower" and change > tolerance):
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the lens selector against local model stand-ins")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="single")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=10, help="requests to send before measuring")
+    parser.add_argument("--repeat-ideas", dest="unique", action="store_false",
+                        help="send the same idea every time (measures the cache path)")
+    parser.add_argument("--url", help="target a running server instead of the in-process app")
+    parser.add_argument("--save-baseline", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    # Measure the model path only: no semantic hits or rule shortcuts. Set
+    # before main is imported, since it reads them at import time.
+    os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "0")
+    os.environ.setdefault("RULES_CONFIDENCE_THRESHOLD", "2")
+    os.environ.setdefault("RULES_FALLBACK", "0")
+
+    report = asyncio.run(benchmark(args))
+    print(json.dumps(report, indent=2))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Performance regressions:\n  " + "\n  ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+        print("No regressions against baseline", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+from types import SimpleNamespace
+import json
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+# Local stand-ins for the paid model APIs. They produce the same response
+# shapes the service consumes (Bedrock's invoke_model_with_response_stream
+# event stream and the Anthropic messages API) with a configurable
+# first-chunk latency, token rate and error/throttle injection.
+
+LENSES = ["SME", "Peer", "Survey", "Social"]
+
+
+def sample_output():
+    order = random.sample(LENSES, len(LENSES))
+    return json.dumps([
+        {
+            "lens": lens,
+            "rank": order.index(lens) + 1,
+            "reason": f"Mock reason for {lens} with enough words to resemble a real model explanation.",
+            "confidence": round(random.uniform(0.5, 0.95), 2),
+            "confidenceBasis": "Mock confidence basis derived from the benchmark stand-in.",
+            "pros": [f"{lens} advantage one", f"{lens} advantage two"],
+            "cons": [f"{lens} limitation one", f"{lens} limitation two"],
+            "stageRelevance": round(random.uniform(0.3, 0.9), 2),
+        }
+        for lens in LENSES
+    ], indent=2)
+
+
+class MockModelConfig:
+    def __init__(self, first_chunk_latency=0.3, tokens_per_second=150.0, chars_per_token=4,
+                 tokens_per_chunk=8, error_rate=0.0, throttle_rate=0.0):
+        self.first_chunk_latency = first_chunk_latency
+        self.tokens_per_second = tokens_per_second
+        self.chars_per_token = chars_per_token
+        self.tokens_per_chunk = tokens_per_chunk
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.lock = threading.Lock()
+        self.counters = {"calls": 0, "errors": 0, "throttles": 0}
+
+    def incr(self, counter):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def inject_failure(self, throttle_error):
+        self.incr("calls")
+        roll = random.random()
+        if roll < self.throttle_rate:
+            self.incr("throttles")
+            raise throttle_error
+        if roll < self.throttle_rate + self.error_rate:
+            self.incr("errors")
+            raise RuntimeError("Injected mock model error")
+
+    def chunks(self, text):
+        size = self.chars_per_token * self.tokens_per_chunk
+        delay = self.tokens_per_chunk / self.tokens_per_second
+        time.sleep(self.first_chunk_latency)
+        for start in range(0, len(text), size):
+            if start:
+                time.sleep(delay)
+            yield text[start:start + size]
+
+    def token_count(self, text):
+        return max(1, len(text) // self.chars_per_token)
+
+
+# ==== Bedrock Stand-In ====
+class MockEventStream:
+    def __init__(self, events):
+        self.events = events
+
+    def __iter__(self):
+        return self.events
+
+    def close(self):
+        self.events.close()
+
+class MockBedrockClient:
+    def __init__(self, config: MockModelConfig):
+        self.config = config
+
+    def invoke_model_with_response_stream(self, modelId, body, contentType=None, accept=None):
+        self.config.inject_failure(ClientError(
+            {"Error": {"Code": "ThrottlingException", "Message": "Mock rate exceeded"}},
+            "InvokeModelWithResponseStream",
+        ))
+        request = json.loads(body)
+        prompt_chars = sum(
+            len(part.get("text", ""))
+            for message in request.get("messages", []) for part in message.get("content", [])
+        ) + sum(len(part.get("text", "")) for part in request.get("system", []))
+        return {"body": MockEventStream(self._events(prompt_chars))}
+
+    def _events(self, prompt_chars):
+        text = sample_output()
+        for piece in self.config.chunks(text):
+            payload = {"contentBlockDelta": {"delta": {"text": piece}, "contentBlockIndex": 0}}
+            yield {"chunk": {"bytes": json.dumps(payload).encode("utf-8")}}
+        usage = {"inputTokens": prompt_chars // self.config.chars_per_token,
+                 "outputTokens": self.config.token_count(text)}
+        yield {"chunk": {"bytes": json.dumps({"metadata": {"usage": usage}}).encode("utf-8")}}
+
+
+# ==== Anthropic Stand-In ====
+class MockMessageStream:
+    def __init__(self, config, text, input_tokens):
+        self.config = config
+        self.text = text
+        self.input_tokens = input_tokens
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        return self.config.chunks(self.text)
+
+    def get_final_message(self):
+        return mock_message(self.text, self.input_tokens, self.config.token_count(self.text))
+
+class MockRateLimitError(Exception):
+    # Shaped like anthropic.RateLimitError as far as is_throttle cares
+    status_code = 429
+
+def mock_message(text, input_tokens, output_tokens):
+    return SimpleNamespace(
+        content=[SimpleNamespace(type="text", text=text)],
+        usage=SimpleNamespace(input_tokens=input_tokens, output_tokens=output_tokens),
+        stop_reason="end_turn",
+    )
+
+class MockMessages:
+    def __init__(self, config: MockModelConfig):
+        self.config = config
+
+    def _start(self, messages, system):
+        self.config.inject_failure(MockRateLimitError("Mock 429: rate limited"))
+        prompt = json.dumps(messages) + json.dumps(system or "")
+        return sample_output(), len(prompt) // self.config.chars_per_token
+
+    def create(self, model, max_tokens, messages, system=None, **kwargs):
+        text, input_tokens = self._start(messages, system)
+        for _ in self.config.chunks(text):
+            pass
+        return mock_message(text, input_tokens, self.config.token_count(text))
+
+    def stream(self, model, max_tokens, messages, system=None, **kwargs):
+        text, input_tokens = self._start(messages, system)
+        return MockMessageStream(self.config, text, input_tokens)
+
+class MockAnthropicClient:
+    def __init__(self, config: MockModelConfig):
+        self.messages = MockMessages(config)
+
+
+# ==== Wiring ====
+def add_mock_arguments(parser):
+    parser.add_argument("--first-chunk-latency", type=float, default=0.3, help="seconds before the first chunk")
+    parser.add_argument("--tokens-per-second", type=float, default=150.0, help="mock generation speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls that fail")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of calls that are throttled")
+
+def config_from_args(args) -> MockModelConfig:
+    return MockModelConfig(
+        first_chunk_latency=args.first_chunk_latency,
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+    )
+
+def install_mocks(main_module, config: MockModelConfig):
+    # Swap every routed backend's client for the matching stand-in
+    for provider in main_module.router.providers:
+        provider.client = MockBedrockClient(config) if provider.name == "nova" else MockAnthropicClient(config)
+    return main_module
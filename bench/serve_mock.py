@@ -0,0 +1,25 @@
+import argparse
+
+import uvicorn
+
+from bench.mock_models import add_mock_arguments, config_from_args, install_mocks
+
+# Runs the FastAPI service with the model stand-ins in place of Bedrock, so
+# external load tools can hit a real HTTP server without paying for tokens.
+#
+#   python -m bench.serve_mock --port 8000 --tokens-per-second 100 --throttle-rate 0.05
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the lens selector with mock model backends")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+
+    import main as service
+    install_mocks(service, config_from_args(args))
+    uvicorn.run(service.app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
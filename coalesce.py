@@ -0,0 +1,146 @@
+from typing import Optional
+import asyncio
+import json
+import time
+
+# Identical lens requests that arrive while one is being answered share that
+# answer instead of each starting a model call. The first request's work runs
+# as its own task, so the others aren't cut off if the first client goes
+# away; followers get the same response, or replay the same stream events
+# from the beginning. Successful answers stay for a short window to serve
+# late retries. An Idempotency-Key pins a request to its answer for longer,
+# and reusing a key with a different body is refused.
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+class Flight:
+    # One shared answer. head is (status, body, headers) for a plain response,
+    # or STREAM once events follow; events are replayed to every subscriber.
+
+    STREAM = "stream"
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.head = None
+        self.events = []
+        self.done = False
+        self.ok = True
+        self.finished_at = None
+        self.task = None
+        self.wakeup = asyncio.Event()
+
+    def _notify(self):
+        self.wakeup.set()
+        self.wakeup = asyncio.Event()
+
+    def respond(self, status: int, body: bytes, headers: dict):
+        # Only successes are kept for retries; an error is shared with the
+        # requests already waiting and then forgotten
+        self.head = (status, body, headers)
+        self.ok = status < 300
+        self._notify()
+
+    def start_stream(self):
+        self.head = self.STREAM
+        self._notify()
+
+    def publish(self, event):
+        self.events.append(event)
+        self._notify()
+
+    def fail(self):
+        self.ok = False
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    async def wait_head(self):
+        while self.head is None and not self.done:
+            await self.wakeup.wait()
+        return self.head
+
+    async def replay(self):
+        sent = 0
+        while True:
+            while sent < len(self.events):
+                yield self.events[sent]
+                sent += 1
+            if self.done:
+                return
+            await self.wakeup.wait()
+
+
+class Coalescer:
+    def __init__(self, window: float = 30.0, idempotency_ttl: float = 600.0, max_entries: int = 10000):
+        self.window = window
+        self.idempotency_ttl = idempotency_ttl
+        self.max_entries = max_entries
+        self.flights = {}  # request fingerprint key -> Flight, in flight or recently answered
+        self.keys = {}  # idempotency key -> Flight
+        self.counters = {"leaders": 0, "coalesced": 0, "replayed": 0, "conflicts": 0}
+        self.purged_at = 0.0
+
+    def join(self, key: Optional[str], fingerprint: str, idempotency_key: Optional[str], start):
+        # Returns (flight, role). role is "leader" when this call started
+        # start(flight), "coalesced" when it joined one still running, or
+        # "replayed" when it got a finished answer. key None skips matching
+        # on content, so only the idempotency key can join requests.
+        self.purge()
+        flight = self.keys.get(idempotency_key) if idempotency_key is not None else None
+        if flight is not None and flight.fingerprint != fingerprint:
+            self.counters["conflicts"] += 1
+            raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+        if flight is None and key is not None:
+            flight = self.flights.get(key)
+
+        if flight is None:
+            role = "leader"
+            flight = Flight(fingerprint)
+            if key is not None and len(self.flights) < self.max_entries:
+                self.flights[key] = flight
+            flight.task = asyncio.get_running_loop().create_task(self._drive(key, flight, start))
+        else:
+            role = "replayed" if flight.done else "coalesced"
+        if idempotency_key is not None and len(self.keys) < self.max_entries:
+            self.keys[idempotency_key] = flight
+        self.counters["leaders" if role == "leader" else role] += 1
+        return flight, role
+
+    async def _drive(self, key, flight, start):
+        try:
+            await start(flight)
+        except Exception as e:
+            if flight.head is None:
+                flight.respond(500, json.dumps({"error": f"Request failed: {e}"}).encode(), {})
+            flight.fail()
+        finally:
+            flight.finish()
+            if not flight.ok:
+                # Retries of a failed request run again
+                if key is not None and self.flights.get(key) is flight:
+                    del self.flights[key]
+                for idempotency_key in [k for k, other in self.keys.items() if other is flight]:
+                    del self.keys[idempotency_key]
+
+    def purge(self):
+        now = time.monotonic()
+        if now - self.purged_at < 1.0:
+            return
+        self.purged_at = now
+        for key in [k for k, flight in self.flights.items() if flight.done and flight.finished_at + self.window < now]:
+            del self.flights[key]
+        for key in [k for k, flight in self.keys.items() if flight.done and flight.finished_at + self.idempotency_ttl < now]:
+            del self.keys[key]
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "in_flight": sum(1 for flight in self.flights.values() if not flight.done),
+            "retained": sum(1 for flight in self.flights.values() if flight.done),
+            "idempotency_keys": len(self.keys),
+        }
@@ -0,0 +1,302 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import sys
+import threading
+
+from lens_cache import LensCache
+from lens_rules import SIGNALS
+from semantic_cache import STOPWORDS
+from startup import timed_import
+
+# Pitch decks in, Idea fields out. pdfplumber is CPU-bound, so pages are
+# parsed in a process pool a few at a time and handed back in order as each
+# range finishes; a page's text is cached under the file's hash, so a
+# re-upload or a retry after a dropped connection parses nothing twice. The
+# summary is extractive and keyword-driven like lens_rules: no model call
+# before lens selection.
+#
+#   python deck_ingest.py decks/*.pdf --study-id s1 --stage idea > ideas.jsonl
+#   python batch_score.py ideas.jsonl results.jsonl
+
+MAX_PDF_BYTES = int(os.environ.get("DECK_MAX_BYTES", str(20 * 1024 * 1024)))
+MAX_PAGES = int(os.environ.get("DECK_MAX_PAGES", "40"))
+MAX_PAGE_CHARS = int(os.environ.get("DECK_MAX_PAGE_CHARS", "8000"))
+PAGES_PER_TASK = int(os.environ.get("DECK_PAGES_PER_TASK", "4"))
+DECK_WORKERS = int(os.environ.get("DECK_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+MAX_TITLE_CHARS = 120
+MAX_DESCRIPTION_CHARS = 600
+DESCRIPTION_SENTENCES = 3
+MAX_TAGS = 6
+HASH_BLOCK = 1024 * 1024
+
+
+class DeckError(Exception):
+    # Not a readable PDF, or past one of the limits; status is the HTTP code to answer with
+    def __init__(self, message, status=422):
+        super().__init__(message)
+        self.status = status
+
+
+# ==== Extraction (runs in the process pool) ====
+def count_pages(path: str) -> int:
+    pdfplumber = timed_import("pdfplumber")
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+def extract_page_range(path: str, start: int, stop: int, max_chars: int):
+    # Returns [(page number, text)] for pages start..stop-1. Each page's parsed
+    # objects are released before the next one, so a worker holds one page at a time.
+    pdfplumber = timed_import("pdfplumber")
+    pages = []
+    with pdfplumber.open(path) as pdf:
+        for index in range(start, stop):
+            page = pdf.pages[index]
+            try:
+                text = page.extract_text() or ""
+            finally:
+                page.close()
+            pages.append((index + 1, text[:max_chars]))
+    return pages
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# ==== Ingestion ====
+class DeckIngestor:
+    # Owns the parsing pool and the page cache. The pool starts on first use,
+    # so importing this costs no worker processes.
+
+    def __init__(self, max_workers: int = DECK_WORKERS, max_bytes: int = MAX_PDF_BYTES, max_pages: int = MAX_PAGES,
+                 max_page_chars: int = MAX_PAGE_CHARS, pages_per_task: int = PAGES_PER_TASK,
+                 cache: Optional[LensCache] = None):
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.max_page_chars = max_page_chars
+        self.pages_per_task = max(1, pages_per_task)
+        self.cache = cache if cache is not None else LensCache(max_entries=2048, ttl_seconds=7 * 86400)
+        self.pool = None
+        self.lock = threading.Lock()
+        self.counters = {"decks": 0, "pages_parsed": 0, "pages_cached": 0, "rejected": 0}
+
+    def executor(self):
+        with self.lock:
+            if self.pool is None:
+                # Not fork: the service has model and event-loop threads running,
+                # and a forked child would inherit their locks mid-use
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self.pool = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context(method)
+                )
+            return self.pool
+
+    def incr(self, counter: str, amount: int = 1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def reject(self, message, status=422):
+        self.incr("rejected")
+        return DeckError(message, status)
+
+    async def iter_pages(self, path: str):
+        # Yields (page number, text) in page order. Cached pages come straight
+        # back; the rest are parsed in ranges of pages_per_task, all submitted
+        # up front so the pool works ahead of the consumer.
+        loop = asyncio.get_running_loop()
+        size = os.path.getsize(path)
+        if size > self.max_bytes:
+            raise self.reject(f"Deck too large: {size} bytes > {self.max_bytes}", 413)
+        digest = await loop.run_in_executor(None, file_hash, path)
+
+        # The page cache may be SQLite-backed, so it is read and written off the loop
+        page_count = await loop.run_in_executor(None, self.cache.get, f"deck:{digest}:pages")
+        if page_count is None:
+            try:
+                page_count = await loop.run_in_executor(self.executor(), count_pages, path)
+            except Exception as e:
+                raise self.reject(f"Could not read PDF: {e}")
+        if page_count > self.max_pages:
+            raise self.reject(f"Deck has too many pages: {page_count} > {self.max_pages}", 413)
+        await loop.run_in_executor(None, self.cache.set, f"deck:{digest}:pages", page_count)
+        self.incr("decks")
+
+        cached = await loop.run_in_executor(None, self.cached_pages, digest, page_count)
+        tasks = {}
+        for start in range(0, page_count, self.pages_per_task):
+            stop = min(start + self.pages_per_task, page_count)
+            if all(page_no in cached for page_no in range(start + 1, stop + 1)):
+                continue
+            tasks[start] = loop.run_in_executor(
+                self.executor(), extract_page_range, path, start, stop, self.max_page_chars
+            )
+
+        try:
+            for start in range(0, page_count, self.pages_per_task):
+                if start in tasks:
+                    try:
+                        parsed = await tasks.pop(start)
+                    except Exception as e:
+                        raise self.reject(f"Could not read PDF page {start + 1}: {e}")
+                    self.incr("pages_parsed", len(parsed))
+                    await loop.run_in_executor(None, self.remember_pages, digest, parsed)
+                    cached.update(parsed)
+                else:
+                    self.incr("pages_cached", min(self.pages_per_task, page_count - start))
+                for page_no in range(start + 1, min(start + self.pages_per_task, page_count) + 1):
+                    yield page_no, cached.pop(page_no)
+        finally:
+            # Consumer stopped early (client gone, error): don't parse the rest
+            for task in tasks.values():
+                task.cancel()
+
+    def cached_pages(self, digest: str, page_count: int) -> dict:
+        cached = {}
+        for page_no in range(1, page_count + 1):
+            text = self.cache.get(f"deck:{digest}:{page_no}")
+            if text is not None:
+                cached[page_no] = text
+        return cached
+
+    def remember_pages(self, digest: str, parsed) -> None:
+        for page_no, text in parsed:
+            self.cache.set(f"deck:{digest}:{page_no}", text)
+
+    async def ingest(self, path: str) -> dict:
+        pages = [text async for _, text in self.iter_pages(path)]
+        return summarize_deck(pages)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown(wait=False, cancel_futures=True)
+                self.pool = None
+
+
+# ==== Summary ====
+# Sentences that say what the company does carry these words
+CUE_WORDS = {
+    "problem", "solution", "help", "helps", "enable", "enables", "platform", "customers", "users", "market",
+    "build", "building", "mission", "simple", "save", "saves", "reduce", "reduces", "without",
+}
+BOILERPLATE = re.compile(r"confidential|all rights reserved|copyright|©|www\.|https?://|@", re.IGNORECASE)
+
+def deck_lines(text: str) -> List[str]:
+    return [" ".join(line.split()) for line in text.splitlines() if line.strip()]
+
+def candidate_sentences(pages: List[str]):
+    # (page index, sentence) for every statement long enough to describe something
+    for page_index, text in enumerate(pages):
+        for sentence in re.split(r"(?<=[.!?])\s+", "\n".join(deck_lines(text))):
+            for part in sentence.split("\n"):
+                part = part.strip(" -•*·")
+                if 6 <= len(part.split()) <= 60 and not BOILERPLATE.search(part):
+                    yield page_index, part
+
+def keyword_counts(text: str) -> Counter:
+    padded = " " + " ".join(re.findall(r"[a-z0-9\-]+", text.lower())) + " "
+    return Counter({
+        keyword: padded.count(f" {keyword} ")
+        for keywords in SIGNALS.values() for keyword in keywords
+        if f" {keyword} " in padded
+    })
+
+def deck_title(pages: List[str]) -> str:
+    # Cover slide: the first line, plus the tagline when the first line is just a name
+    for text in pages[:2]:
+        lines = [line for line in deck_lines(text) if not BOILERPLATE.search(line)]
+        if not lines:
+            continue
+        title = lines[0]
+        if len(title.split()) <= 3 and len(lines) > 1 and len(lines[1].split()) <= 12:
+            title = f"{title}: {lines[1]}"
+        return title[:MAX_TITLE_CHARS]
+    return "Untitled deck"
+
+def deck_description(pages: List[str]) -> str:
+    scored = []
+    for order, (page_index, sentence) in enumerate(candidate_sentences(pages)):
+        words = {word.lower() for word in re.findall(r"[A-Za-z]+", sentence)}
+        score = 2 * len(words & CUE_WORDS) + sum(keyword_counts(sentence).values()) + 1.0 / (1 + page_index)
+        scored.append((score, order, sentence))
+    best = sorted(sorted(scored, reverse=True)[:DESCRIPTION_SENTENCES], key=lambda item: item[1])
+    description = " ".join(sentence if sentence[-1] in ".!?" else sentence + "." for _, _, sentence in best)
+    if len(description) > MAX_DESCRIPTION_CHARS:
+        description = description[:MAX_DESCRIPTION_CHARS].rsplit(" ", 1)[0] + "..."
+    return description
+
+def deck_tags(pages: List[str]) -> List[str]:
+    # Signal keywords first, since those are what lens_rules and the model key
+    # on; frequent content words fill the rest
+    text = "\n".join(pages)
+    tags = [keyword for keyword, _ in keyword_counts(text).most_common(MAX_TAGS)]
+    if len(tags) < MAX_TAGS:
+        words = Counter(
+            word for word in re.findall(r"[a-z][a-z\-]+", text.lower())
+            if len(word) > 3 and word not in STOPWORDS and word not in CUE_WORDS
+        )
+        for word, count in words.most_common():
+            if len(tags) >= MAX_TAGS or count < 2:
+                break
+            if word not in tags:
+                tags.append(word)
+    return tags
+
+def summarize_deck(pages: List[str]) -> dict:
+    # Idea fields (title, description, tags) for LensSelectorRequest
+    pages = [text for text in pages if text.strip()]
+    if not pages:
+        raise DeckError("No extractable text in deck (scanned images are not supported)")
+    return {"title": deck_title(pages), "description": deck_description(pages), "tags": deck_tags(pages)}
+
+
+# ==== CLI ====
+async def ingest_many(paths, study_id, stage, ingestor):
+    # Decks run concurrently; the shared pool bounds the parsing
+    async def one(path):
+        try:
+            idea = await ingestor.ingest(path)
+        except DeckError as e:
+            return {"file": path, "error": str(e)}
+        return {"studyId": study_id, "idea": idea, "stage": stage, "file": path}
+    return await asyncio.gather(*(one(path) for path in paths))
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Extract lens-selector requests from PDF pitch decks")
+    parser.add_argument("decks", nargs="+")
+    parser.add_argument("--study-id", default="decks")
+    parser.add_argument("--stage", default="idea")
+    parser.add_argument("--workers", type=int, default=DECK_WORKERS)
+    args = parser.parse_args()
+
+    ingestor = DeckIngestor(max_workers=args.workers)
+    try:
+        rows = asyncio.run(ingest_many(args.decks, args.study_id, args.stage, ingestor))
+    finally:
+        ingestor.shutdown()
+    for row in rows:
+        if "error" in row:
+            print(f"{row['file']}: {row['error']}", file=sys.stderr)
+        else:
+            print(json.dumps(row))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+from typing import Optional
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+# Persistent queue for lens analyses submitted through the job API. Jobs live
+# in SQLite so a restart loses nothing. Several processes may share the file,
+# so a claim is a conditional UPDATE that only one of them can win, and a
+# running job holds a lease its process renews with heartbeat(); a job whose
+# lease ran out (its process died) goes back to the queue via reclaim_stale().
+# Workers claim the highest priority first and, within a priority, the study
+# with the fewest jobs already running, so one study's burst can't hold every
+# worker.
+
+STATUSES = ("queued", "running", "done", "failed")
+
+
+class QueueFull(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobQueue:
+    def __init__(self, db_path: str = ":memory:", max_queued: int = 10000, max_queued_per_study: int = 500,
+                 max_running_per_study: int = 4, retention_seconds: float = 86400, lease_seconds: float = 300):
+        self.max_queued = max_queued
+        self.max_queued_per_study = max_queued_per_study
+        self.max_running_per_study = max_running_per_study
+        self.retention_seconds = retention_seconds
+        self.lease_seconds = lease_seconds
+        self.claimed = set()  # jobs this instance is running, kept alive by heartbeat()
+        self.lock = threading.Lock()
+        self.counters = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "recovered": 0}
+
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS lens_jobs ("
+            "id TEXT PRIMARY KEY, study_id TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "status TEXT NOT NULL, payload TEXT NOT NULL, result TEXT, error TEXT, "
+            "webhook_url TEXT, webhook_status TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, heartbeat_at REAL)"
+        )
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(lens_jobs)")}
+        if "heartbeat_at" not in columns:
+            self.db.execute("ALTER TABLE lens_jobs ADD COLUMN heartbeat_at REAL")
+        self.db.execute("CREATE INDEX IF NOT EXISTS lens_jobs_queue ON lens_jobs (status, priority, created_at)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS lens_jobs_study ON lens_jobs (study_id, status)")
+        self.db.commit()
+
+    def heartbeat(self) -> int:
+        # Renews the lease on every job this instance is running
+        with self.lock:
+            if not self.claimed:
+                return 0
+            claimed = list(self.claimed)
+            self.db.execute(
+                f"UPDATE lens_jobs SET heartbeat_at = ? WHERE status = 'running' "
+                f"AND id IN ({', '.join('?' for _ in claimed)})",
+                (time.time(), *claimed),
+            )
+            self.db.commit()
+            return len(claimed)
+
+    def reclaim_stale(self) -> int:
+        # Running jobs whose lease lapsed belong to a process that is gone;
+        # they are queued again. Jobs a live process is running are left alone.
+        with self.lock:
+            cursor = self.db.execute(
+                "UPDATE lens_jobs SET status = 'queued', started_at = NULL, heartbeat_at = NULL "
+                "WHERE status = 'running' AND COALESCE(heartbeat_at, started_at, 0) < ?",
+                (time.time() - self.lease_seconds,),
+            )
+            self.db.commit()
+            reclaimed = max(cursor.rowcount, 0)
+            self.counters["recovered"] += reclaimed
+            return reclaimed
+
+    def submit(self, study_id: str, payload: dict, priority: int = 0, webhook_url: Optional[str] = None) -> dict:
+        now = time.time()
+        with self.lock:
+            queued = self.db.execute("SELECT COUNT(*) FROM lens_jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                self.counters["rejected"] += 1
+                raise QueueFull(f"Job queue is full ({queued} queued)", self._retry_after(queued))
+            study_queued = self.db.execute(
+                "SELECT COUNT(*) FROM lens_jobs WHERE study_id = ? AND status = 'queued'", (study_id,)
+            ).fetchone()[0]
+            if study_queued >= self.max_queued_per_study:
+                self.counters["rejected"] += 1
+                raise QueueFull(
+                    f"Too many queued jobs for study {study_id} ({study_queued})", self._retry_after(study_queued)
+                )
+
+            job_id = uuid.uuid4().hex
+            self.db.execute(
+                "INSERT INTO lens_jobs (id, study_id, priority, status, payload, webhook_url, created_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, study_id, priority, json.dumps(payload), webhook_url, now),
+            )
+            self.db.commit()
+            self.counters["submitted"] += 1
+        return {"jobId": job_id, "studyId": study_id, "status": "queued", "priority": priority, "queued": queued + 1}
+
+    def _retry_after(self, depth):
+        # Rough drain time, clamped so clients neither spin nor give up
+        return int(min(60, max(1, depth // 50)))
+
+    def claim(self) -> Optional[dict]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT j.id FROM lens_jobs j "
+                "LEFT JOIN (SELECT study_id, COUNT(*) AS running FROM lens_jobs "
+                "           WHERE status = 'running' GROUP BY study_id) r ON r.study_id = j.study_id "
+                "WHERE j.status = 'queued' AND COALESCE(r.running, 0) < ? "
+                "ORDER BY j.priority DESC, COALESCE(r.running, 0) ASC, j.created_at ASC LIMIT 1",
+                (self.max_running_per_study,),
+            ).fetchone()
+            if row is None:
+                return None
+            # Another process may have taken the row since the SELECT; only one UPDATE wins
+            now = time.time()
+            cursor = self.db.execute(
+                "UPDATE lens_jobs SET status = 'running', started_at = ?, heartbeat_at = ?, attempts = attempts + 1 "
+                "WHERE id = ? AND status = 'queued'",
+                (now, now, row[0]),
+            )
+            self.db.commit()
+            if cursor.rowcount != 1:
+                return None
+            self.claimed.add(row[0])
+            return self._get(row[0])
+
+    def release(self, job_id: str) -> None:
+        # Puts a claimed job back, e.g. when it was rate limited
+        with self.lock:
+            self.claimed.discard(job_id)
+            self.db.execute(
+                "UPDATE lens_jobs SET status = 'queued', started_at = NULL, heartbeat_at = NULL "
+                "WHERE id = ? AND status = 'running'",
+                (job_id,),
+            )
+            self.db.commit()
+
+    def complete(self, job_id: str, result) -> None:
+        self._finish(job_id, "done", result=json.dumps(result))
+        with self.lock:
+            self.counters["completed"] += 1
+
+    def fail(self, job_id: str, error: str) -> None:
+        self._finish(job_id, "failed", error=error)
+        with self.lock:
+            self.counters["failed"] += 1
+
+    def _finish(self, job_id, status, result=None, error=None):
+        with self.lock:
+            self.claimed.discard(job_id)
+            self.db.execute(
+                "UPDATE lens_jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (status, result, error, time.time(), job_id),
+            )
+            self.db.commit()
+
+    def set_webhook_status(self, job_id: str, webhook_status: str) -> None:
+        with self.lock:
+            self.db.execute("UPDATE lens_jobs SET webhook_status = ? WHERE id = ?", (webhook_status, job_id))
+            self.db.commit()
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self.lock:
+            return self._get(job_id)
+
+    def _get(self, job_id):
+        row = self.db.execute(
+            "SELECT id, study_id, priority, status, payload, result, error, webhook_url, webhook_status, "
+            "attempts, created_at, started_at, finished_at FROM lens_jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        return self._to_job(row) if row is not None else None
+
+    def list_study(self, study_id: str, limit: int = 100) -> list:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT id, study_id, priority, status, payload, result, error, webhook_url, webhook_status, "
+                "attempts, created_at, started_at, finished_at FROM lens_jobs "
+                "WHERE study_id = ? ORDER BY created_at DESC LIMIT ?",
+                (study_id, limit),
+            ).fetchall()
+        return [self._to_job(row) for row in rows]
+
+    def _to_job(self, row):
+        (job_id, study_id, priority, status, payload, result, error, webhook_url, webhook_status,
+         attempts, created_at, started_at, finished_at) = row
+        job = {
+            "jobId": job_id,
+            "studyId": study_id,
+            "priority": priority,
+            "status": status,
+            "payload": json.loads(payload),
+            "attempts": attempts,
+            "createdAt": created_at,
+            "startedAt": started_at,
+            "finishedAt": finished_at,
+        }
+        if result is not None:
+            job["result"] = json.loads(result)
+        if error is not None:
+            job["error"] = error
+        if webhook_url:
+            job["webhookUrl"] = webhook_url
+            job["webhookStatus"] = webhook_status
+        return job
+
+    def purge(self) -> int:
+        # Drops finished jobs past the retention window
+        with self.lock:
+            cursor = self.db.execute(
+                "DELETE FROM lens_jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                (time.time() - self.retention_seconds,),
+            )
+            self.db.commit()
+            return max(cursor.rowcount, 0)
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            counts = dict(self.db.execute("SELECT status, COUNT(*) FROM lens_jobs GROUP BY status").fetchall())
+            oldest = self.db.execute("SELECT MIN(created_at) FROM lens_jobs WHERE status = 'queued'").fetchone()[0]
+        for status in STATUSES:
+            stats[status] = counts.get(status, 0)
+        stats["oldest_queued_age_s"] = round(time.time() - oldest, 1) if oldest is not None else 0.0
+        return stats
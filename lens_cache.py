@@ -0,0 +1,154 @@
+from collections import OrderedDict
+from typing import List, Optional
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+# ==== Cache Key ====
+def normalize_text(text: str) -> str:
+    return " ".join(text.split()).lower()
+
+def cache_key(title: str, description: str, tags: List[str], stage: str, prompt_version: str, model_id: str) -> str:
+    # Whitespace, case and tag order don't change the prompt's meaning, so they
+    # shouldn't change the key either.
+    normalized = {
+        "title": normalize_text(title),
+        "description": normalize_text(description),
+        "tags": sorted({normalize_text(tag) for tag in tags if tag.strip()}),
+        "stage": normalize_text(stage),
+        "prompt_version": prompt_version,
+        "model_id": model_id,
+    }
+    encoded = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+# ==== Two-Tier Cache ====
+class LensCache:
+    # In-memory LRU in front of an optional SQLite table. Entries expire after
+    # ttl_seconds; both tiers evict least-recently-used entries past their size
+    # limit. The table's row count is kept alongside (counted once on open), so
+    # writes and stats don't scan it; once it passes max_disk_entries the
+    # oldest tenth goes in one indexed delete.
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 86400,
+                 db_path: Optional[str] = None, max_disk_entries: int = 100000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "sets": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expirations": 0,
+        }
+
+        self.db = None
+        self.disk_entries = 0
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS lens_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self.db.execute("CREATE INDEX IF NOT EXISTS lens_cache_accessed ON lens_cache (accessed_at)")
+            self.db.commit()
+            self.disk_entries = self._count()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return value
+                del self.memory[key]
+                self.counters["expirations"] += 1
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT value, expires_at FROM lens_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    if row[1] > now:
+                        self.db.execute("UPDATE lens_cache SET accessed_at = ? WHERE key = ?", (now, key))
+                        self.db.commit()
+                        value = json.loads(row[0])
+                        self._remember(key, row[1], value)
+                        self.counters["disk_hits"] += 1
+                        return value
+                    cursor = self.db.execute("DELETE FROM lens_cache WHERE key = ?", (key,))
+                    self.db.commit()
+                    self.disk_entries -= max(cursor.rowcount, 0)
+                    self.counters["expirations"] += 1
+
+            self.counters["misses"] += 1
+            return None
+
+    def set(self, key: str, value) -> None:
+        now = time.time()
+        expires_at = now + self.ttl_seconds
+        with self.lock:
+            self._remember(key, expires_at, value)
+            self.counters["sets"] += 1
+            if self.db is not None:
+                encoded = json.dumps(value)
+                cursor = self.db.execute(
+                    "INSERT OR IGNORE INTO lens_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, encoded, expires_at, now),
+                )
+                if cursor.rowcount > 0:
+                    self.disk_entries += 1
+                else:
+                    self.db.execute(
+                        "UPDATE lens_cache SET value = ?, expires_at = ?, accessed_at = ? WHERE key = ?",
+                        (encoded, expires_at, now, key),
+                    )
+                if self.disk_entries > self.max_disk_entries:
+                    self._evict_disk()
+                self.db.commit()
+
+    def _evict_disk(self):
+        # Called with the lock held. Recounts afterwards, which also picks up
+        # rows other processes sharing the file added or removed.
+        target = self.max_disk_entries - self.max_disk_entries // 10
+        cursor = self.db.execute(
+            "DELETE FROM lens_cache WHERE key IN ("
+            "SELECT key FROM lens_cache ORDER BY accessed_at LIMIT ?)",
+            (max(self.disk_entries - target, 1),),
+        )
+        self.counters["disk_evictions"] += max(cursor.rowcount, 0)
+        self.disk_entries = self._count()
+
+    def _count(self):
+        return self.db.execute("SELECT COUNT(*) FROM lens_cache").fetchone()[0]
+
+    def _remember(self, key, expires_at, value):
+        self.memory[key] = (expires_at, value)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+            self.counters["memory_evictions"] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            stats["memory_entries"] = len(self.memory)
+            if self.db is not None:
+                stats["disk_entries"] = self.disk_entries
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((stats["memory_hits"] + stats["disk_hits"]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,58 @@
+from typing import Callable, Dict, List
+import re
+
+from lens_parser import REQUIRED_FIELDS, extract_lens_objects, usable_lenses
+
+# Multi-idea packing: several ideas share one model call (and one copy of the
+# fixed prompt). The model answers with a JSON object keyed by idea id, which
+# is split back into per-idea rankings. Lenses missing from an idea's answer
+# are left for the caller to ask for on their own.
+
+PACKED_OUTPUT_INSTRUCTIONS = """
+The user message lists several startups, each with an id. Rank the 4 lenses
+separately for every startup. Return ONLY a JSON object whose keys are the
+startup ids and whose values are that startup's 4-entry array in the format
+above, e.g. {"idea-1": [...], "idea-2": [...]}.
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token is close enough for budgeting
+    return len(text) // 4 + 1
+
+def pack_groups(items: List, max_items: int, token_budget: int, cost: Callable) -> List[List]:
+    # Greedy, order-preserving grouping under an item count and token budget.
+    # An item that alone exceeds the budget still gets a group of its own.
+    groups, current, used = [], [], 0
+    for item in items:
+        item_cost = cost(item)
+        if current and (len(current) >= max_items or used + item_cost > token_budget):
+            groups.append(current)
+            current, used = [], 0
+        current.append(item)
+        used += item_cost
+    if current:
+        groups.append(current)
+    return groups
+
+def format_packed_ideas(blocks: Dict[str, str]) -> str:
+    return "\n".join(f"### Startup id: {idea_id}\n{block.strip()}\n" for idea_id, block in blocks.items())
+
+def split_packed_output(raw_output: str, ids: List[str], required_fields=REQUIRED_FIELDS) -> Dict[str, list]:
+    # Usable lens entries per idea: the whole ranking, the lenses that came
+    # through complete (the rest can be asked for on their own), or [] when
+    # the idea needs a call of its own. Each idea's array is parsed from its
+    # key up to the next idea's key, so a truncated or broken entry only
+    # costs that idea the lenses it damaged.
+    found = []
+    for idea_id in ids:
+        match = re.search(rf'"{re.escape(idea_id)}"\s*:', raw_output)
+        if match:
+            found.append((match.start(), match.end(), idea_id))
+    found.sort()
+
+    results = {idea_id: [] for idea_id in ids}
+    for n, (_, end, idea_id) in enumerate(found):
+        stop = found[n + 1][0] if n + 1 < len(found) else len(raw_output)
+        results[idea_id], _ = usable_lenses(extract_lens_objects(raw_output[end:stop]), required_fields)
+    return results
@@ -0,0 +1,180 @@
+import json
+import os
+
+
+# ==== Incremental Lens Array Parser ====
+class LensArrayParser:
+    # Scans model output as it streams in and hands back each top-level object
+    # of the JSON array as soon as its closing brace arrives, so callers don't
+    # have to wait for the whole array before using the first lens. Anything
+    # around the array (markdown fences, prose, a wrapping object) is skipped,
+    # and objects completed before a truncation are kept.
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.obj_start = None
+        self.started = False
+        self.done = False
+        self.objects = []
+
+    def feed(self, text):
+        if self.done or not text:
+            return []
+        self.buffer += text
+        found = []
+        i = self.pos
+        while i < len(self.buffer):
+            ch = self.buffer[i]
+            if not self.started:
+                if ch == "[":
+                    # Only "[{" or "[]" opens the array; "[" in prose doesn't
+                    j = i + 1
+                    while j < len(self.buffer) and self.buffer[j].isspace():
+                        j += 1
+                    if j == len(self.buffer):
+                        break  # wait for the next chunk to decide
+                    if self.buffer[j] in "{]":
+                        self.started = True
+                        self.depth = 1
+                i += 1
+                continue
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                if self.depth == 1 and ch == "{":
+                    self.obj_start = i
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if self.depth == 1 and self.obj_start is not None:
+                    obj = self._decode(self.buffer[self.obj_start:i + 1])
+                    if obj is not None:
+                        found.append(obj)
+                    # Drop everything already consumed to keep the buffer small
+                    self.buffer = self.buffer[i + 1:]
+                    self.obj_start = None
+                    i = 0
+                    continue
+                if self.depth == 0:
+                    self.done = True
+                    self.buffer = ""
+                    i = 0
+                    break
+            i += 1
+        self.pos = i
+        self.objects.extend(found)
+        return found
+
+    def _decode(self, text):
+        try:
+            obj = json.loads(text)
+        except json.JSONDecodeError:
+            return None
+        return obj if isinstance(obj, dict) else None
+
+
+class LensCompletion:
+    # Stop condition for a streamed ranking: true once each expected lens has
+    # a usable entry, or the array has closed. Anything after that point is
+    # prose the caller would discard anyway.
+
+    def __init__(self, required_fields=None, lenses=None):
+        self.parser = LensArrayParser()
+        self.required_fields = required_fields or REQUIRED_FIELDS
+        self.lenses = lenses or LENSES
+
+    def __call__(self, delta):
+        if self.parser.feed(delta):
+            _, missing = usable_lenses(self.parser.objects, self.required_fields)
+            if not any(lens in missing for lens in self.lenses):
+                return True
+        return self.parser.done
+
+
+def extract_lens_objects(text):
+    # Every complete lens object in a finished (possibly malformed) response
+    parser = LensArrayParser()
+    parser.feed(text)
+    return parser.objects
+
+
+# ==== Validation ====
+LENSES = ["SME", "Peer", "Survey", "Social"]
+REQUIRED_FIELDS = ['lens', 'rank', 'reason', 'confidence', 'pros', 'cons', 'stageRelevance']
+
+def validate_lenses(parsed, required_fields=REQUIRED_FIELDS):
+    # Returns a description of the first problem found, or None if the
+    # ranking is a usable 4-lens array.
+    if not isinstance(parsed, list) or len(parsed) != 4:
+        return "Invalid response format - expected array of 4 items"
+    for item in parsed:
+        if not isinstance(item, dict):
+            return "Invalid response format - expected array of 4 items"
+        for field in required_fields:
+            if field not in item:
+                return f"Missing field: {field}"
+    if {item['lens'] for item in parsed} != set(LENSES):
+        return f"Invalid lenses - must be exactly {', '.join(LENSES)}"
+    ranks = [item['rank'] for item in parsed]
+    if not all(isinstance(rank, int) for rank in ranks) or sorted(ranks) != [1, 2, 3, 4]:
+        return "Invalid rankings - must be unique values 1-4"
+    return None
+
+
+# ==== Salvage ====
+# A response cut off at max_tokens or with a broken entry usually still holds
+# a few good lenses. Keeping them and asking the model for just the missing
+# ones is much cheaper than regenerating the whole ranking.
+def usable_lenses(objects, required_fields=REQUIRED_FIELDS):
+    # Returns (kept, missing): the first complete entry for each lens, and
+    # the lens names still needed. Kept ranks are unique ints in 1-4.
+    kept, ranks = [], set()
+    for item in objects:
+        if not isinstance(item, dict) or item.get("lens") not in LENSES:
+            continue
+        if any(field not in item for field in required_fields):
+            continue
+        rank = item["rank"]
+        if not isinstance(rank, int) or rank not in (1, 2, 3, 4) or rank in ranks:
+            continue
+        if any(existing["lens"] == item["lens"] for existing in kept):
+            continue
+        kept.append(item)
+        ranks.add(rank)
+    found = {item["lens"] for item in kept}
+    return kept, [lens for lens in LENSES if lens not in found]
+
+# Follow-up calls for lenses missing from a truncated answer are sized per lens
+FOLLOWUP_TOKENS_PER_LENS = int(os.environ.get("FOLLOWUP_TOKENS_PER_LENS", "350"))
+
+def followup_request(kept, missing):
+    # Text appended to the original user message to get only the missing lenses
+    taken = ", ".join(f"{item['lens']} (rank {item['rank']})" for item in sorted(kept, key=lambda x: x["rank"]))
+    free = sorted({1, 2, 3, 4} - {item["rank"] for item in kept})
+    return f"""
+Part of this analysis is already done. These lenses are ranked: {taken}.
+Return ONLY a JSON array with entries for the remaining lenses ({', '.join(missing)}),
+in the same format, using the remaining ranks {', '.join(str(rank) for rank in free)}.
+"""
+
+def merge_lenses(kept, followup_output, required_fields=REQUIRED_FIELDS):
+    # Combines salvaged lenses with a follow-up answer; None if still incomplete
+    _, missing = usable_lenses(kept, required_fields)
+    extra, _ = usable_lenses(
+        [item for item in extract_lens_objects(followup_output) if isinstance(item, dict) and item.get("lens") in missing],
+        required_fields,
+    )
+    merged = sorted(kept + extra, key=lambda item: item["rank"])
+    return merged if validate_lenses(merged, required_fields) is None else None
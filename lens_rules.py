@@ -0,0 +1,176 @@
+from typing import List
+import re
+
+# Local, deterministic lens ranking. Encodes the per-stage ranking logic from
+# the Streamlit prompt (app.py build_prompt) as keyword signals so obvious
+# ideas can be ranked without a model call, and so there is still an answer
+# when the model is unavailable.
+
+LENSES = ["SME", "Peer", "Survey", "Social"]
+
+# main.py's API uses short stage names; app.py uses the full stage labels
+STAGE_ALIASES = {
+    "idea": "IDEATION & PLANNING",
+    "ideation": "IDEATION & PLANNING",
+    "prototype": "PROTOTYPE DEVELOPMENT",
+    "beta": "VALIDATION & ITERATION",
+    "validation": "VALIDATION & ITERATION",
+    "launch": "LAUNCH & SCALING",
+    "growth": "GROWTH & OPTIMIZATION",
+}
+
+# ==== Keyword Signals ====
+SIGNALS = {
+    "technical": ["ai", "ml", "machine learning", "deep tech", "hardware", "biotech", "blockchain", "robotics",
+                  "iot", "quantum", "algorithm", "infrastructure", "security", "api", "llm", "computer vision"],
+    "regulated": ["health", "healthtech", "medical", "clinical", "fintech", "finance", "banking", "insurance",
+                  "legal", "compliance", "regulation", "regulated", "pharma", "hipaa", "gdpr"],
+    "business_model": ["marketplace", "b2b", "saas", "subscription", "pricing", "monetization", "business model",
+                       "pivot", "fundraising", "enterprise", "sales", "go-to-market", "gtm", "partnerships"],
+    "consumer": ["consumer", "b2c", "mobile", "app", "retail", "ecommerce", "e-commerce", "parents", "students",
+                 "families", "shoppers", "households"],
+    "trend": ["social", "community", "brand", "fashion", "lifestyle", "creator", "influencer", "gaming",
+              "trend", "viral", "content", "entertainment", "beauty"],
+    "user_experience": ["ux", "user experience", "usability", "onboarding", "interface", "design", "feedback",
+                        "user testing", "navigation"],
+    "competitive": ["competitor", "competitors", "competition", "competitive", "crowded", "alternatives",
+                    "positioning", "differentiation"],
+    "operations": ["operations", "logistics", "supply chain", "automation", "scaling", "scale", "infrastructure",
+                   "manufacturing"],
+    "expansion": ["expansion", "international", "new market", "new markets", "localization", "retention",
+                  "growth"],
+}
+
+# ==== Per-Stage Ranking Logic ====
+# Each stage has a prior (from the prompt's stage context) plus
+# (signal, lens, weight, reason) rules mirroring its CRITICAL RANKING LOGIC.
+STAGE_RULES = {
+    "IDEATION & PLANNING": {
+        "prior": {"SME": 0.6, "Peer": 0.6, "Survey": 0.5, "Social": 0.4},
+        "rules": [
+            ("technical", "SME", 1.0, "technical product needs feasibility validation"),
+            ("regulated", "SME", 1.2, "regulated domain needs expert guidance"),
+            ("business_model", "Peer", 1.0, "business model questions are best answered by founders"),
+            ("consumer", "Survey", 1.0, "large consumer market needs demand validation"),
+            ("trend", "Social", 1.0, "trend/brand dependent market shows up in organic conversations"),
+        ],
+    },
+    "PROTOTYPE DEVELOPMENT": {
+        "prior": {"SME": 0.7, "Peer": 0.5, "Survey": 0.5, "Social": 0.3},
+        "rules": [
+            ("technical", "SME", 1.0, "technical complexity needs development guidance"),
+            ("regulated", "SME", 0.8, "regulated domain constrains the build"),
+            ("user_experience", "Survey", 1.0, "user experience is critical for testing"),
+            ("consumer", "Survey", 0.5, "consumer product benefits from user testing"),
+            ("business_model", "Peer", 1.0, "business model still needs validation"),
+            ("competitive", "Social", 1.0, "active competitive landscape affects positioning"),
+        ],
+    },
+    "VALIDATION & ITERATION": {
+        "prior": {"SME": 0.4, "Peer": 0.3, "Survey": 1.0, "Social": 0.6},
+        "rules": [
+            ("user_experience", "Survey", 0.8, "direct user feedback is critical"),
+            ("consumer", "Survey", 0.5, "consumer product needs structured user feedback"),
+            ("technical", "SME", 0.8, "technical optimization needs advanced insight"),
+            ("business_model", "Peer", 1.0, "business model pivoting needs strategic guidance"),
+            ("competitive", "Social", 0.8, "market positioning unclear, perception matters"),
+            ("trend", "Social", 0.6, "brand perception drives iteration"),
+        ],
+    },
+    "LAUNCH & SCALING": {
+        "prior": {"SME": 0.3, "Peer": 0.9, "Survey": 0.6, "Social": 0.5},
+        "rules": [
+            ("business_model", "Peer", 0.8, "go-to-market execution needs founder experience"),
+            ("consumer", "Survey", 1.0, "market sizing needs demand quantification"),
+            ("trend", "Social", 1.0, "brand building drives awareness"),
+            ("operations", "SME", 1.0, "operational scaling needs infrastructure expertise"),
+            ("regulated", "SME", 0.6, "regulated launch needs compliance expertise"),
+        ],
+    },
+    "GROWTH & OPTIMIZATION": {
+        "prior": {"SME": 0.4, "Peer": 0.5, "Survey": 0.7, "Social": 0.8},
+        "rules": [
+            ("competitive", "Social", 1.0, "competitive intelligence reflects market dynamics"),
+            ("expansion", "Survey", 1.0, "expansion planning needs new market validation"),
+            ("operations", "SME", 1.0, "operational optimization needs advanced systems expertise"),
+            ("business_model", "Peer", 1.0, "strategic pivoting benefits from scaling experience"),
+        ],
+    },
+}
+
+LENS_PROFILES = {
+    "SME": {
+        "pros": ["Deep technical and regulatory validation", "Expert feasibility assessment"],
+        "cons": ["Expert access is slow and costly", "Small sample of opinions"],
+    },
+    "Peer": {
+        "pros": ["Real-world business model and go-to-market experience", "Operational lessons from founders"],
+        "cons": ["Anecdotal and context-dependent", "Founders' situations may not transfer"],
+    },
+    "Survey": {
+        "pros": ["Quantifies demand and preferences", "Scales to many target users"],
+        "cons": ["Depends on reaching the right audience", "Stated intent can differ from behavior"],
+    },
+    "Social": {
+        "pros": ["Organic, unprompted user sentiment", "Competitive and trend signals"],
+        "cons": ["Noisy and hard to attribute", "Skewed toward vocal users"],
+    },
+}
+
+
+def normalize_stage(stage: str):
+    key = stage.strip()
+    if key.upper() in STAGE_RULES:
+        return key.upper()
+    return STAGE_ALIASES.get(key.lower())
+
+def matched_signals(title: str, description: str, tags: List[str]):
+    text = " ".join([title, description, " ".join(tags)]).lower()
+    padded = " " + " ".join(re.findall(r"[a-z0-9\-]+", text)) + " "
+    return {
+        signal for signal, keywords in SIGNALS.items()
+        if any(f" {keyword} " in padded for keyword in keywords)
+    }
+
+# ==== Scoring ====
+def rank_lenses(title: str, description: str, tags: List[str], stage: str):
+    # Returns (lenses, confidence). lenses is None when the stage is unknown.
+    stage_name = normalize_stage(stage)
+    if stage_name is None:
+        return None, 0.0
+
+    stage_rules = STAGE_RULES[stage_name]
+    signals = matched_signals(title, description, tags)
+    scores = dict(stage_rules["prior"])
+    reasons = {lens: [] for lens in LENSES}
+    for signal, lens, weight, reason in stage_rules["rules"]:
+        if signal in signals:
+            scores[lens] += weight
+            reasons[lens].append(reason)
+
+    ordered = sorted(LENSES, key=lambda lens: (-scores[lens], LENSES.index(lens)))
+    matches = sum(len(r) for r in reasons.values())
+    margin = scores[ordered[0]] - scores[ordered[1]]
+    runner_up_margin = scores[ordered[1]] - scores[ordered[2]]
+    # Confident only when the top pick clearly leads and is backed by signals
+    confidence = round(min(0.95, 0.35 + 0.3 * margin + 0.1 * runner_up_margin + 0.05 * min(matches, 3)), 3)
+
+    top_score = scores[ordered[0]] or 1.0
+    lenses = []
+    for rank, lens in enumerate(ordered, start=1):
+        if reasons[lens]:
+            reason = f"Ranked #{rank} for {stage_name}: " + "; ".join(reasons[lens]) + "."
+        else:
+            reason = f"Ranked #{rank} for {stage_name} based on the stage's typical research needs."
+        lenses.append({
+            "lens": lens,
+            "rank": rank,
+            "reason": reason,
+            "confidence": round(min(1.0, confidence * scores[lens] / top_score), 3),
+            "confidenceBasis": "Rule-based ranking from stage priors and matched signals: "
+                               + (", ".join(sorted(signals)) or "none"),
+            "pros": LENS_PROFILES[lens]["pros"],
+            "cons": LENS_PROFILES[lens]["cons"],
+            "stageRelevance": stage_rules["prior"][lens],
+        })
+    return lenses, confidence
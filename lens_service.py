@@ -0,0 +1,267 @@
+from typing import List
+import os
+
+from startup import STARTUP
+from pydantic import BaseModel
+from lens_parser import FOLLOWUP_TOKENS_PER_LENS, LensCompletion, followup_request, merge_lenses, usable_lenses, validate_lenses
+from lens_packing import PACKED_OUTPUT_INSTRUCTIONS, estimate_tokens, pack_groups, format_packed_ideas, split_packed_output
+from lens_cache import LensCache, cache_key
+from lens_rules import normalize_stage, rank_lenses
+with STARTUP.timed("import:semantic_cache"):
+    from semantic_cache import SemanticCache, idea_text
+from model_clients import build_anthropic_client, build_bedrock_client
+from providers import ClaudeProvider, NovaProvider, Prompt, build_output_budget, build_router
+
+# The lens-selection core shared by the API (main.py) and the offline scorer
+# (batch_score.py): request schema, prompts, the routed model calls, packing,
+# and the local answers (response cache, near-duplicate cache, rules).
+# Importing it opens no database files and starts no threads; the job queue,
+# result history and everything else that belongs to the server stays in main.
+
+# Model calls run on a bounded pool (main's model_executor, batch_score's
+# workers); this also sizes the Bedrock connection pool.
+MODEL_MAX_CONCURRENCY = int(os.environ.get("MODEL_MAX_CONCURRENCY", "16"))
+
+# AWS Bedrock config. Keep at least one pooled connection per model worker.
+# The client is built on first use or by warm_up(), not at import.
+def build_bedrock():
+    return build_bedrock_client(
+        "ap-south-1",
+        pool_size=max(MODEL_MAX_CONCURRENCY, int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "50"))),
+    )
+
+inference_profile_arn = "arn:aws:bedrock:ap-south-1:069717477936:inference-profile/apac.amazon.nova-micro-v1:0"
+
+# Model backends, routed to the fastest healthy one. Nova is always available
+# and the only one by default; Claude joins when LENS_PROVIDERS lists it (e.g.
+# "nova,claude") and ANTHROPIC_API_KEY is set.
+# MODEL_HEDGING=1 sends a second request when the first chunk is late.
+CLAUDE_MODEL = os.environ.get("CLAUDE_MODEL", "claude-3-5-sonnet-20241022")
+LENS_PROVIDERS = os.environ.get("LENS_PROVIDERS", "nova").split(",")
+nova = NovaProvider(inference_profile_arn, client_factory=build_bedrock)
+providers = [nova]
+if "claude" in LENS_PROVIDERS and os.environ.get("ANTHROPIC_API_KEY"):
+    providers.append(ClaudeProvider(
+        CLAUDE_MODEL, client_factory=lambda: build_anthropic_client(os.environ["ANTHROPIC_API_KEY"])
+    ))
+router = build_router(providers)
+
+# Bump whenever build_prompt changes so cached rankings from the old prompt are ignored
+PROMPT_VERSION = "2"
+
+# Rule-based rankings at or above this confidence are returned without a model
+# call. Below it the model decides, but the rules still answer if the model fails.
+RULES_CONFIDENCE_THRESHOLD = float(os.environ.get("RULES_CONFIDENCE_THRESHOLD", "0.8"))
+
+# Response cache: memory LRU, plus a SQLite tier when LENS_CACHE_DB is set
+with STARTUP.timed("init:lens_cache"):
+    lens_cache = LensCache(
+        max_entries=int(os.environ.get("LENS_CACHE_SIZE", "1024")),
+        ttl_seconds=float(os.environ.get("LENS_CACHE_TTL", "86400")),
+        db_path=os.environ.get("LENS_CACHE_DB"),
+        max_disk_entries=int(os.environ.get("LENS_CACHE_DISK_SIZE", "100000")),
+    )
+
+# Near-duplicate cache: reuses a stored ranking for a reworded idea at the same
+# stage. A sample of hits is re-run through the model to measure false hits.
+with STARTUP.timed("init:semantic_cache"):
+    semantic_cache = SemanticCache(
+        threshold=float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.75")),
+        max_entries=int(os.environ.get("SEMANTIC_CACHE_SIZE", "10000")),
+        dim=int(os.environ.get("SEMANTIC_CACHE_DIM", "1024")),
+        backend=os.environ.get("SEMANTIC_CACHE_BACKEND", "numpy"),
+        verify_rate=float(os.environ.get("SEMANTIC_CACHE_VERIFY_RATE", "0.05")),
+    )
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "1") == "1"
+
+# ==== Input Schema ====
+class Idea(BaseModel):
+    title: str
+    description: str
+    tags: List[str]
+
+class LensSelectorRequest(BaseModel):
+    studyId: str
+    idea: Idea
+    stage: str  # "idea", "prototype", or "beta"
+
+def request_cache_key(payload: LensSelectorRequest):
+    idea = payload.idea
+    return cache_key(idea.title, idea.description, idea.tags, payload.stage, PROMPT_VERSION, inference_profile_arn)
+
+# ==== Prompt Builder ====
+# The fixed instructions go in a static system block that is identical on
+# every call (so Bedrock can cache it); only the idea fields and stage travel
+# in the per-request user message. The stage has no stage-specific text here,
+# so one precompiled block serves all stages.
+SYSTEM_PROMPT = """
+You are an AI research strategist helping a startup choose the best validation methods.
+The user message gives the startup's idea title, description, tags and stage.
+
+Available research lenses:
+- SME (interviews with experts)
+- Peer (calls with fellow founders)
+- Survey (structured questions to users)
+- Social (Reddit/Quora/Discord sentiment scraping)
+
+Your job:
+1. Rank the 4 lenses (1 = most useful).
+2. For each lens, provide:
+   - rank
+   - confidence (0–1)
+   - reason (why it's useful or not)
+   - confidenceBasis (how you derived the score)
+   - pros (1–2 bullets)
+   - cons (1–2 bullets)
+
+Format the output as a JSON array like this:
+[
+  {
+    "lens": "SME",
+    "rank": 1,
+    "reason": "...",
+    "confidence": 0.85,
+    "confidenceBasis": "...",
+    "pros": ["...", "..."],
+    "cons": ["...", "..."]
+  },
+  ...
+]
+
+Return ONLY valid JSON with 4 entries.
+"""
+
+# Fields the Nova prompt asks for (it has no stageRelevance)
+NOVA_REQUIRED_FIELDS = ['lens', 'rank', 'reason', 'confidence', 'pros', 'cons']
+
+# Packed mode: several ideas share the fixed prompt and one round trip. Groups
+# are capped by idea count, by the per-idea user text budget, and by how many
+# 4-lens answers fit in Nova's output limit.
+NOVA_MAX_TOKENS = 1200
+PACK_MAX_IDEAS = int(os.environ.get("PACK_MAX_IDEAS", "5"))
+PACK_INPUT_TOKEN_BUDGET = int(os.environ.get("PACK_INPUT_TOKEN_BUDGET", "4000"))
+PACK_OUTPUT_TOKENS_PER_IDEA = int(os.environ.get("PACK_OUTPUT_TOKENS_PER_IDEA", "900"))
+PACK_MAX_OUTPUT_TOKENS = int(os.environ.get("PACK_MAX_OUTPUT_TOKENS", "5000"))
+PACKED_SYSTEM_PROMPT = SYSTEM_PROMPT.replace("Return ONLY valid JSON with 4 entries.\n", PACKED_OUTPUT_INSTRUCTIONS)
+
+def build_prompt(idea: Idea, stage: str):
+    return Prompt(SYSTEM_PROMPT, f"""Given:
+- Idea Title: {idea.title}
+- Description: {idea.description}
+- Tags: {', '.join(idea.tags)}
+- Stage: {stage}
+""")
+
+# Single-idea calls get a per-stage max_tokens that follows the answer
+# lengths actually observed (OUTPUT_BUDGET_*), never above NOVA_MAX_TOKENS,
+# and with EARLY_STOP the stream is closed as soon as all four lenses are in.
+ADAPTIVE_MAX_TOKENS = os.environ.get("ADAPTIVE_MAX_TOKENS", "1") == "1"
+EARLY_STOP = os.environ.get("EARLY_STOP", "1") == "1"
+output_budget = build_output_budget(NOVA_MAX_TOKENS)
+
+def budget_stage(stage: str):
+    # Known stages get their own budget and metric series; anything else shares one
+    return normalize_stage(stage) or "other"
+
+def lens_max_tokens(stage: str):
+    return output_budget.max_tokens(budget_stage(stage)) if ADAPTIVE_MAX_TOKENS else NOVA_MAX_TOKENS
+
+def lens_completion(lenses=None):
+    # stop_when for calls answering with a lens array; lenses narrows it for follow-ups
+    return (lambda: LensCompletion(NOVA_REQUIRED_FIELDS, lenses)) if EARLY_STOP else None
+
+def observe_output(stage: str, timings, objects):
+    # An answer still missing lenses was cut off by max_tokens
+    _, missing = usable_lenses(objects, NOVA_REQUIRED_FIELDS)
+    output_budget.observe(budget_stage(stage), timings.get("output_tokens"), complete=not missing)
+
+# ==== Nova Micro Call ====
+# These names predate the provider router: calls go to whichever backend it
+# currently ranks fastest, hedged when MODEL_HEDGING is on.
+def stream_nova_micro(prompt: Prompt, timings=None, max_tokens=NOVA_MAX_TOKENS, stop_when=None):
+    return router.stream(prompt, max_tokens, timings, stop_when)
+
+def query_nova_micro(prompt: Prompt, timings=None, max_tokens=NOVA_MAX_TOKENS, stop_when=None):
+    return router.query(prompt, max_tokens, timings, stop_when)
+
+def stream_lenses(prompt: Prompt, max_tokens, timings=None):
+    return stream_nova_micro(prompt, timings, max_tokens, lens_completion())
+
+def query_lenses(prompt: Prompt, max_tokens, timings=None):
+    return query_nova_micro(prompt, timings, max_tokens, lens_completion())
+
+# ==== Packed Nova Micro Call ====
+def pack_payloads(entries, payload_of=lambda entry: entry):
+    # Groups entries (payloads, or anything payload_of maps to one) for packed calls
+    max_ideas = max(1, min(PACK_MAX_IDEAS, PACK_MAX_OUTPUT_TOKENS // PACK_OUTPUT_TOKENS_PER_IDEA))
+
+    def cost(entry):
+        payload = payload_of(entry)
+        return estimate_tokens(build_prompt(payload.idea, payload.stage).user)
+
+    return pack_groups(entries, max_ideas, PACK_INPUT_TOKEN_BUDGET, cost)
+
+def packed_tokens(payload: LensSelectorRequest):
+    # One idea's estimated share of a packed call, for admission
+    return estimate_tokens(build_prompt(payload.idea, payload.stage).user) + PACK_OUTPUT_TOKENS_PER_IDEA
+
+def query_nova_micro_packed(payloads: List[LensSelectorRequest], timings=None):
+    # Usable lens entries per payload, in order: a full ranking, a partial one
+    # to top up with query_missing_lenses, or [] to retry that idea alone.
+    ids = [f"idea-{n}" for n in range(1, len(payloads) + 1)]
+    blocks = {idea_id: build_prompt(payload.idea, payload.stage).user for idea_id, payload in zip(ids, payloads)}
+    prompt = Prompt(PACKED_SYSTEM_PROMPT, format_packed_ideas(blocks))
+    max_tokens = min(PACK_MAX_OUTPUT_TOKENS, PACK_OUTPUT_TOKENS_PER_IDEA * len(payloads))
+    raw_output = query_nova_micro(prompt, timings, max_tokens)
+    results = split_packed_output(raw_output, ids, NOVA_REQUIRED_FIELDS)
+    return [results[idea_id] for idea_id in ids]
+
+def followup_call(prompt: Prompt, kept, missing):
+    # (prompt, max_tokens) of the call asking only for the missing lenses
+    return Prompt(prompt.system, prompt.user + followup_request(kept, missing)), FOLLOWUP_TOKENS_PER_LENS * len(missing)
+
+def query_missing_lenses(prompt: Prompt, kept, missing, timings=None):
+    # Asks only for the lenses a truncated or malformed answer lacked
+    followup, max_tokens = followup_call(prompt, kept, missing)
+    raw_output = query_nova_micro(followup, timings, max_tokens, lens_completion(missing))
+    return merge_lenses(kept, raw_output, NOVA_REQUIRED_FIELDS)
+
+
+# ==== Local Answers ====
+def rule_based_lenses(payload: LensSelectorRequest):
+    idea = payload.idea
+    return rank_lenses(idea.title, idea.description, idea.tags, payload.stage)
+
+def semantic_namespace(payload: LensSelectorRequest):
+    # None for an unknown stage: free-form stage strings get no partition of their own
+    stage = normalize_stage(payload.stage)
+    return f"{stage}|{PROMPT_VERSION}|{inference_profile_arn}" if stage is not None else None
+
+def semantic_text(payload: LensSelectorRequest):
+    idea = payload.idea
+    return idea_text(idea.title, idea.description, idea.tags)
+
+def local_lenses(payload: LensSelectorRequest, key):
+    # Answers that don't need the model, cheapest first: exact cache,
+    # near-duplicate cache, confident rules. Returns (None, {}) if none apply.
+    cached = lens_cache.get(key)
+    if cached is not None:
+        return cached, {"source": "cache"}
+
+    namespace = semantic_namespace(payload)
+    if SEMANTIC_CACHE_ENABLED and namespace is not None:
+        near = semantic_cache.lookup(namespace, semantic_text(payload))
+        if near is not None:
+            return near[0], {"source": "semantic", "similarity": round(near[1], 4)}
+
+    rules_lenses, rules_confidence = rule_based_lenses(payload)
+    if rules_lenses is not None and rules_confidence >= RULES_CONFIDENCE_THRESHOLD:
+        return rules_lenses, {"source": "rules"}
+    return None, {}
+
+def remember_lenses(payload: LensSelectorRequest, key, lenses):
+    if validate_lenses(lenses, NOVA_REQUIRED_FIELDS) is None:
+        lens_cache.set(key, lenses)
+        namespace = semantic_namespace(payload)
+        if SEMANTIC_CACHE_ENABLED and namespace is not None:
+            semantic_cache.add(namespace, semantic_text(payload), lenses)
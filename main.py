@@ -1,113 +1,1005 @@
-from fastapi import FastAPI
-from pydantic import BaseModel
-from typing import List
-from fastapi.responses import JSONResponse
-import boto3
+from startup import STARTUP, timed_import
+with STARTUP.timed("import:fastapi"):
+    from fastapi import FastAPI, File, Form, Request, UploadFile
+    from pydantic import BaseModel
+    from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from lens_parser import LensArrayParser, extract_lens_objects, usable_lenses, validate_lenses
+from lens_cache import LensCache
+from lens_service import (
+    MODEL_MAX_CONCURRENCY, NOVA_REQUIRED_FIELDS, PACKED_SYSTEM_PROMPT, SYSTEM_PROMPT, Idea, LensSelectorRequest,
+    build_prompt, followup_call, lens_cache, lens_max_tokens, local_lenses, observe_output, output_budget, pack_payloads,
+    packed_tokens, query_lenses, query_missing_lenses, query_nova_micro_packed, remember_lenses, request_cache_key,
+    router, rule_based_lenses, semantic_cache, stream_lenses,
+)
+from job_queue import JobQueue, QueueFull
+from webhooks import WebhookRejected, post_webhook, resolve_webhook
+from coalesce import Coalescer, Flight, IdempotencyConflict
+from deck_ingest import DeckError, DeckIngestor, summarize_deck
+from result_store import ResultStore
+from rate_limit import AdmissionController, RateLimited
+from model_clients import client_stats
+from providers import Prompt, nova_system_blocks, system_texts
+from metrics import COALESCED, REGISTRY, REQUESTS, SALVAGE, HTTP_SECONDS, observe_phase, server_timing
+import asyncio
 import json
+import logging
+import os
+import tempfile
+import threading
+import time
 
 app = FastAPI()
+logger = logging.getLogger(__name__)
 
-# AWS Bedrock config
-bedrock = boto3.client("bedrock-runtime", region_name="ap-south-1")
-inference_profile_arn = "arn:aws:bedrock:ap-south-1:069717477936:inference-profile/apac.amazon.nova-micro-v1:0"
+# Model calls block on the Bedrock event stream, so they run on a bounded pool
+# instead of the event loop. The pool size caps concurrent Nova calls per worker.
+model_executor = ThreadPoolExecutor(max_workers=MODEL_MAX_CONCURRENCY, thread_name_prefix="nova")
+
+# Admission control ahead of the model pool. Each study gets its own RPM/TPM
+# budget (STUDY_RPM, STUDY_TPM; 0 is unlimited) and every call needs headroom
+# in some provider's budget (NOVA_RPM, NOVA_TPM, ...). Requests wait up to
+# ADMISSION_MAX_WAIT seconds for capacity, then get 429 with Retry-After.
+admission = AdmissionController(
+    study_rpm=float(os.environ.get("STUDY_RPM", "0")),
+    study_tpm=float(os.environ.get("STUDY_TPM", "0")),
+    max_wait=float(os.environ.get("ADMISSION_MAX_WAIT", "2.0")),
+    max_waiting=int(os.environ.get("ADMISSION_MAX_WAITING", "256")),
+    headroom=router.headroom,
+)
+
+# A single batch may use at most this many model workers at once, so one large
+# batch can't starve interactive requests sharing the pool.
+BATCH_MAX_CONCURRENCY = int(os.environ.get("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "500"))
+
+# When the model call fails, the rules answer anyway (RULES_CONFIDENCE_THRESHOLD
+# in lens_service decides when they answer without asking the model)
+RULES_FALLBACK = os.environ.get("RULES_FALLBACK", "1") == "1"
+background_tasks = set()
+
+# Adds a Server-Timing header with every recorded phase to lens responses
+TIMING_HEADERS = os.environ.get("TIMING_HEADERS", "0") == "1"
+
+# Submit/poll job API. Jobs persist in SQLite and a fixed number of background
+# workers drain them, so accepting a job never waits on model capacity. A
+# running job's lease (JOB_LEASE seconds) is renewed while this process is
+# alive; jobs of a process that died are picked up once theirs runs out.
+with STARTUP.timed("init:job_queue"):
+    job_queue = JobQueue(
+        db_path=os.environ.get("JOB_QUEUE_DB", "lens_jobs.db"),
+        max_queued=int(os.environ.get("JOB_MAX_QUEUED", "10000")),
+        max_queued_per_study=int(os.environ.get("JOB_MAX_QUEUED_PER_STUDY", "500")),
+        max_running_per_study=int(os.environ.get("JOB_MAX_RUNNING_PER_STUDY", "4")),
+        retention_seconds=float(os.environ.get("JOB_RETENTION", "86400")),
+        lease_seconds=float(os.environ.get("JOB_LEASE", "300")),
+    )
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "1.0"))
+WEBHOOK_ATTEMPTS = int(os.environ.get("WEBHOOK_ATTEMPTS", "3"))
+job_wakeup = asyncio.Event()
+job_tasks = []
+webhook_tasks = set()  # deliveries in progress, off the job workers
+
+# Pitch-deck uploads. Extracted page text is cached per file hash (memory,
+# plus SQLite when DECK_CACHE_DB is set); limits come from DECK_MAX_BYTES,
+# DECK_MAX_PAGES and DECK_MAX_PAGE_CHARS, parse processes from DECK_WORKERS.
+with STARTUP.timed("init:deck_ingest"):
+    deck_ingestor = DeckIngestor(cache=LensCache(
+        max_entries=int(os.environ.get("DECK_CACHE_SIZE", "2048")),
+        ttl_seconds=float(os.environ.get("DECK_CACHE_TTL", str(7 * 86400))),
+        db_path=os.environ.get("DECK_CACHE_DB"),
+    ))
+DECK_UPLOAD_CHUNK = 1024 * 1024
+
+# Append-only history of every served ranking, keyed by studyId, for the
+# results endpoints and dashboards. RESULT_STORE_WARM_ENTRIES recent model
+# answers are loaded back into the response cache by warm_up().
+with STARTUP.timed("init:result_store"):
+    # Flushed by flush_results() off the event loop, not by a full buffer on it
+    result_store = ResultStore(db_path=os.environ.get("RESULT_STORE_DB", "lens_results.db"), flush_when_full=False)
+RESULT_STORE_ENABLED = os.environ.get("RESULT_STORE_ENABLED", "1") == "1"
+RESULT_STORE_FLUSH_INTERVAL = float(os.environ.get("RESULT_STORE_FLUSH_INTERVAL", "1.0"))
+RESULT_STORE_WARM_ENTRIES = int(os.environ.get("RESULT_STORE_WARM_ENTRIES", "1000"))
+
+# Identical requests in flight share one answer, kept COALESCE_WINDOW seconds
+# for late retries; with an Idempotency-Key header, IDEMPOTENCY_TTL seconds
+coalescer = Coalescer(
+    window=float(os.environ.get("COALESCE_WINDOW", "30")),
+    idempotency_ttl=float(os.environ.get("IDEMPOTENCY_TTL", "600")),
+    max_entries=int(os.environ.get("COALESCE_MAX_ENTRIES", "10000")),
+)
 
 # ==== Input Schema ====
-class Idea(BaseModel):
-    title: str
-    description: str
-    tags: List[str]
-
-class LensSelectorRequest(BaseModel):
-    studyId: str
-    idea: Idea
-    stage: str  # "idea", "prototype", or "beta"
-
-# ==== Prompt Builder ====
-def build_prompt(idea: Idea, stage: str):
-    return f"""
-You are an AI research strategist helping a startup choose the best validation methods.
-
-Given:
-- Idea Title: {idea.title}
-- Description: {idea.description}
-- Tags: {', '.join(idea.tags)}
-- Stage: {stage}
-
-Available research lenses:
-- SME (interviews with experts)
-- Peer (calls with fellow founders)
-- Survey (structured questions to users)
-- Social (Reddit/Quora/Discord sentiment scraping)
-
-Your job:
-1. Rank the 4 lenses (1 = most useful).
-2. For each lens, provide:
-   - rank
-   - confidence (0–1)
-   - reason (why it's useful or not)
-   - confidenceBasis (how you derived the score)
-   - pros (1–2 bullets)
-   - cons (1–2 bullets)
-
-Format the output as a JSON array like this:
-[
-  {{
-    "lens": "SME",
-    "rank": 1,
-    "reason": "...",
-    "confidence": 0.85,
-    "confidenceBasis": "...",
-    "pros": ["...", "..."],
-    "cons": ["...", "..."]
-  }},
-  ...
-]
-
-Return ONLY valid JSON with 4 entries.
-"""
-
-# ==== Nova Micro Call ====
-def query_nova_micro(prompt_text):
-    body = {
-        "inferenceConfig": {
-            "max_new_tokens": 1200
-        },
-        "messages": [
-            {
-                "role": "user",
-                "content": [{"text": prompt_text}]
-            }
-        ]
+# Idea and LensSelectorRequest live in lens_service
+class LensSelectorJobRequest(LensSelectorRequest):
+    priority: Optional[int] = 0  # higher runs first
+    webhookUrl: Optional[str] = None  # POSTed the finished job
+
+class LensSelectorBatchRequest(BaseModel):
+    requests: List[LensSelectorRequest]
+    groupByStudy: Optional[bool] = False
+    pack: Optional[bool] = False  # rank several ideas per model call
+
+# ==== Model Pool ====
+async def run_in_model_pool(fn, *args, timings=None):
+    # Returns fn's result plus how long the call waited for a free worker
+    # and how long the model call itself took, both in milliseconds. fn gets
+    # the same timings dict so it can add its own phases.
+    loop = asyncio.get_running_loop()
+    submitted = time.perf_counter()
+    timings = timings if timings is not None else {}
+
+    def timed_call():
+        started = time.perf_counter()
+        observe_phase("queue_wait", started - submitted, timings=timings)
+        try:
+            return fn(*args, timings=timings)
+        finally:
+            timings["model_latency_ms"] = (time.perf_counter() - started) * 1000
+
+    result = await loop.run_in_executor(model_executor, timed_call)
+    return result, timings
+
+async def iterate_in_model_pool(gen_fn, *args, timings=None):
+    # Drives a blocking generator on the model pool and yields its items on
+    # the event loop as they arrive. Stops the producer if the consumer goes away.
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+    submitted = time.perf_counter()
+    timings = timings if timings is not None else {}
+
+    def produce():
+        started = time.perf_counter()
+        observe_phase("queue_wait", started - submitted, timings=timings)
+        gen = gen_fn(*args, timings=timings)
+        try:
+            for item in gen:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            gen.close()
+            timings["model_latency_ms"] = (time.perf_counter() - started) * 1000
+
+    future = loop.run_in_executor(model_executor, produce)
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        await asyncio.shield(future)
+
+def timing_headers(timings):
+    return {
+        "X-Queue-Wait-Ms": f"{timings.get('queue_wait_ms', 0):.1f}",
+        "X-Model-Latency-Ms": f"{timings.get('model_latency_ms', 0):.1f}",
     }
 
-    response = bedrock.invoke_model_with_response_stream(
-        modelId=inference_profile_arn,
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(body)
-    )
+@app.on_event("shutdown")
+def shutdown_model_pool():
+    model_executor.shutdown(wait=False, cancel_futures=True)
+    router.shutdown()
+    deck_ingestor.shutdown()
+
+def reported_tokens(timings):
+    return timings.get("input_tokens", 0) + timings.get("output_tokens", 0)
+
+def settle_study_budget(budget, estimated, used):
+    # Corrects a study's admitted estimate to the tokens the model reported.
+    # A call that reported none (refused by the router, failed before an
+    # answer) gives the whole estimate back.
+    if budget is not None:
+        budget.tokens.adjust(used - estimated)
+
+async def salvage_lenses(study_id, prompt: Prompt, objects, timings):
+    # Returns a full 4-lens ranking built from the complete objects of an
+    # answer, topped up by a follow-up call if some lenses are missing, or
+    # None if nothing usable came back. The follow-up is admitted against the
+    # study's budget like any model call and raises RateLimited if refused.
+    kept, missing = usable_lenses(objects, NOVA_REQUIRED_FIELDS)
+    if not missing:
+        return kept
+    if not kept:
+        SALVAGE.inc(provider="nova", outcome="failed")
+        return None
+    tokens = router.estimate_tokens(*followup_call(prompt, kept, missing))
+    try:
+        study_budget = await admission.admit(study_id, tokens)
+    except RateLimited:
+        SALVAGE.inc(provider="nova", outcome="rate-limited")
+        raise
+    followup_timings = {}
+    try:
+        merged, _ = await run_in_model_pool(query_missing_lenses, prompt, kept, missing, timings=followup_timings)
+    except Exception:
+        merged = None
+    finally:
+        settle_study_budget(study_budget, tokens, reported_tokens(followup_timings))
+    timings["followup_ms"] = followup_timings.get("model_latency_ms", 0)
+    SALVAGE.inc(provider="nova", outcome="followup" if merged is not None else "failed")
+    return merged
+
+
+# ==== Lens Selection ====
+class LensParseError(Exception):
+    def __init__(self, raw_output, timings):
+        super().__init__("Could not parse JSON from model")
+        self.raw_output = raw_output
+        self.timings = timings
+
+async def find_local_lenses(payload: LensSelectorRequest, key):
+    # local_lenses off the event loop: the near-duplicate scan and the SQLite
+    # cache tier both block
+    return await asyncio.get_running_loop().run_in_executor(None, local_lenses, payload, key)
 
-    output_string = ""
-    for event in response["body"]:
-        if "chunk" in event:
-            chunk = event["chunk"]["bytes"]
-            if chunk:
-                try:
-                    payload = json.loads(chunk.decode("utf-8"))
-                    delta = payload.get("contentBlockDelta", {}).get("delta", {}).get("text", "")
-                    output_string += delta
-                except Exception:
-                    continue
-    return output_string
+def record_result(payload: LensSelectorRequest, key, lenses, source):
+    # History is best-effort: a failure here is logged, never served
+    if not RESULT_STORE_ENABLED or validate_lenses(lenses, NOVA_REQUIRED_FIELDS) is not None:
+        return
+    idea = payload.idea
+    try:
+        result_store.append(payload.studyId, idea.title, idea.description, idea.tags, payload.stage, lenses, source, key)
+    except Exception:
+        logger.exception("Could not record lens result for study %s", payload.studyId)
+
+def fallback_lenses(payload: LensSelectorRequest):
+    if not RULES_FALLBACK:
+        return None
+    return rule_based_lenses(payload)[0]
+
+async def verify_semantic_hit(payload: LensSelectorRequest, served):
+    prompt = build_prompt(payload.idea, payload.stage)
+    try:
+        raw_output, _ = await run_in_model_pool(query_lenses, prompt, lens_max_tokens(payload.stage))
+        fresh = extract_lens_objects(raw_output)
+    except Exception:
+        return
+    semantic_cache.record_verification(served, fresh)
+
+def maybe_verify_semantic_hit(payload: LensSelectorRequest, meta, lenses):
+    if meta.get("source") == "semantic" and semantic_cache.should_verify():
+        task = asyncio.get_running_loop().create_task(verify_semantic_hit(payload, lenses))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+async def select_lenses(payload: LensSelectorRequest, key=None):
+    # Returns (parsed lenses, meta). meta["source"] is "cache", "semantic",
+    # "rules", "model" or "rules-fallback"; model calls also carry their timings.
+    key = key or request_cache_key(payload)
+    lenses, meta = await find_local_lenses(payload, key)
+    if lenses is not None:
+        maybe_verify_semantic_hit(payload, meta, lenses)
+        record_result(payload, key, lenses, meta["source"])
+        return lenses, meta
+
+    timings = {}
+    started = time.perf_counter()
+    prompt = build_prompt(payload.idea, payload.stage)
+    observe_phase("build_prompt", time.perf_counter() - started, timings=timings)
+    max_tokens = lens_max_tokens(payload.stage)
+    tokens = router.estimate_tokens(prompt, max_tokens)
+    study_budget = await admission.admit(payload.studyId, tokens)
+    try:
+        raw_output, _ = await run_in_model_pool(query_lenses, prompt, max_tokens, timings=timings)
+    except Exception:
+        # Includes provider throttling: a rule-based answer beats a 429
+        fallback = fallback_lenses(payload)
+        if fallback is not None:
+            record_result(payload, key, fallback, "rules-fallback")
+            return fallback, {"source": "rules-fallback"}
+        raise
+    finally:
+        settle_study_budget(study_budget, tokens, reported_tokens(timings))
+
+    started = time.perf_counter()
+    objects = extract_lens_objects(raw_output)
+    observe_phase("parse", time.perf_counter() - started, timings=timings)
+    observe_output(payload.stage, timings, objects)
+    parsed = await salvage_lenses(payload.studyId, prompt, objects, timings)
+    if parsed is None:
+        raise LensParseError(raw_output, timings)
+    remember_lenses(payload, key, parsed)
+    record_result(payload, key, parsed, "model")
+    return parsed, {"source": "model", **timings}
+
+CACHE_HEADER_VALUES = {"cache": "hit", "semantic": "semantic"}
+
+def lens_headers(meta):
+    headers = {"X-Lens-Source": meta["source"], "X-Cache": CACHE_HEADER_VALUES.get(meta["source"], "miss")}
+    if "similarity" in meta:
+        headers["X-Semantic-Similarity"] = str(meta["similarity"])
+    if "model_latency_ms" in meta:
+        headers.update(timing_headers(meta))
+    if TIMING_HEADERS:
+        headers["Server-Timing"] = server_timing(meta)
+    if "provider" in meta:
+        headers["X-Model-Provider"] = meta["provider"]
+    if "input_tokens" in meta:
+        headers["X-Input-Tokens"] = str(meta["input_tokens"])
+        headers["X-Output-Tokens"] = str(meta["output_tokens"])
+    return headers
 
 # ==== Endpoint ====
+def rate_limited_response(e: RateLimited):
+    return JSONResponse(
+        content={"error": str(e), "retryAfter": e.retry_after_header()},
+        status_code=429, headers={"Retry-After": e.retry_after_header()},
+    )
+
+def request_fingerprint(payload: LensSelectorRequest):
+    return f"{payload.studyId}|{request_cache_key(payload)}"
+
+async def coalesced(request: Request, endpoint: str, fingerprint: str, start, by_content=True):
+    # Joins or starts the shared answer for this request. Returns the
+    # response for a plain head, or the flight once it is streaming.
+    idempotency_key = request.headers.get("Idempotency-Key")
+    try:
+        flight, role = coalescer.join(
+            f"{endpoint}|{fingerprint}" if by_content else None, fingerprint,
+            f"{endpoint}|{idempotency_key}" if idempotency_key else None, start,
+        )
+    except IdempotencyConflict as e:
+        return JSONResponse(content={"error": str(e)}, status_code=422)
+    COALESCED.inc(endpoint=endpoint, role=role)
+    head = await flight.wait_head()
+    if head == Flight.STREAM:
+        return flight
+    status, body, headers = head
+    if role != "leader":
+        headers = {**headers, "X-Coalesced": role}
+    return Response(content=body, status_code=status, headers=headers, media_type="application/json")
+
+def share_response(flight: Flight, response: Response):
+    headers = {name: value for name, value in response.headers.items() if name not in ("content-length", "content-type")}
+    flight.respond(response.status_code, response.body, headers)
+
 @app.post("/api/ai/lens-selector")
-async def lens_selector(payload: LensSelectorRequest):
+async def lens_selector(payload: LensSelectorRequest, request: Request):
+    async def start(flight):
+        response = await answer_lens_request(payload)
+        share_response(flight, response)
+        if not response.body.startswith(b"["):
+            flight.fail()  # a parse error is answered with 200 but shouldn't be replayed
+    return await coalesced(request, "single", request_fingerprint(payload), start)
+
+async def answer_lens_request(payload: LensSelectorRequest):
+    try:
+        parsed, meta = await select_lenses(payload)
+    except LensParseError as e:
+        REQUESTS.inc(endpoint="single", source="parse-error")
+        headers = lens_headers({"source": "model", **e.timings})
+        return JSONResponse(content={"raw_output": e.raw_output, "error": str(e)}, status_code=200, headers=headers)
+    except RateLimited as e:
+        REQUESTS.inc(endpoint="single", source="rate-limited")
+        return rate_limited_response(e)
+
+    REQUESTS.inc(endpoint="single", source=meta["source"])
+    return JSONResponse(content=parsed, headers=lens_headers(meta))
+
+@app.post("/api/ai/lens-selector/batch")
+async def lens_selector_batch(batch: LensSelectorBatchRequest):
+    if len(batch.requests) > BATCH_MAX_SIZE:
+        return JSONResponse(content={"error": f"Batch too large: {len(batch.requests)} > {BATCH_MAX_SIZE}"}, status_code=413)
+
+    started = time.perf_counter()
+    semaphore = asyncio.Semaphore(BATCH_MAX_CONCURRENCY)
+
+    # Identical ideas inside the batch share one model call
+    keys = [request_cache_key(item) for item in batch.requests]
+    unique = {}
+    for key, item in zip(keys, batch.requests):
+        unique.setdefault(key, item)
+
+    async def run_one(key, item):
+        async with semaphore:
+            try:
+                parsed, meta = await select_lenses(item, key)
+                REQUESTS.inc(endpoint="batch", source=meta["source"])
+                return {"result": parsed, "source": meta["source"]}
+            except LensParseError as e:
+                return {"error": str(e), "raw_output": e.raw_output}
+            except RateLimited as e:
+                REQUESTS.inc(endpoint="batch", source="rate-limited")
+                return {"error": str(e), "retryAfter": e.retry_after_header()}
+            except Exception as e:
+                return {"error": f"Model call failed: {e}"}
+
+    async def finish_packed(key, item, kept):
+        # Lenses the packed answer lacked are asked for alone; an idea with
+        # nothing usable is retried alone
+        try:
+            lenses = await salvage_lenses(item.studyId, build_prompt(item.idea, item.stage), kept, {}) if kept else None
+        except RateLimited as e:
+            REQUESTS.inc(endpoint="batch", source="rate-limited")
+            return {"error": str(e), "retryAfter": e.retry_after_header()}
+        if lenses is None:
+            return await run_one(key, item)
+        remember_lenses(item, key, lenses)
+        record_result(item, key, lenses, "model-packed")
+        REQUESTS.inc(endpoint="batch", source="model-packed")
+        return {"result": lenses, "source": "model-packed"}
+
+    async def admit_packed(group):
+        # Each study in the group is admitted for its own ideas' share of the
+        # packed call. Ideas of a study that is shed get the same rate-limited
+        # result the unpacked path gives; the rest go ahead.
+        # Returns (admitted [(key, item)], {study: (budget, tokens)}, outcomes).
+        tokens = {}
+        for _, item in group:
+            tokens[item.studyId] = tokens.get(item.studyId, 0) + packed_tokens(item)
+        studies = list(tokens)
+        budgets = await asyncio.gather(
+            *(admission.admit(study, tokens[study]) for study in studies), return_exceptions=True
+        )
+        charged, outcomes = {}, {}
+        for study, budget in zip(studies, budgets):
+            if isinstance(budget, Exception):
+                if not isinstance(budget, RateLimited):
+                    raise budget
+                for key, item in group:
+                    if item.studyId == study:
+                        REQUESTS.inc(endpoint="batch", source="rate-limited")
+                        outcomes[key] = {"error": str(budget), "retryAfter": budget.retry_after_header()}
+            else:
+                charged[study] = (budget, tokens[study])
+        return [(key, item) for key, item in group if item.studyId in charged], charged, outcomes
+
+    async def run_packed(group):
+        # group: [(key, item)]
+        async with semaphore:
+            group, charged, shed = await admit_packed(group)
+            if not group:
+                return shed
+            timings = {}
+            try:
+                packed, _ = await run_in_model_pool(query_nova_micro_packed, [item for _, item in group],
+                                                    timings=timings)
+            except Exception:
+                packed = [[]] * len(group)
+            finally:
+                # Spread what the model reported over the studies by their estimates
+                used = reported_tokens(timings)
+                estimated = sum(tokens for _, tokens in charged.values())
+                for budget, tokens in charged.values():
+                    settle_study_budget(budget, tokens, tokens * used / estimated)
+        outcomes = await asyncio.gather(*(finish_packed(key, item, kept) for (key, item), kept in zip(group, packed)))
+        return {**shed, **{key: outcome for (key, _), outcome in zip(group, outcomes)}}
+
+    by_key = {}
+    if batch.pack:
+        # Local answers first; only the rest is packed into model calls
+        remaining = []
+        for key, item in unique.items():
+            lenses, meta = await find_local_lenses(item, key)
+            if lenses is not None:
+                REQUESTS.inc(endpoint="batch", source=meta["source"])
+                record_result(item, key, lenses, meta["source"])
+                by_key[key] = {"result": lenses, "source": meta["source"]}
+            else:
+                remaining.append((key, item))
+        groups = pack_payloads(remaining, payload_of=lambda entry: entry[1])
+        for outcomes in await asyncio.gather(*(run_packed(group) for group in groups)):
+            by_key.update(outcomes)
+    else:
+        outcomes = await asyncio.gather(*(run_one(key, item) for key, item in unique.items()))
+        by_key = dict(zip(unique.keys(), outcomes))
+
+    results = [
+        {"index": index, "studyId": item.studyId, **by_key[key]}
+        for index, (key, item) in enumerate(zip(keys, batch.requests))
+    ]
+    content = {
+        "results": results,
+        "stats": {
+            "total": len(results),
+            "unique": len(unique),
+            "errors": sum(1 for result in results if "error" in result),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        },
+    }
+    if batch.groupByStudy:
+        studies = {}
+        for result in results:
+            studies.setdefault(result["studyId"], []).append(result["index"])
+        content["studies"] = studies
+    return JSONResponse(content=content)
+
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+def format_stream_event(fmt, event, data):
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+@app.post("/api/ai/lens-selector/stream")
+async def lens_selector_stream(payload: LensSelectorRequest, request: Request, format: str = "ndjson"):
+    # Events are shared as (event, data) pairs, so NDJSON and SSE clients of
+    # the same idea can follow one model stream
+    if format not in STREAM_MEDIA_TYPES:
+        return JSONResponse(content={"error": f"Unsupported stream format: {format}"}, status_code=400)
+
+    async def start(flight):
+        stream = await open_lens_stream(payload)
+        if isinstance(stream, Response):
+            share_response(flight, stream)
+            return
+        flight.start_stream()
+        async for event, data in stream:
+            if event == "error":
+                flight.fail()
+            flight.publish((event, data))
+
+    outcome = await coalesced(request, "stream", request_fingerprint(payload), start)
+    if isinstance(outcome, Response):
+        return outcome
+    events = (format_stream_event(format, event, data) async for event, data in outcome.replay())
+    return StreamingResponse(events, media_type=STREAM_MEDIA_TYPES[format])
+
+async def open_lens_stream(payload: LensSelectorRequest):
+    # An async iterator of (event, data), or a response when refused before streaming
+    key = request_cache_key(payload)
+    local, local_meta = await find_local_lenses(payload, key)
+    started = time.perf_counter()
     prompt = build_prompt(payload.idea, payload.stage)
-    raw_output = query_nova_micro(prompt)
+    observe_phase("build_prompt", time.perf_counter() - started)
+    max_tokens = lens_max_tokens(payload.stage)
+    study_budget, tokens = None, 0
+    if local is None:
+        # Refused before the stream starts, while a status code can still be sent
+        tokens = router.estimate_tokens(prompt, max_tokens)
+        try:
+            study_budget = await admission.admit(payload.studyId, tokens)
+        except RateLimited as e:
+            REQUESTS.inc(endpoint="stream", source="rate-limited")
+            return rate_limited_response(e)
+
+    async def immediate_events(lenses, meta):
+        record_result(payload, key, lenses, meta["source"])
+        for lens in lenses:
+            yield ("lens", lens)
+        yield ("done", {"count": len(lenses), **meta})
+
+    async def events():
+        # Only lenses usable_lenses would keep are sent: a known lens, not
+        # sent before, with every field and a free rank. Its choice of the
+        # first good entry per lens never changes as more objects arrive, so
+        # whatever it keeps beyond what was sent is new.
+        parser = LensArrayParser()
+        sent = []
+        timings = {}
+        raw_output = ""
+        try:
+            async for delta in iterate_in_model_pool(stream_lenses, prompt, max_tokens, timings=timings):
+                raw_output += delta
+                if parser.feed(delta):
+                    kept, _ = usable_lenses(parser.objects, NOVA_REQUIRED_FIELDS)
+                    for lens in kept[len(sent):]:
+                        sent.append(lens)
+                        yield ("lens", lens)
+        except Exception as e:
+            fallback = fallback_lenses(payload)
+            if fallback is not None and not sent:
+                async for event in immediate_events(fallback, {"source": "rules-fallback"}):
+                    yield event
+                return
+            yield ("error", {"error": f"Model call failed: {e}"})
+            return
+        finally:
+            settle_study_budget(study_budget, tokens, reported_tokens(timings))
+
+        observe_output(payload.stage, timings, parser.objects)
+        # Lenses already sent stay as they are; a follow-up only adds the
+        # missing ones, matched by lens name
+        try:
+            lenses = await salvage_lenses(payload.studyId, prompt, sent, timings)
+        except RateLimited as e:
+            yield ("error", {"error": str(e), "retryAfter": e.retry_after_header()})
+            yield ("done", {"count": len(sent), "source": "model", **timings})
+            return
+        if lenses is None:
+            yield ("error", {"raw_output": raw_output, "error": "Could not parse JSON from model"})
+            yield ("done", {"count": len(sent), "source": "model", **timings})
+            return
+        sent_names = {lens["lens"] for lens in sent}
+        for lens in lenses:
+            if lens["lens"] not in sent_names:
+                sent.append(lens)
+                yield ("lens", lens)
+        remember_lenses(payload, key, lenses)
+        record_result(payload, key, lenses, "model")
+        yield ("done", {"count": len(sent), "source": "model", **timings})
+
+    if local is not None:
+        REQUESTS.inc(endpoint="stream", source=local_meta["source"])
+        maybe_verify_semantic_hit(payload, local_meta, local)
+        return immediate_events(local, local_meta)
+    REQUESTS.inc(endpoint="stream", source="model")
+    return events()
+
+# ==== Job Queue ====
+@app.post("/api/ai/lens-selector/jobs")
+async def submit_lens_job(payload: LensSelectorJobRequest, request: Request):
+    # Identical jobs may be wanted twice, so only an Idempotency-Key makes a
+    # resubmission return the first job instead of queuing another
+    lens_request = LensSelectorRequest(studyId=payload.studyId, idea=payload.idea, stage=payload.stage)
+    if payload.webhookUrl:
+        try:
+            await resolve_webhook(payload.webhookUrl)
+        except WebhookRejected as e:
+            return JSONResponse(content={"error": str(e)}, status_code=422)
+    if "Idempotency-Key" not in request.headers:
+        return await submit_job(payload, lens_request)
+
+    async def start(flight):
+        share_response(flight, await submit_job(payload, lens_request))
+    fingerprint = f"{request_fingerprint(lens_request)}|{payload.priority}|{payload.webhookUrl}"
+    return await coalesced(request, "jobs", fingerprint, start, by_content=False)
+
+# The job queue and result store are SQLite, so their calls run in a thread
+# rather than on the event loop
+async def submit_job(payload: LensSelectorJobRequest, lens_request: LensSelectorRequest):
+    try:
+        job = await asyncio.to_thread(
+            job_queue.submit, payload.studyId, lens_request.dict(), payload.priority or 0, payload.webhookUrl
+        )
+    except QueueFull as e:
+        return JSONResponse(
+            content={"error": str(e)}, status_code=429, headers={"Retry-After": str(e.retry_after)}
+        )
+    job_wakeup.set()
+    return JSONResponse(
+        content=job, status_code=202, headers={"Location": f"/api/ai/lens-selector/jobs/{job['jobId']}"}
+    )
+
+@app.get("/api/ai/lens-selector/jobs/{job_id}")
+async def get_lens_job(job_id: str):
+    job = await asyncio.to_thread(job_queue.get, job_id)
+    if job is None:
+        return JSONResponse(content={"error": f"Unknown job: {job_id}"}, status_code=404)
+    return JSONResponse(content=job)
+
+@app.get("/api/ai/lens-selector/jobs")
+async def list_lens_jobs(studyId: str, limit: int = 100):
+    jobs = await asyncio.to_thread(job_queue.list_study, studyId, min(limit, 1000))
+    return JSONResponse(content={"studyId": studyId, "jobs": jobs})
+
+async def run_job(job, webhooks):
+    payload = LensSelectorRequest(**job["payload"])
+    try:
+        parsed, meta = await select_lenses(payload)
+        REQUESTS.inc(endpoint="jobs", source=meta["source"])
+        await asyncio.to_thread(job_queue.complete, job["jobId"], {"lenses": parsed, "source": meta["source"]})
+    except LensParseError as e:
+        await asyncio.to_thread(job_queue.fail, job["jobId"], str(e))
+    except RateLimited as e:
+        # Jobs wait out rate limits instead of failing
+        await asyncio.to_thread(job_queue.release, job["jobId"])
+        await asyncio.sleep(e.retry_after)
+        return
+    except Exception as e:
+        await asyncio.to_thread(job_queue.fail, job["jobId"], f"Model call failed: {e}")
+    if job.get("webhookUrl"):
+        # Delivery retries with backoff; the worker moves on to the next job
+        finished = await asyncio.to_thread(job_queue.get, job["jobId"])
+        task = asyncio.create_task(deliver_webhook(finished, webhooks))
+        webhook_tasks.add(task)
+        task.add_done_callback(webhook_tasks.discard)
+
+async def deliver_webhook(job, webhooks):
+    for attempt in range(WEBHOOK_ATTEMPTS):
+        try:
+            response = await post_webhook(webhooks, job["webhookUrl"], job)
+            if response.status_code < 300:
+                await asyncio.to_thread(job_queue.set_webhook_status, job["jobId"], "delivered")
+                return
+        except WebhookRejected:
+            break  # the host now points somewhere it mustn't; retrying won't help
+        except Exception:
+            pass
+        await asyncio.sleep(2 ** attempt)
+    await asyncio.to_thread(job_queue.set_webhook_status, job["jobId"], "failed")
+
+async def job_worker(webhooks):
+    while True:
+        job = await asyncio.to_thread(job_queue.claim)
+        if job is None:
+            job_wakeup.clear()
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        await run_job(job, webhooks)
+
+async def purge_jobs():
+    while True:
+        await asyncio.to_thread(job_queue.purge)
+        await asyncio.sleep(3600)
 
+async def keep_job_leases():
+    # Renews this process's leases and requeues jobs whose process is gone
+    while True:
+        await asyncio.to_thread(job_queue.heartbeat)
+        if await asyncio.to_thread(job_queue.reclaim_stale):
+            job_wakeup.set()
+        await asyncio.sleep(job_queue.lease_seconds / 3)
+
+@app.on_event("startup")
+async def start_job_workers():
+    httpx = timed_import("httpx")
+    webhooks = app.state.webhooks = httpx.AsyncClient(timeout=10)
+    job_tasks.extend(asyncio.create_task(job_worker(webhooks)) for _ in range(JOB_WORKERS))
+    job_tasks.append(asyncio.create_task(purge_jobs()))
+    job_tasks.append(asyncio.create_task(keep_job_leases()))
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    # Jobs cut off here go straight back to the queue for another process
+    tasks = [*job_tasks, *webhook_tasks]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for job_id in list(job_queue.claimed):
+        job_queue.release(job_id)
+    await app.state.webhooks.aclose()
+
+# ==== Deck Ingestion ====
+async def save_upload(upload: UploadFile, max_bytes: int) -> str:
+    # Spools the upload to a temp file a chunk at a time, so a deck is never
+    # held in memory whole and an oversized one is cut off early
+    spool = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    size = 0
+    try:
+        while True:
+            chunk = await upload.read(DECK_UPLOAD_CHUNK)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise DeckError(f"Deck too large: over {max_bytes} bytes", 413)
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        os.unlink(spool.name)
+        raise
+    spool.close()
+    return spool.name
+
+def deck_error_response(e: DeckError):
+    return JSONResponse(content={"error": str(e)}, status_code=e.status)
+
+@app.post("/api/ai/lens-selector/deck")
+async def lens_selector_deck(file: UploadFile = File(...), studyId: str = Form(...), stage: str = Form(...),
+                             format: Optional[str] = None):
+    # Without format, answers once with the extracted idea and its lenses.
+    # format=ndjson|sse streams a "page" event per parsed page, then "idea",
+    # the "lens" events and "done".
+    if format is not None and format not in STREAM_MEDIA_TYPES:
+        return JSONResponse(content={"error": f"Unsupported stream format: {format}"}, status_code=400)
+    try:
+        path = await save_upload(file, deck_ingestor.max_bytes)
+    except DeckError as e:
+        REQUESTS.inc(endpoint="deck", source="deck-error")
+        return deck_error_response(e)
+
+    pages = deck_ingestor.iter_pages(path)
     try:
-        parsed = json.loads(raw_output)
-        return JSONResponse(content=parsed)
-    except:
-        return JSONResponse(content={"raw_output": raw_output, "error": "Could not parse JSON from model"}, status_code=200)
+        # Page-count and unreadable-file errors surface here, while a status code can still be sent
+        first = await pages.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except DeckError as e:
+        os.unlink(path)
+        REQUESTS.inc(endpoint="deck", source="deck-error")
+        return deck_error_response(e)
+
+    async def all_pages():
+        if first is not None:
+            yield first
+            async for page in pages:
+                yield page
+
+    async def lenses_for(texts):
+        idea = Idea(**summarize_deck(texts))
+        payload = LensSelectorRequest(studyId=studyId, idea=idea, stage=stage)
+        parsed, meta = await select_lenses(payload)
+        REQUESTS.inc(endpoint="deck", source=meta["source"])
+        return idea, parsed, meta
+
+    if format is None:
+        try:
+            texts = [text async for _, text in all_pages()]
+            idea, parsed, meta = await lenses_for(texts)
+        except DeckError as e:
+            REQUESTS.inc(endpoint="deck", source="deck-error")
+            return deck_error_response(e)
+        except LensParseError as e:
+            REQUESTS.inc(endpoint="deck", source="parse-error")
+            return JSONResponse(content={"raw_output": e.raw_output, "error": str(e)}, status_code=200)
+        except RateLimited as e:
+            REQUESTS.inc(endpoint="deck", source="rate-limited")
+            return rate_limited_response(e)
+        finally:
+            await pages.aclose()
+            os.unlink(path)
+        return JSONResponse(content={"idea": idea.dict(), "lenses": parsed, "pages": len(texts)}, headers=lens_headers(meta))
+
+    async def events():
+        texts = []
+        try:
+            async for page_no, text in all_pages():
+                texts.append(text)
+                yield format_stream_event(format, "page", {"page": page_no, "chars": len(text)})
+            idea = Idea(**summarize_deck(texts))
+            yield format_stream_event(format, "idea", idea.dict())
+            _, parsed, meta = await lenses_for(texts)
+            for lens in parsed:
+                yield format_stream_event(format, "lens", lens)
+            yield format_stream_event(format, "done", {"count": len(parsed), **meta})
+        except RateLimited as e:
+            REQUESTS.inc(endpoint="deck", source="rate-limited")
+            yield format_stream_event(format, "error", {"error": str(e), "retryAfter": e.retry_after_header()})
+        except (DeckError, LensParseError) as e:
+            yield format_stream_event(format, "error", {"error": str(e)})
+        except Exception as e:
+            yield format_stream_event(format, "error", {"error": f"Model call failed: {e}"})
+        finally:
+            await pages.aclose()
+            os.unlink(path)
+
+    return StreamingResponse(events(), media_type=STREAM_MEDIA_TYPES[format])
+
+# ==== Result History ====
+@app.get("/api/ai/lens-selector/results")
+async def list_lens_results(studyId: str, limit: int = 100):
+    # Latest ranking for each idea in the study, newest first
+    results = await asyncio.to_thread(result_store.latest_per_idea, studyId, min(limit, 1000))
+    return JSONResponse(content={"studyId": studyId, "results": results})
+
+@app.get("/api/ai/lens-selector/results/summary")
+async def lens_results_summary(studyId: str, since: Optional[float] = None, tags: int = 50):
+    top_lens = await asyncio.to_thread(result_store.top_lens_by_stage, studyId, since)
+    confidence = await asyncio.to_thread(result_store.confidence_by_tag, studyId, since, min(tags, 500))
+    return JSONResponse(content={"studyId": studyId, "topLensByStage": top_lens, "confidenceByTag": confidence})
+
+async def flush_results():
+    while True:
+        await asyncio.sleep(RESULT_STORE_FLUSH_INTERVAL)
+        await asyncio.to_thread(result_store.flush)
+
+@app.on_event("startup")
+async def start_result_flusher():
+    app.state.result_flusher = asyncio.create_task(flush_results())
+
+@app.on_event("shutdown")
+async def stop_result_flusher():
+    app.state.result_flusher.cancel()
+    await asyncio.gather(app.state.result_flusher, return_exceptions=True)
+    result_store.flush()
+
+# ==== Startup ====
+# WARM_UP=background (default) builds model clients and precomputes prompt
+# blocks right after startup without delaying readiness; "block" finishes that
+# before serving, "off" leaves everything to the first request.
+WARM_UP = os.environ.get("WARM_UP", "background")
+PRECOMPUTE_PROMPTS = os.environ.get("PRECOMPUTE_PROMPTS", "1") == "1"
+
+def warm_up():
+    with STARTUP.timed("warm_up:clients"):
+        router.warm_up()
+    if RESULT_STORE_WARM_ENTRIES:
+        with STARTUP.timed("warm_up:lens_cache"):
+            since = time.time() - lens_cache.ttl_seconds
+            for key, lenses in result_store.recent_rankings(since, RESULT_STORE_WARM_ENTRIES):
+                lens_cache.set(key, lenses)
+    if PRECOMPUTE_PROMPTS:
+        with STARTUP.timed("warm_up:prompts"):
+            for system_prompt in (SYSTEM_PROMPT, PACKED_SYSTEM_PROMPT):
+                nova_system_blocks(system_texts(Prompt(system_prompt, "")))
+
+def log_warm_up_failure(future):
+    # A failed background warm-up only costs the first requests their head start
+    if not future.cancelled() and future.exception() is not None:
+        logger.error("Background warm-up failed", exc_info=future.exception())
+
+@app.on_event("startup")
+async def start_warm_up():
+    if WARM_UP == "block":
+        await asyncio.get_running_loop().run_in_executor(model_executor, warm_up)
+    elif WARM_UP == "background":
+        model_executor.submit(warm_up).add_done_callback(log_warm_up_failure)
+    STARTUP.mark_ready()
+
+@app.get("/api/ai/startup")
+async def startup_report():
+    return JSONResponse(content=STARTUP.report())
+
+@app.get("/api/ai/lens-selector/cache")
+async def lens_cache_stats():
+    return JSONResponse(content={"exact": lens_cache.stats(), "semantic": semantic_cache.stats()})
+
+@app.get("/api/ai/clients")
+async def model_client_stats():
+    return JSONResponse(content={**client_stats(), "router": router.stats()})
+
+# ==== Metrics ====
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    path = route.path if route is not None else "unmatched"
+    HTTP_SECONDS.observe(time.perf_counter() - started, method=request.method, path=path, status=response.status_code)
+    return response
+
+@REGISTRY.collector
+def collect_component_stats():
+    cache_samples = [
+        ({"tier": tier, "stat": name}, value)
+        for tier, stats in (("exact", lens_cache.stats()), ("semantic", semantic_cache.stats()))
+        for name, value in stats.items() if isinstance(value, (int, float)) and not isinstance(value, bool)
+    ]
+    client_samples = [
+        ({"provider": provider, "stat": name}, value)
+        for provider, stats in client_stats().items()
+        for name, value in stats.items()
+    ]
+    admission_samples = [
+        ({"stat": name}, value) for name, value in admission.stats().items()
+    ]
+    job_samples = [
+        ({"stat": name}, value) for name, value in job_queue.stats().items()
+    ]
+    result_samples = [
+        ({"stat": name}, value) for name, value in result_store.stats().items()
+    ]
+    coalesce_samples = [
+        ({"stat": name}, value) for name, value in coalescer.stats().items()
+    ]
+    output_budget_samples = [
+        ({"stage": stage}, budget["max_tokens"]) for stage, budget in output_budget.snapshot().items()
+    ]
+    deck_samples = [
+        ({"stat": name}, value) for name, value in deck_ingestor.stats().items()
+    ]
+    provider_samples = [
+        ({"provider": provider, "stat": name}, float(value))
+        for provider, profile in router.stats()["providers"].items()
+        for name, value in profile.items() if value is not None
+    ]
+    startup_samples = [
+        ({"phase": phase["phase"]}, phase["ms"]) for phase in STARTUP.report()["phases"]
+    ]
+    return [
+        ("lens_startup_phase_ms", "gauge", "Time spent importing and initializing each component at startup", startup_samples),
+        ("lens_cache_stat", "gauge", "Response cache counters and sizes", cache_samples),
+        ("model_client_stat", "gauge", "Model client pool usage, retries and throttles", client_samples),
+        ("model_provider_stat", "gauge", "Rolling latency and error profile per model backend", provider_samples),
+        ("lens_job_stat", "gauge", "Job queue depth by status and submission counters", job_samples),
+        ("lens_result_store_stat", "gauge", "Result history rows, buffered appends and flushes", result_samples),
+        ("lens_coalesce_stat", "gauge", "Requests sharing an in-flight or recent answer, and answers retained", coalesce_samples),
+        ("lens_output_budget_tokens", "gauge", "Current max_tokens for single-idea lens calls, by stage", output_budget_samples),
+        ("lens_deck_stat", "gauge", "Pitch decks ingested, pages parsed or served from cache, and rejected uploads", deck_samples),
+        ("lens_admission_stat", "gauge", "Requests admitted, queued and shed, and current wait-queue depth", admission_samples),
+    ]
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Collectors read the job queue's and stores' SQLite stats
+    return PlainTextResponse(await asyncio.to_thread(REGISTRY.render), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,197 @@
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+
+# Minimal in-process metrics with Prometheus text exposition, shared by the
+# FastAPI service and the Streamlit app. Collectors let other modules (caches,
+# clients) publish their own counters at scrape time.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for name, value in labels.items():
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+# ==== Metric Types ====
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            items = [(key, (list(entry[0]), entry[1], entry[2])) for key, entry in self.values.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f"{self.name}_bucket", {**labels, "le": le}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+# ==== Registry ====
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        # fn() returns [(name, type, help, [(labels, value), ...]), ...]
+        self.collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        for collect in self.collectors:
+            for name, metric_type, help, samples in collect():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# ==== Lens Pipeline Metrics ====
+PHASE_SECONDS = REGISTRY.histogram(
+    "lens_phase_seconds", "Time spent in each phase of a lens request",
+    ("phase", "provider"),
+)
+TOKENS = REGISTRY.counter(
+    "lens_tokens_total", "Model tokens consumed, by direction",
+    ("provider", "direction"),
+)
+PROMPT_CHARS = REGISTRY.histogram(
+    "lens_prompt_chars", "Size of prompts sent to the model in characters",
+    ("provider",), buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+REQUESTS = REGISTRY.counter(
+    "lens_requests_total", "Lens requests answered, by endpoint and answer source",
+    ("endpoint", "source"),
+)
+SALVAGE = REGISTRY.counter(
+    "lens_salvage_total", "Incomplete model answers, by how they were recovered",
+    ("provider", "outcome"),
+)
+PROVIDER_ATTEMPTS = REGISTRY.counter(
+    "lens_provider_attempts_total", "Routed model attempts, by provider and how they ended",
+    ("provider", "result"),
+)
+HEDGES = REGISTRY.counter(
+    "lens_hedged_requests_total", "Requests that sent a hedged second attempt, by which attempt won",
+    ("winner",),
+)
+EARLY_STOPS = REGISTRY.counter(
+    "lens_early_stops_total", "Model streams closed as soon as the lens array was complete",
+    ("provider",),
+)
+OUTPUT_TOKENS = REGISTRY.histogram(
+    "lens_output_tokens", "Output tokens per lens answer, by stage",
+    ("stage",), buckets=(100, 200, 300, 400, 500, 600, 800, 1000, 1200, 1500, 2000),
+)
+COALESCED = REGISTRY.counter(
+    "lens_coalesced_requests_total", "Lens requests by whether they started an answer or shared one",
+    ("endpoint", "role"),
+)
+HTTP_SECONDS = REGISTRY.histogram(
+    "lens_http_request_seconds", "HTTP request latency until the response starts",
+    ("method", "path", "status"),
+)
+
+def observe_phase(phase: str, seconds: float, provider: str = "", timings: dict = None):
+    PHASE_SECONDS.observe(seconds, phase=phase, provider=provider)
+    if timings is not None:
+        timings[f"{phase}_ms"] = seconds * 1000
+
+def record_usage(provider: str, input_tokens=None, output_tokens=None, timings: dict = None,
+                 cache_read_tokens=None, cache_write_tokens=None):
+    if input_tokens:
+        TOKENS.inc(input_tokens, provider=provider, direction="input")
+    if output_tokens:
+        TOKENS.inc(output_tokens, provider=provider, direction="output")
+    if cache_read_tokens:
+        TOKENS.inc(cache_read_tokens, provider=provider, direction="cache_read")
+    if cache_write_tokens:
+        TOKENS.inc(cache_write_tokens, provider=provider, direction="cache_write")
+    if timings is not None:
+        timings["input_tokens"] = input_tokens or 0
+        timings["output_tokens"] = output_tokens or 0
+
+def server_timing(timings: dict) -> str:
+    # Server-Timing header value for every *_ms entry in a request's timings
+    return ", ".join(
+        f"{name[:-3]};dur={value:.1f}" for name, value in timings.items()
+        if name.endswith("_ms") and isinstance(value, (int, float))
+    )
@@ -0,0 +1,144 @@
+from contextlib import contextmanager
+import os
+import threading
+
+from startup import STARTUP, timed_import
+
+# Shared construction for the Bedrock and Anthropic clients. Both keep a pool
+# of keep-alive connections sized for concurrent model calls, retry throttling
+# with jittered exponential backoff, and report pool usage and retry counts.
+# The SDKs are imported by the builders, not here: boto3 and anthropic are the
+# slowest imports in the project and a cold start shouldn't pay for either
+# until a client is actually needed.
+
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceUnavailableException"}
+
+def is_throttle(exc) -> bool:
+    # Bedrock reports throttling as a ClientError code, Anthropic as 429/529
+    response = getattr(exc, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code") in THROTTLE_CODES
+    return getattr(exc, "status_code", None) in (429, 529)
+
+# Stats for every client built here, keyed by provider name
+CLIENT_STATS = {}
+
+
+# ==== Client Stats ====
+class ClientStats:
+    def __init__(self, name: str, pool_size: int):
+        self.name = name
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.counters = {"calls": 0, "errors": 0, "retries": 0, "throttles": 0}
+
+    @contextmanager
+    def track(self):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.counters["calls"] += 1
+        try:
+            yield
+        except Exception:
+            self.incr("errors")
+            raise
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def incr(self, counter: str, amount: int = 1):
+        with self.lock:
+            self.counters[counter] += amount
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "pool_size": self.pool_size,
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "pool_utilization": round(self.in_flight / self.pool_size, 4) if self.pool_size else 0.0,
+                **self.counters,
+            }
+
+def client_stats() -> dict:
+    return {name: stats.snapshot() for name, stats in CLIENT_STATS.items()}
+
+
+# ==== Bedrock ====
+def build_bedrock_client(region_name: str, pool_size: int = None):
+    boto3 = timed_import("boto3")
+    Config = timed_import("botocore.config").Config
+    pool_size = pool_size or int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "50"))
+    config = Config(
+        max_pool_connections=pool_size,
+        connect_timeout=float(os.environ.get("BEDROCK_CONNECT_TIMEOUT", "5")),
+        read_timeout=float(os.environ.get("BEDROCK_READ_TIMEOUT", "60")),
+        tcp_keepalive=True,
+        # Adaptive mode adds client-side rate limiting on top of the standard
+        # jittered exponential backoff when Bedrock starts throttling
+        retries={
+            "mode": os.environ.get("BEDROCK_RETRY_MODE", "adaptive"),
+            "max_attempts": int(os.environ.get("BEDROCK_MAX_ATTEMPTS", "6")),
+        },
+    )
+    with STARTUP.timed("init:bedrock_client"):
+        client = boto3.client("bedrock-runtime", region_name=region_name, config=config)
+    stats = CLIENT_STATS["bedrock"] = ClientStats("bedrock", pool_size)
+
+    def count_retry(response=None, attempts=None, caught_exception=None, **kwargs):
+        # Registered ahead of botocore's own retry handler; returning None
+        # leaves the retry decision to it.
+        if response is not None:
+            code = response[1].get("Error", {}).get("Code")
+            if code in THROTTLE_CODES:
+                stats.incr("throttles")
+        return None
+
+    def count_attempts(parsed=None, **kwargs):
+        if parsed:
+            stats.incr("retries", parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0))
+
+    client.meta.events.register_first("needs-retry.bedrock-runtime", count_retry)
+    client.meta.events.register("after-call.bedrock-runtime", count_attempts)
+    return client
+
+
+# ==== Anthropic ====
+def build_anthropic_client(api_key: str):
+    anthropic = timed_import("anthropic")
+    httpx = timed_import("httpx")
+    max_connections = int(os.environ.get("ANTHROPIC_MAX_CONNECTIONS", "50"))
+    stats = CLIENT_STATS["anthropic"] = ClientStats("anthropic", max_connections)
+
+    def on_request(request):
+        # The SDK numbers its own retries on each outgoing request
+        if int(request.headers.get("x-stainless-retry-count", "0") or 0) > 0:
+            stats.incr("retries")
+
+    def on_response(response):
+        if response.status_code in (429, 529):
+            stats.incr("throttles")
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=int(os.environ.get("ANTHROPIC_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.environ.get("ANTHROPIC_KEEPALIVE_EXPIRY", "30")),
+        ),
+        timeout=httpx.Timeout(
+            float(os.environ.get("ANTHROPIC_TIMEOUT", "60")),
+            connect=float(os.environ.get("ANTHROPIC_CONNECT_TIMEOUT", "5")),
+        ),
+        event_hooks={"request": [on_request], "response": [on_response]},
+    )
+    # The SDK retries 429/5xx with jittered exponential backoff
+    with STARTUP.timed("init:anthropic_client"):
+        client = anthropic.Anthropic(
+            api_key=api_key,
+            max_retries=int(os.environ.get("ANTHROPIC_MAX_RETRIES", "4")),
+            http_client=http_client,
+        )
+    return client
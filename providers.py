@@ -0,0 +1,565 @@
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import NamedTuple, Sequence, Union
+import json
+import os
+import queue
+import threading
+import time
+
+from metrics import EARLY_STOPS, HEDGES, OUTPUT_TOKENS, PROMPT_CHARS, PROVIDER_ATTEMPTS, observe_phase, record_usage
+from model_clients import CLIENT_STATS, is_throttle
+from rate_limit import Budget, RateLimited
+
+# Model backends behind one interface, shared by the FastAPI service (Nova via
+# Bedrock) and the Streamlit app (Claude). The router keeps a rolling latency
+# and error profile per backend, sends each call to the fastest healthy one
+# and can hedge a slow first chunk with a second request elsewhere.
+
+
+class Prompt(NamedTuple):
+    system: Union[str, Sequence[str]]  # one block, or several with the cacheable prefix first
+    user: str
+
+def system_texts(prompt: Prompt):
+    return (prompt.system,) if isinstance(prompt.system, str) else tuple(prompt.system)
+
+def estimated_usage(prompt: Prompt, output_chars):
+    # Stand-in for a stream closed before the provider reported usage
+    return (sum(map(len, system_texts(prompt))) + len(prompt.user)) // 4, output_chars // 4
+
+
+# ==== Latency Profile ====
+class LatencyProfile:
+    # Rolling window of recent calls. Calls cancelled before their first chunk
+    # count their elapsed time as a lower bound, so a stalled backend looks slow.
+
+    def __init__(self, window=200, min_samples=20, failure_threshold=3, cooldown=30.0):
+        self.first_chunk = deque(maxlen=window)
+        self.total = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.lock = threading.Lock()
+
+    def record_success(self, first_chunk, total):
+        with self.lock:
+            self.first_chunk.append(first_chunk)
+            self.total.append(total)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+
+    def record_stall(self, elapsed):
+        with self.lock:
+            self.first_chunk.append(elapsed)
+            self.total.append(elapsed)
+
+    def record_failure(self):
+        with self.lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.unhealthy_until = time.monotonic() + self.cooldown
+
+    def healthy(self):
+        # After the cooldown one call is let through; another failure re-arms it
+        return time.monotonic() >= self.unhealthy_until
+
+    def percentile(self, samples, pct):
+        with self.lock:
+            ordered = sorted(samples)
+        if len(ordered) < self.min_samples:
+            return None
+        return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+    def error_rate(self):
+        with self.lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def expected_latency(self):
+        # Median latency inflated by the error rate; unmeasured backends score
+        # 0 so each one gets sampled before the profile decides
+        p50 = self.percentile(self.total, 50)
+        if p50 is None:
+            return 0.0
+        return p50 / max(0.05, 1.0 - self.error_rate())
+
+    def snapshot(self):
+        p50, p90 = self.percentile(self.total, 50), self.percentile(self.first_chunk, 90)
+        with self.lock:
+            samples = len(self.total)
+        return {
+            "healthy": self.healthy(),
+            "samples": samples,
+            "error_rate": round(self.error_rate(), 4),
+            "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "first_chunk_p90_ms": round(p90 * 1000, 1) if p90 is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+# ==== Output Budget ====
+class OutputBudget:
+    # max_tokens per stage from the answer lengths actually seen: a high
+    # percentile of recent answers plus a margin, kept within [floor,
+    # ceiling]. The ceiling applies until min_samples answers are in. A
+    # truncated answer counts as longer than the limit it hit, so a budget
+    # that turns out too tight grows back.
+
+    def __init__(self, ceiling, floor=300, pct=99, margin=0.15, window=500, min_samples=30, truncation_growth=1.5):
+        self.ceiling = ceiling
+        self.floor = min(floor, ceiling)
+        self.pct = pct
+        self.margin = margin
+        self.window = window
+        self.min_samples = min_samples
+        self.truncation_growth = truncation_growth
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def observe(self, stage, output_tokens, complete=True):
+        if not output_tokens:
+            return
+        OUTPUT_TOKENS.observe(output_tokens, stage=stage)
+        value = output_tokens if complete else output_tokens * self.truncation_growth
+        with self.lock:
+            self.samples.setdefault(stage, deque(maxlen=self.window)).append(value)
+
+    def max_tokens(self, stage):
+        with self.lock:
+            ordered = sorted(self.samples.get(stage, ()))
+        if len(ordered) < self.min_samples:
+            return self.ceiling
+        observed = ordered[min(len(ordered) - 1, int(self.pct / 100 * len(ordered)))]
+        return int(min(self.ceiling, max(self.floor, observed * (1 + self.margin))))
+
+    def snapshot(self):
+        with self.lock:
+            stages = {stage: len(samples) for stage, samples in self.samples.items()}
+        return {stage: {"samples": count, "max_tokens": self.max_tokens(stage)} for stage, count in stages.items()}
+
+def build_output_budget(ceiling):
+    return OutputBudget(
+        ceiling,
+        floor=int(os.environ.get("OUTPUT_BUDGET_FLOOR", "300")),
+        pct=float(os.environ.get("OUTPUT_BUDGET_PERCENTILE", "99")),
+        margin=float(os.environ.get("OUTPUT_BUDGET_MARGIN", "0.15")),
+        min_samples=int(os.environ.get("OUTPUT_BUDGET_MIN_SAMPLES", "30")),
+    )
+
+
+# ==== Providers ====
+# Bedrock only caches prefixes of at least ~1K tokens. "auto" adds a cache
+# point when the static block is long enough, "on"/"off" force it.
+PROMPT_CACHING = os.environ.get("PROMPT_CACHING", "auto")
+PROMPT_CACHE_MIN_CHARS = int(os.environ.get("PROMPT_CACHE_MIN_CHARS", "4096"))
+
+@lru_cache(maxsize=32)
+def nova_system_blocks(texts):
+    blocks = [{"text": texts[0]}]
+    if PROMPT_CACHING == "on" or (PROMPT_CACHING == "auto" and len(texts[0]) >= PROMPT_CACHE_MIN_CHARS):
+        blocks.append({"cachePoint": {"type": "default"}})
+    return blocks + [{"text": text} for text in texts[1:]]
+
+class Provider:
+    # Common state: rolling profile, quota budget and the SDK client. The
+    # client is either passed in or built by client_factory on first use, so
+    # importing an entry point doesn't pay for SDK imports and client setup.
+    name = ""
+
+    def __init__(self, client=None, client_factory=None):
+        self._client = client
+        self.client_factory = client_factory
+        self.client_lock = threading.Lock()
+        self.profile = LatencyProfile()
+        self.budget = Budget()
+
+    @property
+    def client(self):
+        if self._client is None:
+            with self.client_lock:
+                if self._client is None:
+                    self._client = self.client_factory()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    def warm_up(self):
+        return self.client
+
+class NovaProvider(Provider):
+    name = "nova"
+
+    def __init__(self, model_id, client=None, client_factory=None):
+        super().__init__(client, client_factory)
+        self.model_id = model_id
+
+    def stream(self, prompt: Prompt, max_tokens, timings=None):
+        texts = system_texts(prompt)
+        body = {
+            "system": nova_system_blocks(texts),
+            "inferenceConfig": {
+                "max_new_tokens": max_tokens
+            },
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [{"text": prompt.user}]
+                }
+            ]
+        }
+
+        PROMPT_CHARS.observe(sum(map(len, texts)) + len(prompt.user), provider=self.name)
+        started = time.perf_counter()
+        first_chunk_seen = False
+        usage = {}
+        output_chars = 0
+
+        # Built first: the lazy build is what registers the client's stats
+        client = self.client
+        with CLIENT_STATS["bedrock"].track() if "bedrock" in CLIENT_STATS else nullcontext():
+            events = None
+            try:
+                response = client.invoke_model_with_response_stream(
+                    modelId=self.model_id,
+                    contentType="application/json",
+                    accept="application/json",
+                    body=json.dumps(body)
+                )
+
+                events = response["body"]
+                for event in events:
+                    if "chunk" in event:
+                        chunk = event["chunk"]["bytes"]
+                        if chunk:
+                            try:
+                                payload = json.loads(chunk.decode("utf-8"))
+                                delta = payload.get("contentBlockDelta", {}).get("delta", {}).get("text", "")
+                            except Exception:
+                                continue
+                            # Token usage arrives in the trailing metadata chunk
+                            if "metadata" in payload:
+                                usage = payload["metadata"].get("usage", usage)
+                            if delta:
+                                if not first_chunk_seen:
+                                    first_chunk_seen = True
+                                    observe_phase("first_chunk", time.perf_counter() - started, self.name, timings)
+                                output_chars += len(delta)
+                                yield delta
+            finally:
+                # Closing frees the pooled connection when a hedge loser is cancelled
+                if events is not None:
+                    events.close()
+                observe_phase("model_stream", time.perf_counter() - started, self.name, timings)
+                if not usage and output_chars:
+                    # Closed early: the usage trailer never arrived
+                    usage["inputTokens"], usage["outputTokens"] = estimated_usage(prompt, output_chars)
+                record_usage(
+                    self.name, usage.get("inputTokens"), usage.get("outputTokens"), timings,
+                    cache_read_tokens=usage.get("cacheReadInputTokenCount"),
+                    cache_write_tokens=usage.get("cacheWriteInputTokenCount"),
+                )
+
+class ClaudeProvider(Provider):
+    name = "claude"
+
+    def __init__(self, model, client=None, client_factory=None, temperature=0.4):
+        super().__init__(client, client_factory)
+        self.model = model
+        self.temperature = temperature
+
+    def stream(self, prompt: Prompt, max_tokens, timings=None):
+        texts = system_texts(prompt)
+        # The first block is identical on every call, so it is marked as a
+        # cacheable prefix; anything after it is sent uncached.
+        system = [{"type": "text", "text": texts[0], "cache_control": {"type": "ephemeral"}}]
+        system += [{"type": "text", "text": text} for text in texts[1:]]
+
+        PROMPT_CHARS.observe(sum(map(len, texts)) + len(prompt.user), provider=self.name)
+        started = time.perf_counter()
+        first_chunk_seen = False
+        usage = None
+        output_chars = 0
+
+        client = self.client
+        with CLIENT_STATS["anthropic"].track() if "anthropic" in CLIENT_STATS else nullcontext():
+            try:
+                with client.messages.stream(
+                    model=self.model,
+                    max_tokens=max_tokens,
+                    temperature=self.temperature,
+                    system=system,
+                    messages=[{"role": "user", "content": prompt.user}],
+                ) as response:
+                    for delta in response.text_stream:
+                        if not delta:
+                            continue
+                        if not first_chunk_seen:
+                            first_chunk_seen = True
+                            observe_phase("first_chunk", time.perf_counter() - started, self.name, timings)
+                        output_chars += len(delta)
+                        yield delta
+                    usage = response.get_final_message().usage
+            finally:
+                observe_phase("model_stream", time.perf_counter() - started, self.name, timings)
+                input_tokens, output_tokens = getattr(usage, "input_tokens", None), getattr(usage, "output_tokens", None)
+                if usage is None and output_chars:
+                    # Closed early, before the final message
+                    input_tokens, output_tokens = estimated_usage(prompt, output_chars)
+                record_usage(
+                    self.name, input_tokens, output_tokens, timings,
+                    cache_read_tokens=getattr(usage, "cache_read_input_tokens", None),
+                    cache_write_tokens=getattr(usage, "cache_creation_input_tokens", None),
+                )
+
+
+# ==== Router ====
+class Attempt:
+    def __init__(self, provider, role, tokens, stop=None):
+        self.provider = provider
+        self.role = role  # "primary", "hedge" or "failover"
+        self.tokens = tokens  # estimate charged to the provider budget
+        self.stop = stop  # called with each chunk; True once the answer is complete
+        self.cancel = threading.Event()
+        self.timings = {}
+        self.chunks = []
+        self.failed = False
+
+class ProviderRouter:
+    # Streams race attempts through a queue. A stream commits to the first
+    # attempt that produces a chunk, since text already handed to the caller
+    # can't be swapped; query() waits for the first attempt to finish. Either
+    # way the losing attempt is cancelled. If every attempt fails the last
+    # error is raised, as RateLimited when the backend was throttling.
+    #
+    # Every attempt is charged to its provider's RPM/TPM budget first. A
+    # provider without headroom is skipped; if none has any, the call waits up
+    # to max_budget_wait and is then refused with RateLimited.
+    #
+    # stop_when, if given, makes a fresh stop condition per attempt; once it
+    # returns True for a chunk the stream is closed and counts as finished, so
+    # nothing the model adds after a complete answer is waited for or billed.
+
+    def __init__(self, providers, hedging=False, hedge_delay=2.0, hedge_min_delay=0.2, max_workers=32,
+                 max_budget_wait=1.0, throttle_backoff=5.0):
+        if not providers:
+            raise ValueError("ProviderRouter needs at least one provider")
+        self.providers = list(providers)
+        self.hedging = hedging
+        self.hedge_delay = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.max_budget_wait = max_budget_wait
+        self.throttle_backoff = throttle_backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider")
+
+    def provider(self, name):
+        return next((provider for provider in self.providers if provider.name == name), None)
+
+    def ranked(self, tokens=1):
+        # Healthy backends with budget by expected latency, then the rest
+        return sorted(
+            self.providers,
+            key=lambda provider: (
+                not provider.profile.healthy(),
+                provider.budget.wait_time(tokens) > 0,
+                provider.profile.expected_latency(),
+            ),
+        )
+
+    def warm_up(self):
+        # Builds every backend's client ahead of the first request
+        for provider in self.providers:
+            provider.warm_up()
+
+    def headroom(self, tokens):
+        # Seconds until some provider's budget can take a call of this size
+        return min(provider.budget.wait_time(tokens) for provider in self.providers)
+
+    def estimate_tokens(self, prompt: Prompt, max_tokens):
+        return (sum(map(len, system_texts(prompt))) + len(prompt.user)) // 4 + max_tokens
+
+    def hedge_after(self, provider):
+        # The primary's observed first-chunk p90, once there is enough history
+        p90 = provider.profile.percentile(provider.profile.first_chunk, 90)
+        return max(self.hedge_min_delay, p90 if p90 is not None else self.hedge_delay)
+
+    def stream(self, prompt: Prompt, max_tokens, timings=None, stop_when=None):
+        return self._race(prompt, max_tokens, timings, streaming=True, stop_when=stop_when)
+
+    def query(self, prompt: Prompt, max_tokens, timings=None, stop_when=None):
+        return "".join(self._race(prompt, max_tokens, timings, streaming=False, stop_when=stop_when))
+
+    def _run(self, attempt, prompt, max_tokens, events):
+        if attempt.cancel.is_set():
+            # Lost the race while queued for a worker: no call, and its budget back
+            attempt.provider.budget.tokens.adjust(-attempt.tokens)
+            PROVIDER_ATTEMPTS.inc(provider=attempt.provider.name, result="cancelled")
+            return
+        started = time.perf_counter()
+        first_chunk = None
+        gen = attempt.provider.stream(prompt, max_tokens, attempt.timings)
+        try:
+            for delta in gen:
+                if attempt.cancel.is_set():
+                    break
+                if first_chunk is None:
+                    first_chunk = time.perf_counter() - started
+                events.put((attempt, "chunk", delta))
+                if attempt.stop is not None and attempt.stop(delta):
+                    # Closing now records usage before "done" hands the timings over
+                    gen.close()
+                    EARLY_STOPS.inc(provider=attempt.provider.name)
+                    attempt.timings["early_stop"] = True
+                    break
+            if attempt.cancel.is_set():
+                if first_chunk is None:
+                    attempt.provider.profile.record_stall(time.perf_counter() - started)
+                PROVIDER_ATTEMPTS.inc(provider=attempt.provider.name, result="cancelled")
+                return
+            attempt.provider.profile.record_success(first_chunk or 0.0, time.perf_counter() - started)
+            events.put((attempt, "done", None))
+        except Exception as e:
+            if is_throttle(e):
+                # Out of quota rather than unhealthy: stop sending it calls for a bit
+                attempt.provider.budget.requests.block(self.throttle_backoff)
+                attempt.provider.budget.tokens.block(self.throttle_backoff)
+                PROVIDER_ATTEMPTS.inc(provider=attempt.provider.name, result="throttled")
+                e = RateLimited(f"{attempt.provider.name} is throttling: {e}", self.throttle_backoff)
+            else:
+                attempt.provider.profile.record_failure()
+                PROVIDER_ATTEMPTS.inc(provider=attempt.provider.name, result="failed")
+            events.put((attempt, "error", e))
+        finally:
+            gen.close()
+            # Replace the up-front estimate with what the model reported
+            used = attempt.timings.get("input_tokens", 0) + attempt.timings.get("output_tokens", 0)
+            if used:
+                attempt.provider.budget.tokens.adjust(used - attempt.tokens)
+
+    def _admit(self, candidates, tokens, wait_limit):
+        # First candidate whose budget takes the call, waiting up to wait_limit
+        # for one to refill; None if the budgets stay exhausted
+        deadline = time.monotonic() + wait_limit
+        while True:
+            waits = []
+            for provider in candidates:
+                wait = provider.budget.try_take(tokens)
+                if not wait:
+                    return provider
+                waits.append(wait)
+            if not waits or time.monotonic() + min(waits) > deadline:
+                return None
+            time.sleep(min(waits))
+
+    def _race(self, prompt, max_tokens, timings, streaming, stop_when=None):
+        events = queue.Queue()
+        tokens = self.estimate_tokens(prompt, max_tokens)
+        candidates = self.ranked(tokens)
+        attempts = []
+
+        def launch(provider, role):
+            candidates.remove(provider)
+            attempt = Attempt(provider, role, tokens, stop_when() if stop_when else None)
+            attempts.append(attempt)
+            self.executor.submit(self._run, attempt, prompt, max_tokens, events)
+
+        primary = self._admit(candidates, tokens, self.max_budget_wait)
+        if primary is None:
+            raise RateLimited("Every model provider is at its rate limit", self.headroom(tokens))
+        launch(primary, "primary")
+        # Hedge on the next backend, or on the same one if it is the only one
+        hedge_to = (candidates[0] if candidates else primary) if self.hedging else None
+        hedge_at = time.monotonic() + self.hedge_after(primary) if hedge_to else None
+        winner = None
+        try:
+            while True:
+                timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None else None
+                try:
+                    attempt, kind, data = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_at = None
+                    # A hedge is only worth it if it fits the budget right now
+                    if not hedge_to.budget.try_take(tokens):
+                        if hedge_to not in candidates:
+                            candidates.append(hedge_to)
+                        launch(hedge_to, "hedge")
+                    continue
+                if winner is not None and attempt is not winner:
+                    continue
+
+                if kind == "chunk":
+                    hedge_at = None
+                    if winner is None and streaming:
+                        winner = self._settle(attempt, attempts)
+                    if streaming:
+                        yield data
+                    else:
+                        attempt.chunks.append(data)
+                elif kind == "done":
+                    if winner is None:
+                        winner = self._settle(attempt, attempts)
+                    if not streaming:
+                        yield "".join(winner.chunks)
+                    if timings is not None:
+                        timings.update(winner.timings)
+                        timings["provider"] = winner.provider.name
+                    return
+                else:
+                    if attempt is winner:
+                        raise data
+                    attempt.failed = True
+                    if any(not other.failed for other in attempts):
+                        continue
+                    # Nothing left running: fail over to the next backend
+                    hedge_at = None
+                    failover = self._admit(candidates, tokens, 0)
+                    if failover is None:
+                        raise data
+                    launch(failover, "failover")
+        finally:
+            for attempt in attempts:
+                attempt.cancel.set()
+
+    def _settle(self, winner, attempts):
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel.set()
+        PROVIDER_ATTEMPTS.inc(provider=winner.provider.name, result="won")
+        if len(attempts) > 1 and any(attempt.role == "hedge" for attempt in attempts):
+            HEDGES.inc(winner=winner.role)
+        return winner
+
+    def stats(self):
+        return {
+            "hedging": self.hedging,
+            "order": [provider.name for provider in self.ranked()],
+            "providers": {provider.name: provider.profile.snapshot() for provider in self.providers},
+            "budgets": {provider.name: provider.budget.snapshot() for provider in self.providers},
+        }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+def build_router(providers):
+    # Quotas come from <NAME>_RPM / <NAME>_TPM, e.g. NOVA_TPM; 0 is unlimited
+    for provider in providers:
+        prefix = provider.name.upper()
+        provider.budget = Budget(
+            float(os.environ.get(f"{prefix}_RPM", "0")), float(os.environ.get(f"{prefix}_TPM", "0"))
+        )
+    return ProviderRouter(
+        providers,
+        hedging=os.environ.get("MODEL_HEDGING", "0") == "1",
+        hedge_delay=float(os.environ.get("HEDGE_DELAY", "2.0")),
+        hedge_min_delay=float(os.environ.get("HEDGE_MIN_DELAY", "0.2")),
+        max_workers=int(os.environ.get("ROUTER_MAX_WORKERS", "32")),
+        max_budget_wait=float(os.environ.get("ROUTER_MAX_BUDGET_WAIT", "1.0")),
+        throttle_backoff=float(os.environ.get("THROTTLE_BACKOFF", "5.0")),
+    )
@@ -0,0 +1,203 @@
+import asyncio
+import threading
+import time
+
+# Client-side budgets kept under the providers' quotas. Requests and tokens per
+# minute are token buckets; a request that doesn't fit waits briefly for
+# capacity or is shed with a Retry-After, before it reaches a throttling
+# backend. Token costs are estimated up front and corrected once the model
+# reports real usage.
+
+
+class RateLimited(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def retry_after_header(self):
+        return str(max(1, int(self.retry_after + 0.999)))
+
+
+# ==== Token Bucket ====
+class TokenBucket:
+    # rate_per_minute <= 0 means unlimited. Capacity defaults to one minute's
+    # worth, so a quiet period allows a burst up to the quota.
+
+    def __init__(self, rate_per_minute: float, capacity: float = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        # Seconds until amount fits, without taking it
+        if self.unlimited:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            self._refill(now)
+            blocked = max(0.0, self.blocked_until - now)
+            amount = min(amount, self.capacity)  # an oversized request waits for a full bucket
+            return max(blocked, (amount - self.level) / self.rate if self.level < amount else 0.0)
+
+    def try_take(self, amount: float) -> float:
+        # Takes amount and returns 0, or returns the wait and takes nothing
+        if self.unlimited:
+            return 0.0
+        now = time.monotonic()
+        with self.lock:
+            self._refill(now)
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            needed = min(amount, self.capacity)
+            if self.level < needed:
+                return (needed - self.level) / self.rate
+            self.level -= amount
+            return 0.0
+
+    def adjust(self, amount: float):
+        # Positive charges more, negative refunds an over-estimate
+        if self.unlimited or not amount:
+            return
+        with self.lock:
+            self.level = min(self.capacity, self.level - amount)
+
+    def block(self, seconds: float):
+        # Provider said slow down: hand out nothing for a while
+        if self.unlimited:
+            return
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.level = min(self.level, 0.0)
+
+    def snapshot(self):
+        if self.unlimited:
+            return {"per_minute": 0, "available": None}
+        now = time.monotonic()
+        with self.lock:
+            self._refill(now)
+            return {
+                "per_minute": round(self.rate * 60, 1),
+                "available": round(self.level, 1),
+                "blocked_s": round(max(0.0, self.blocked_until - now), 2),
+            }
+
+
+class Budget:
+    # Requests-per-minute and tokens-per-minute buckets for one provider or study
+
+    def __init__(self, rpm: float = 0, tpm: float = 0):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    @property
+    def unlimited(self):
+        return self.requests.unlimited and self.tokens.unlimited
+
+    def wait_time(self, tokens: float) -> float:
+        return max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+
+    def try_take(self, tokens: float) -> float:
+        # Both buckets or neither
+        wait = self.requests.try_take(1)
+        if wait:
+            return wait
+        wait = self.tokens.try_take(tokens)
+        if wait:
+            self.requests.adjust(-1)
+        return wait
+
+    def snapshot(self):
+        return {"rpm": self.requests.snapshot(), "tpm": self.tokens.snapshot()}
+
+
+# ==== Admission ====
+class AdmissionController:
+    # Per-study budgets at the edge of the service. admit() waits up to
+    # max_wait for the study's buckets and for the router's provider headroom,
+    # with at most max_waiting requests parked at once; everything else is
+    # shed with RateLimited.
+
+    def __init__(self, study_rpm: float = 0, study_tpm: float = 0, max_wait: float = 2.0,
+                 max_waiting: int = 256, max_studies: int = 10000, headroom=None):
+        self.study_rpm = study_rpm
+        self.study_tpm = study_tpm
+        self.max_wait = max_wait
+        self.max_waiting = max_waiting
+        self.max_studies = max_studies
+        self.headroom = headroom or (lambda tokens: 0.0)
+        self.studies = {}
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.lock = threading.Lock()
+        self.counters = {"admitted": 0, "queued": 0, "shed": 0}
+
+    def study_budget(self, study_id):
+        if not (self.study_rpm or self.study_tpm):
+            return None
+        with self.lock:
+            budget = self.studies.get(study_id)
+            if budget is None:
+                if len(self.studies) >= self.max_studies:
+                    # Forget the oldest tenth; a recreated budget starts full,
+                    # which only errs toward admitting
+                    for stale in list(self.studies)[:len(self.studies) // 10 or 1]:
+                        del self.studies[stale]
+                budget = self.studies[study_id] = Budget(self.study_rpm, self.study_tpm)
+            return budget
+
+    async def admit(self, study_id: str, tokens: float):
+        # Returns the study budget charged (None if unlimited) so the caller
+        # can correct the token estimate afterwards
+        budget = self.study_budget(study_id)
+        deadline = time.monotonic() + self.max_wait
+        queued = False
+        try:
+            while True:
+                wait = max(budget.wait_time(tokens) if budget else 0.0, self.headroom(tokens))
+                if wait <= 0:
+                    wait = budget.try_take(tokens) if budget else 0.0
+                    if not wait:
+                        self.incr("admitted")
+                        return budget
+                if time.monotonic() + wait > deadline:
+                    self.incr("shed")
+                    scope = "study" if budget and budget.wait_time(tokens) else "provider"
+                    raise RateLimited(f"Rate limit reached ({scope}), retry later", wait)
+                if not queued:
+                    with self.lock:
+                        if self.waiting >= self.max_waiting:
+                            self.counters["shed"] += 1
+                            raise RateLimited("Too many requests waiting for model capacity", wait)
+                        self.waiting += 1
+                        self.peak_waiting = max(self.peak_waiting, self.waiting)
+                        self.counters["queued"] += 1
+                    queued = True
+                await asyncio.sleep(wait)
+        finally:
+            if queued:
+                with self.lock:
+                    self.waiting -= 1
+
+    def incr(self, counter: str):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                **self.counters,
+                "waiting": self.waiting,
+                "peak_waiting": self.peak_waiting,
+                "studies": len(self.studies),
+            }
@@ -0,0 +1,211 @@
+from typing import List, Optional
+import json
+import sqlite3
+import threading
+import time
+import zlib
+
+from lens_cache import cache_key, normalize_text
+from lens_parser import LENSES
+
+# Append-only history of served lens rankings, per study. The numeric part of
+# a ranking (lens order, confidence, stageRelevance) is packed into 12 bytes
+# and the top lens and mean confidence get their own indexed columns, so the
+# dashboard aggregates are index scans over small rows; reasons, pros and
+# cons sit zlib-compressed beside them and are only decoded for full results.
+# Writes are buffered and flushed in one transaction.
+
+LENS_CODES = {lens: code for code, lens in enumerate(LENSES)}
+ENCODED_FIELDS = ("lens", "rank", "confidence", "stageRelevance")
+MISSING = 255
+SCALE = 200
+
+
+# ==== Encoding ====
+def quantize(value) -> int:
+    # 0-1 scores as one byte, exact to two decimals; MISSING when absent or not a number
+    try:
+        return round(min(1.0, max(0.0, float(value))) * SCALE)
+    except (TypeError, ValueError):
+        return MISSING
+
+def dequantize(code: int) -> Optional[float]:
+    return None if code == MISSING else round(code / SCALE, 3)
+
+def encode_ranking(lenses) -> bytes:
+    # Three bytes per lens in rank order: lens code, confidence, stageRelevance
+    ordered = sorted(lenses, key=lambda item: item["rank"])
+    return bytes(
+        byte for item in ordered
+        for byte in (LENS_CODES[item["lens"]], quantize(item.get("confidence")), quantize(item.get("stageRelevance")))
+    )
+
+def decode_ranking(blob: bytes, details: Optional[bytes] = None) -> List[dict]:
+    extra = json.loads(zlib.decompress(details)) if details else [{}] * (len(blob) // 3)
+    lenses = []
+    for rank, offset in enumerate(range(0, len(blob), 3), start=1):
+        lens_code, confidence, relevance = blob[offset:offset + 3]
+        item = {"lens": LENSES[lens_code], "rank": rank, "confidence": dequantize(confidence)}
+        if relevance != MISSING:
+            item["stageRelevance"] = dequantize(relevance)
+        item.update(extra[rank - 1])
+        lenses.append(item)
+    return lenses
+
+def encode_details(lenses) -> bytes:
+    ordered = sorted(lenses, key=lambda item: item["rank"])
+    text = json.dumps([{k: v for k, v in item.items() if k not in ENCODED_FIELDS} for item in ordered],
+                      separators=(",", ":"), ensure_ascii=False)
+    return zlib.compress(text.encode("utf-8"), 6)
+
+def idea_key(title: str, description: str, tags: List[str]) -> str:
+    # Same idea whatever the stage, prompt or model
+    return cache_key(title, description, tags, "", "", "")
+
+
+# ==== Store ====
+class ResultStore:
+    def __init__(self, db_path: str = ":memory:", max_pending: int = 500, flush_when_full: bool = True):
+        # flush_when_full=False leaves every flush to the owner's own schedule,
+        # so append() never touches the database
+        self.max_pending = max_pending
+        self.flush_when_full = flush_when_full
+        self.pending = []
+        self.lock = threading.Lock()
+        self.counters = {"appended": 0, "flushes": 0, "flush_errors": 0, "dropped": 0, "rejected": 0}
+
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS lens_results ("
+            "id INTEGER PRIMARY KEY, study_id TEXT NOT NULL, idea_key TEXT NOT NULL, cache_key TEXT, "
+            "stage TEXT NOT NULL, source TEXT NOT NULL, title TEXT NOT NULL, top_lens INTEGER NOT NULL, "
+            "mean_confidence INTEGER, ranking BLOB NOT NULL, details BLOB, created_at REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS lens_result_tags ("
+            "result_id INTEGER NOT NULL, study_id TEXT NOT NULL, tag TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS lens_results_stage ON lens_results (study_id, stage, top_lens)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS lens_results_idea ON lens_results (study_id, idea_key, id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS lens_result_tags_tag ON lens_result_tags (study_id, tag, result_id)")
+        self.db.commit()
+        # Kept up to date by flush() so stats() doesn't count the table on every scrape
+        self.rows = self.db.execute("SELECT COUNT(*) FROM lens_results").fetchone()[0]
+
+    def append(self, study_id: str, title: str, description: str, tags: List[str], stage: str, lenses,
+               source: str, key: Optional[str] = None) -> None:
+        # Queues one served ranking; it reaches the table on the next flush().
+        # A ranking the encoding can't represent is counted and skipped.
+        if not lenses or any(item.get("lens") not in LENS_CODES or not isinstance(item.get("rank"), int)
+                             for item in lenses):
+            with self.lock:
+                self.counters["rejected"] += 1
+            return
+        scores = [quantize(item.get("confidence")) for item in lenses]
+        scores = [score for score in scores if score != MISSING]
+        row = (
+            study_id, idea_key(title, description, tags), key, normalize_text(stage), source, title[:200],
+            LENS_CODES[min(lenses, key=lambda item: item["rank"])["lens"]],
+            round(sum(scores) / len(scores)) if scores else None,
+            encode_ranking(lenses), encode_details(lenses), time.time(),
+        )
+        tag_list = sorted({normalize_text(tag) for tag in tags if tag.strip()})
+        with self.lock:
+            if len(self.pending) >= self.max_pending * 10:
+                # Flushes are failing; keep memory bounded rather than history complete
+                self.counters["dropped"] += 1
+                return
+            self.pending.append((row, tag_list))
+            self.counters["appended"] += 1
+            flush_now = self.flush_when_full and len(self.pending) >= self.max_pending
+        if flush_now:
+            self.flush()
+
+    def flush(self) -> int:
+        with self.lock:
+            pending, self.pending = self.pending, []
+            if not pending:
+                return 0
+            try:
+                for row, tag_list in pending:
+                    cursor = self.db.execute(
+                        "INSERT INTO lens_results (study_id, idea_key, cache_key, stage, source, title, top_lens, "
+                        "mean_confidence, ranking, details, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        row,
+                    )
+                    self.db.executemany(
+                        "INSERT INTO lens_result_tags (result_id, study_id, tag) VALUES (?, ?, ?)",
+                        [(cursor.lastrowid, row[0], tag) for tag in tag_list],
+                    )
+                self.db.commit()
+            except sqlite3.Error:
+                # Kept for the next flush; history never fails a request
+                self.db.rollback()
+                self.pending[:0] = pending
+                self.counters["flush_errors"] += 1
+                return 0
+            self.counters["flushes"] += 1
+            self.rows += len(pending)
+            return len(pending)
+
+    def _query(self, sql, params):
+        self.flush()
+        with self.lock:
+            return self.db.execute(sql, params).fetchall()
+
+    # ==== Queries ====
+    def top_lens_by_stage(self, study_id: str, since: Optional[float] = None) -> dict:
+        # {stage: {lens: results where it ranked first}}
+        rows = self._query(
+            "SELECT stage, top_lens, COUNT(*) FROM lens_results WHERE study_id = ? AND created_at >= ? "
+            "GROUP BY stage, top_lens",
+            (study_id, since or 0),
+        )
+        distribution = {}
+        for stage, lens_code, count in rows:
+            distribution.setdefault(stage, {lens: 0 for lens in LENSES})[LENSES[lens_code]] = count
+        return distribution
+
+    def confidence_by_tag(self, study_id: str, since: Optional[float] = None, limit: int = 50) -> List[dict]:
+        rows = self._query(
+            "SELECT t.tag, COUNT(*), AVG(r.mean_confidence) FROM lens_result_tags t "
+            "JOIN lens_results r ON r.id = t.result_id "
+            "WHERE t.study_id = ? AND r.created_at >= ? GROUP BY t.tag ORDER BY COUNT(*) DESC, t.tag LIMIT ?",
+            (study_id, since or 0, limit),
+        )
+        return [
+            {"tag": tag, "results": count, "meanConfidence": round(mean / SCALE, 3) if mean is not None else None}
+            for tag, count, mean in rows
+        ]
+
+    def latest_per_idea(self, study_id: str, limit: int = 100) -> List[dict]:
+        rows = self._query(
+            "SELECT idea_key, title, stage, source, ranking, details, created_at FROM lens_results "
+            "WHERE id IN (SELECT MAX(id) FROM lens_results WHERE study_id = ? GROUP BY idea_key) "
+            "ORDER BY id DESC LIMIT ?",
+            (study_id, limit),
+        )
+        return [
+            {"ideaKey": key, "title": title, "stage": stage, "source": source,
+             "lenses": decode_ranking(ranking, details), "createdAt": created_at}
+            for key, title, stage, source, ranking, details, created_at in rows
+        ]
+
+    def recent_rankings(self, since: float, limit: int = 1000, sources=("model",)):
+        # (cache key, lenses) for the newest results, oldest first, to warm the response cache
+        placeholders = ", ".join("?" for _ in sources)
+        rows = self._query(
+            "SELECT cache_key, ranking, details FROM lens_results WHERE id IN ("
+            "SELECT MAX(id) FROM lens_results WHERE cache_key IS NOT NULL AND created_at >= ? "
+            f"AND source IN ({placeholders}) GROUP BY cache_key) ORDER BY id DESC LIMIT ?",
+            (since, *sources, limit),
+        )
+        return [(key, decode_ranking(ranking, details)) for key, ranking, details in reversed(rows)]
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            stats["pending"] = len(self.pending)
+            stats["rows"] = self.rows
+        return stats
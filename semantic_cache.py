@@ -0,0 +1,270 @@
+from typing import List
+import random
+import re
+import threading
+import zlib
+
+from startup import timed_import
+
+# Near-duplicate cache: ideas that differ only in wording ("AI tutor for kids"
+# vs "AI tutoring app for children") reuse a previous model ranking. Text is
+# embedded with a hashed TF-IDF vectorizer, so there is no model to download.
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it", "its",
+    "of", "on", "or", "that", "the", "their", "this", "to", "with", "we", "our", "you", "your",
+}
+
+
+# Common wording variants in idea submissions mapped to one term
+SYNONYMS = {
+    "kid": "child", "children": "child", "youth": "child",
+    "application": "app", "platform": "app", "tool": "app",
+    "startup": "company", "business": "company",
+    "customer": "user", "client": "user",
+    "edtech": "education", "educational": "education", "learning": "education",
+}
+
+# Words nearly every submission uses; they count, but much less than the
+# words that say what the idea is
+GENERIC_TERMS = {"app", "company", "user", "use", "using", "help", "through", "new", "product", "service", "based"}
+GENERIC_WEIGHT = 0.3
+BIGRAM_WEIGHT = 0.5
+
+def stem(word: str) -> str:
+    # Crude suffix stripping so "tutor"/"tutoring" and "drone"/"drones" collide.
+    # Synonyms are checked on the word and after each stripping step, so
+    # "customers" reaches "customer" before "-er" would cut it to "custom".
+    if word in SYNONYMS:
+        return SYNONYMS[word]
+    if len(word) > 4 and word.endswith("ies"):
+        word = word[:-3] + "y"
+    elif len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        word = word[:-1]
+    if word in SYNONYMS:
+        return SYNONYMS[word]
+    if len(word) > 5 and word.endswith("ing"):
+        word = word[:-3]
+    elif len(word) > 5 and word.endswith("er"):
+        word = word[:-2]
+    elif len(word) > 5 and word.endswith("ed"):
+        word = word[:-2]
+    return SYNONYMS.get(word, word)
+
+def tokenize(text: str) -> List[str]:
+    stems = [stem(w) for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in STOPWORDS]
+    return stems + [f"{a}_{b}" for a, b in zip(stems, stems[1:])]
+
+def weighted_terms(text: str):
+    # (term, weight): content words count fully, generic words and word
+    # pairs less, so an extra "app" or a reordering doesn't sink a paraphrase
+    for token in tokenize(text):
+        if "_" in token:
+            yield token, BIGRAM_WEIGHT
+        else:
+            yield token, GENERIC_WEIGHT if token in GENERIC_TERMS else 1.0
+
+def idea_text(title: str, description: str, tags: List[str]) -> str:
+    return " ".join([title, description, " ".join(tags)])
+
+
+# ==== Hashed TF-IDF ====
+def load_numpy():
+    # Imported on first use, so importing the service doesn't pay for NumPy
+    # until the cache holds something
+    return timed_import("numpy")
+
+class HashedTfidfVectorizer:
+    # Feature-hashed term counts weighted by an IDF learned from the documents
+    # added so far. Vectors are L2-normalized so a dot product is cosine similarity.
+    # IDF from a handful of documents mostly penalizes the terms a new idea
+    # shares with the stored ones, so it only applies after min_idf_docs.
+    # An idea is a few dozen terms, so 1024 buckets collide rarely and keep a
+    # full 10000-entry partition at about 40 MB of float32.
+
+    def __init__(self, dim: int = 1024, min_idf_docs: int = 200):
+        self.dim = dim
+        self.min_idf_docs = min_idf_docs
+        self.doc_freq = None  # allocated by the first fit_one()
+        self.docs = 0
+
+    def term_vector(self, text: str):
+        np = load_numpy()
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for token, weight in weighted_terms(text):
+            h = zlib.crc32(token.encode("utf-8"))
+            vec[h % self.dim] += weight if (h >> 31) & 1 == 0 else -weight
+        return vec
+
+    def fit_one(self, tf):
+        if self.doc_freq is None:
+            self.doc_freq = load_numpy().zeros(self.dim, dtype="float32")
+        self.doc_freq += tf != 0
+        self.docs += 1
+
+    def transform(self, tf):
+        np = load_numpy()
+        vec = np.sign(tf) * np.log1p(np.abs(tf))
+        if self.docs >= self.min_idf_docs and self.doc_freq is not None:
+            vec *= np.log((1.0 + self.docs) / (1.0 + self.doc_freq)) + 1.0
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+
+# ==== Vector Indexes ====
+class BruteForceIndex:
+    # Ring buffer of up to capacity vectors; the oldest entry is overwritten
+    # when full. Storage doubles as entries arrive instead of being allocated
+    # for the full capacity up front.
+
+    def __init__(self, dim: int, capacity: int, initial: int = 64):
+        np = load_numpy()
+        self.vectors = np.zeros((min(initial, capacity), dim), dtype=np.float32)
+        self.capacity = capacity
+        self.size = 0
+        self.next_slot = 0
+
+    def add(self, vec) -> int:
+        slot = self.next_slot
+        if slot >= len(self.vectors):
+            np = load_numpy()
+            grown = np.zeros((min(self.capacity, 2 * len(self.vectors)), self.vectors.shape[1]), dtype=np.float32)
+            grown[:len(self.vectors)] = self.vectors
+            self.vectors = grown
+        self.vectors[slot] = vec
+        self.next_slot = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return slot
+
+    def search(self, vec):
+        if not self.size:
+            return None, 0.0
+        sims = self.vectors[:self.size] @ vec
+        best = int(sims.argmax())
+        return best, float(sims[best])
+
+def load_hnswlib():
+    # Optional and only needed for the hnsw backend, so imported on first use
+    try:
+        import hnswlib
+    except ImportError:  # falls back to NumPy brute force
+        return None
+    return hnswlib
+
+class HnswIndex:
+    def __init__(self, dim: int, capacity: int):
+        self.index = load_hnswlib().Index(space="ip", dim=dim)
+        self.index.init_index(max_elements=capacity, ef_construction=100, M=16, allow_replace_deleted=True)
+        self.index.set_ef(50)
+        self.capacity = capacity
+        self.size = 0
+        self.next_slot = 0
+
+    def add(self, vec) -> int:
+        slot = self.next_slot
+        if self.size == self.capacity:
+            self.index.mark_deleted(slot)
+        self.index.add_items(vec[None, :], [slot], replace_deleted=self.size == self.capacity)
+        self.next_slot = (slot + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return slot
+
+    def search(self, vec):
+        if not self.size:
+            return None, 0.0
+        labels, distances = self.index.knn_query(vec[None, :], k=1)
+        return int(labels[0][0]), 1.0 - float(distances[0][0])
+
+
+# ==== Semantic Cache ====
+def top_lens(lenses):
+    try:
+        return min(lenses, key=lambda item: item["rank"])["lens"]
+    except (TypeError, KeyError, ValueError):
+        return None
+
+class SemanticCache:
+    # One index per namespace (stage + prompt version + model id), so a ranking
+    # is only reused for the same stage and prompt. A sample of hits can be
+    # re-checked against the model to measure the false-hit rate. Lookups scan
+    # every stored vector, so callers on an event loop run them in a thread.
+    # The cache-wide lock covers the vectorizer, counters and partition map
+    # (all quick); each partition's scan and writes hold only its own lock, so
+    # lookups in different stages don't wait on each other.
+
+    def __init__(self, threshold: float = 0.75, max_entries: int = 10000, dim: int = 1024,
+                 backend: str = "numpy", verify_rate: float = 0.0):
+        if backend == "hnsw" and load_hnswlib() is None:
+            backend = "numpy"
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.backend = backend
+        self.verify_rate = verify_rate
+        self.vectorizer = HashedTfidfVectorizer(dim)
+        self.partitions = {}
+        self.lock = threading.Lock()
+        self.counters = {
+            "lookups": 0,
+            "hits": 0,
+            "adds": 0,
+            "verified": 0,
+            "false_hits": 0,
+        }
+
+    def _partition(self, namespace):
+        partition = self.partitions.get(namespace)
+        if partition is None:
+            index_cls = HnswIndex if self.backend == "hnsw" else BruteForceIndex
+            partition = {
+                "index": index_cls(self.vectorizer.dim, self.max_entries), "values": {}, "lock": threading.Lock(),
+            }
+            self.partitions[namespace] = partition
+        return partition
+
+    def lookup(self, namespace: str, text: str):
+        # Returns (value, similarity) for the nearest stored idea above the threshold, else None
+        with self.lock:
+            self.counters["lookups"] += 1
+            partition = self.partitions.get(namespace)
+            if partition is None:
+                return None
+            vec = self.vectorizer.transform(self.vectorizer.term_vector(text))
+        with partition["lock"]:
+            slot, similarity = partition["index"].search(vec)
+            if slot is None or similarity < self.threshold:
+                return None
+            value = partition["values"][slot]
+        with self.lock:
+            self.counters["hits"] += 1
+        return value, similarity
+
+    def add(self, namespace: str, text: str, value) -> None:
+        tf = self.vectorizer.term_vector(text)
+        with self.lock:
+            self.vectorizer.fit_one(tf)
+            partition = self._partition(namespace)
+            vec = self.vectorizer.transform(tf)
+            self.counters["adds"] += 1
+        with partition["lock"]:
+            slot = partition["index"].add(vec)
+            partition["values"][slot] = value
+
+    def should_verify(self) -> bool:
+        return self.verify_rate > 0 and random.random() < self.verify_rate
+
+    def record_verification(self, served, fresh) -> None:
+        # A served ranking counts as a false hit if the model would have picked a different top lens
+        with self.lock:
+            self.counters["verified"] += 1
+            if top_lens(served) != top_lens(fresh):
+                self.counters["false_hits"] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            stats = dict(self.counters)
+            stats["entries"] = sum(p["index"].size for p in self.partitions.values())
+        stats["backend"] = self.backend
+        stats["threshold"] = self.threshold
+        stats["hit_rate"] = round(stats["hits"] / stats["lookups"], 4) if stats["lookups"] else 0.0
+        stats["false_hit_rate"] = round(stats["false_hits"] / stats["verified"], 4) if stats["verified"] else 0.0
+        return stats
@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+import importlib
+import json
+import sys
+import threading
+import time
+
+# Startup-cost accounting for the service and the app. Imports and one-off
+# initialization are wrapped in timed() so the report shows where a cold start
+# goes; lazily built clients record their first construction here too.
+#
+#   python -m startup main      # import main, run its warm-up, print the breakdown
+
+PROCESS_STARTED = time.perf_counter()
+
+
+class StartupReport:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = []
+        self.ready_at = None
+
+    @contextmanager
+    def timed(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            self.phases.append((name, seconds))
+
+    def record_once(self, name: str, seconds: float):
+        # For phases more than one caller may time, like a shared import
+        with self.lock:
+            if all(phase != name for phase, _ in self.phases):
+                self.phases.append((name, seconds))
+
+    def mark_ready(self):
+        with self.lock:
+            if self.ready_at is None:
+                self.ready_at = time.perf_counter()
+
+    def report(self) -> dict:
+        with self.lock:
+            phases = list(self.phases)
+            ready_at = self.ready_at
+        return {
+            "ready_ms": round((ready_at - PROCESS_STARTED) * 1000, 1) if ready_at is not None else None,
+            "uptime_ms": round((time.perf_counter() - PROCESS_STARTED) * 1000, 1),
+            "phases": [{"phase": name, "ms": round(seconds * 1000, 1)} for name, seconds in phases],
+        }
+
+STARTUP = StartupReport()
+
+def timed_import(name: str):
+    # Only the import that actually loads the module is recorded; later
+    # callers get it from sys.modules and add no phase
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    started = time.perf_counter()
+    module = importlib.import_module(name)
+    STARTUP.record_once(f"import:{name}", time.perf_counter() - started)
+    return module
+
+
+def main():
+    # Run as __main__, so go through the importable module the target records into
+    from startup import STARTUP as report, timed_import as import_timed
+
+    target = sys.argv[1] if len(sys.argv) > 1 else "main"
+    module = import_timed(target)
+    warm_up = getattr(module, "warm_up", None)
+    if warm_up is not None:
+        with report.timed(f"warm_up:{target}"):
+            warm_up()
+    report.mark_ready()
+    print(json.dumps(report.report(), indent=2))
+
+if __name__ == "__main__":
+    main()
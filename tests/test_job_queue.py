@@ -0,0 +1,58 @@
+import time
+
+from job_queue import JobQueue
+
+
+def test_new_instance_leaves_live_running_jobs_alone(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    first = JobQueue(path)
+    first.submit("s1", {"n": 1})
+    job = first.claim()
+    second = JobQueue(path)
+    assert second.get(job["jobId"])["status"] == "running"
+    assert second.reclaim_stale() == 0
+    assert second.claim() is None
+
+
+def test_stale_jobs_are_reclaimed(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    first = JobQueue(path, lease_seconds=0.05)
+    first.submit("s1", {"n": 1})
+    job = first.claim()
+    time.sleep(0.1)
+    second = JobQueue(path, lease_seconds=0.05)
+    assert second.reclaim_stale() == 1
+    assert second.claim()["jobId"] == job["jobId"]
+
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    first = JobQueue(path, lease_seconds=0.2)
+    first.submit("s1", {"n": 1})
+    first.claim()
+    time.sleep(0.15)
+    assert first.heartbeat() == 1
+    time.sleep(0.1)
+    assert JobQueue(path, lease_seconds=0.2).reclaim_stale() == 0
+
+
+def test_a_row_is_claimed_by_one_instance_only(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    first, second = JobQueue(path), JobQueue(path)
+    first.submit("s1", {"n": 1})
+    # second's SELECT found the row, but first's UPDATE got there first
+    row = second.db.execute("SELECT id FROM lens_jobs WHERE status = 'queued'").fetchone()
+    assert first.claim()["jobId"] == row[0]
+    cursor = second.db.execute(
+        "UPDATE lens_jobs SET status = 'running' WHERE id = ? AND status = 'queued'", (row[0],)
+    )
+    assert cursor.rowcount == 0
+    assert second.claim() is None
+
+
+def test_finished_jobs_drop_their_lease(tmp_path):
+    queue = JobQueue(str(tmp_path / "jobs.db"))
+    queue.submit("s1", {"n": 1})
+    job = queue.claim()
+    queue.complete(job["jobId"], {"ok": True})
+    assert queue.heartbeat() == 0
@@ -0,0 +1,21 @@
+from lens_cache import LensCache
+
+
+def test_disk_count_is_tracked_and_evicts_in_batches(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = LensCache(max_entries=2, db_path=path, max_disk_entries=10)
+    for i in range(10):
+        cache.set(f"k{i}", [i])
+    cache.set("k0", [0, 0])  # a rewrite is not a new row
+    assert cache.stats()["disk_entries"] == 10
+    assert cache.stats()["disk_evictions"] == 0
+
+    cache.set("k10", [10])
+    stats = cache.stats()
+    assert stats["disk_entries"] == 9
+    assert stats["disk_evictions"] == 2
+
+    reopened = LensCache(db_path=path, max_disk_entries=10)
+    assert reopened.stats()["disk_entries"] == 9
+    assert reopened.get("k0") == [0, 0]
+    assert reopened.get("k1") is None
@@ -0,0 +1,61 @@
+import json
+
+from lens_packing import split_packed_output
+from lens_parser import LENSES, REQUIRED_FIELDS, validate_lenses
+
+
+def ranking(names=LENSES):
+    return [
+        {"lens": name, "rank": rank, "reason": "r", "confidence": 0.8, "pros": ["p"], "cons": ["c"],
+         "stageRelevance": 0.7}
+        for rank, name in enumerate(names, start=1)
+    ]
+
+
+def test_valid_ranking_passes():
+    assert validate_lenses(ranking()) is None
+
+
+def test_wrong_case_lens_name_is_rejected():
+    assert validate_lenses(ranking(["SME", "Peer", "Survey", "social"])) is not None
+
+
+def test_repeated_lens_is_rejected():
+    assert validate_lenses(ranking(["SME", "Peer", "Peer", "Social"])) is not None
+
+
+def test_packed_answer_with_bad_lens_names_is_not_accepted():
+    output = json.dumps({
+        "a": ranking(),
+        "b": ranking(["SME", "Peer", "Survey", "social"]),
+        "c": ranking(["SME", "SME", "Survey", "Social"]),
+    })
+    results = split_packed_output(output, ["a", "b", "c"], REQUIRED_FIELDS)
+    assert results["a"] == ranking()
+    assert validate_lenses(results["b"]) is not None
+    assert [item["lens"] for item in results["b"]] == ["SME", "Peer", "Survey"]
+    assert [item["lens"] for item in results["c"]] == ["SME", "Survey", "Social"]
+
+
+def test_truncated_packed_answer_keeps_complete_lenses():
+    output = "```json\n" + json.dumps({"idea-1": ranking(), "idea-2": ranking()})
+    output = output[:output.rindex('{"lens": "Survey"') + 20]
+    results = split_packed_output(output, ["idea-1", "idea-2", "idea-3"], REQUIRED_FIELDS)
+    assert results["idea-1"] == ranking()
+    assert [item["lens"] for item in results["idea-2"]] == ["SME", "Peer"]
+    assert results["idea-3"] == []
+
+
+def test_broken_idea_does_not_borrow_the_next_ideas_array():
+    output = '{"idea-1": "n/a", "idea-2": ' + json.dumps(ranking()) + "}"
+    results = split_packed_output(output, ["idea-1", "idea-2"], REQUIRED_FIELDS)
+    assert results["idea-1"] == []
+    assert results["idea-2"] == ranking()
+
+
+def test_similar_ids_are_not_confused():
+    ids = [f"idea-{n}" for n in range(1, 11)]
+    output = json.dumps({"idea-10": ranking()})
+    results = split_packed_output(output, ids, REQUIRED_FIELDS)
+    assert results["idea-1"] == []
+    assert results["idea-10"] == ranking()
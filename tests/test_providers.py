@@ -0,0 +1,38 @@
+import queue
+
+from providers import Attempt, Provider, ProviderRouter
+
+
+class FakeProvider(Provider):
+    name = "fake"
+
+    def __init__(self, chunks):
+        super().__init__(client=object())
+        self.chunks = chunks
+        self.calls = 0
+
+    def stream(self, prompt, max_tokens, timings=None):
+        self.calls += 1
+        yield from self.chunks
+
+
+def test_cancelled_attempt_never_calls_the_provider():
+    provider = FakeProvider(["[]"])
+    router = ProviderRouter([provider])
+    attempt = Attempt(provider, "hedge", 10)
+    attempt.cancel.set()
+    events = queue.Queue()
+    router._run(attempt, None, 100, events)
+    assert provider.calls == 0
+    assert events.empty()
+    router.shutdown()
+
+
+def test_attempt_streams_and_finishes():
+    provider = FakeProvider(["[", "]"])
+    router = ProviderRouter([provider])
+    attempt = Attempt(provider, "primary", 10)
+    events = queue.Queue()
+    router._run(attempt, None, 100, events)
+    assert [kind for _, kind, _ in list(events.queue)] == ["chunk", "chunk", "done"]
+    router.shutdown()
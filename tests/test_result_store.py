@@ -0,0 +1,33 @@
+from result_store import ResultStore, decode_ranking, encode_details, encode_ranking
+
+LENSES = [
+    {"lens": "Peer", "rank": 1, "confidence": 0.9, "stageRelevance": 0.8, "reason": "r", "pros": ["p"], "cons": []},
+    {"lens": "SME", "rank": 2, "confidence": 0.75, "stageRelevance": 0.6, "reason": "r", "pros": [], "cons": ["c"]},
+    {"lens": "Survey", "rank": 3, "confidence": 0.5, "reason": "r", "pros": [], "cons": []},
+    {"lens": "Social", "rank": 4, "confidence": 0.25, "stageRelevance": 0.1, "reason": "r", "pros": [], "cons": []},
+]
+
+
+def test_ranking_round_trips():
+    decoded = decode_ranking(encode_ranking(LENSES), encode_details(LENSES))
+    assert decoded == LENSES
+
+
+def test_unknown_lens_names_are_rejected_not_raised():
+    store = ResultStore()
+    bad = [dict(item, lens=item["lens"].lower()) for item in LENSES]
+    store.append("s1", "Idea", "desc", ["ai"], "idea", bad, "model")
+    store.append("s1", "Idea", "desc", ["ai"], "idea", [], "model")
+    assert store.flush() == 0
+    assert store.stats()["rejected"] == 2
+
+
+def test_row_count_is_kept_without_counting(tmp_path):
+    path = str(tmp_path / "results.db")
+    store = ResultStore(path)
+    store.append("s1", "Idea", "desc", ["ai"], "idea", LENSES, "model")
+    store.append("s1", "Idea 2", "desc", [], "idea", LENSES, "model")
+    store.flush()
+    assert store.stats()["rows"] == 2
+    assert ResultStore(path).stats()["rows"] == 2
+    assert store.top_lens_by_stage("s1") == {"idea": {"SME": 0, "Peer": 2, "Survey": 0, "Social": 0}}
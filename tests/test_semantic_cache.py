@@ -0,0 +1,45 @@
+from semantic_cache import BruteForceIndex, SemanticCache, idea_text, stem
+
+RANKING = [{"lens": "SME", "rank": 1}, {"lens": "Peer", "rank": 2}, {"lens": "Survey", "rank": 3}, {"lens": "Social", "rank": 4}]
+
+
+def test_reworded_idea_hits_at_default_threshold():
+    cache = SemanticCache()
+    cache.add("IDEATION & PLANNING", "AI tutor for kids", RANKING)
+    hit = cache.lookup("IDEATION & PLANNING", "AI tutoring app for children")
+    assert hit is not None and hit[0] == RANKING
+
+
+def test_reworded_idea_with_description_hits():
+    cache = SemanticCache()
+    cache.add("IDEATION & PLANNING", idea_text(
+        "AI tutor for kids", "Personalized homework help for kids using AI tutoring", ["edtech", "ai"]), RANKING)
+    hit = cache.lookup("IDEATION & PLANNING", idea_text(
+        "AI tutoring app for children", "An app that helps children with homework through personalized AI tutors",
+        ["education", "ai"]))
+    assert hit is not None
+
+
+def test_different_idea_misses():
+    cache = SemanticCache()
+    cache.add("IDEATION & PLANNING", "AI tutor for kids", RANKING)
+    assert cache.lookup("IDEATION & PLANNING", "AI tutor for adults learning Spanish") is None
+    assert cache.lookup("IDEATION & PLANNING", "Drone delivery for farms") is None
+
+
+def test_stage_partitions_are_separate():
+    cache = SemanticCache()
+    cache.add("IDEATION & PLANNING", "AI tutor for kids", RANKING)
+    assert cache.lookup("LAUNCH & SCALING", "AI tutor for kids") is None
+
+
+def test_synonyms_survive_stemming():
+    assert stem("customer") == stem("customers") == stem("client") == "user"
+
+
+def test_index_grows_lazily_and_wraps():
+    index = BruteForceIndex(dim=8, capacity=100, initial=4)
+    assert index.vectors.shape[0] == 4
+    for n in range(150):
+        index.add([float(n)] * 8)
+    assert index.vectors.shape[0] == 100 and index.size == 100
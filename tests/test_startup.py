@@ -0,0 +1,20 @@
+import subprocess
+import sys
+
+from startup import STARTUP, timed_import
+
+
+def test_timed_import_records_a_module_once():
+    timed_import("colorsys")
+    timed_import("colorsys")
+    phases = [phase["phase"] for phase in STARTUP.report()["phases"]]
+    assert phases.count("import:colorsys") <= 1
+
+
+def test_semantic_cache_defers_numpy():
+    code = (
+        "import sys; from semantic_cache import SemanticCache; cache = SemanticCache(); "
+        "assert cache.lookup('idea', 'anything') is None; assert 'numpy' not in sys.modules; "
+        "cache.add('idea', 'AI tutor for kids', []); assert 'numpy' in sys.modules"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,82 @@
+from typing import Optional, Set
+from urllib.parse import urlsplit
+import asyncio
+import ipaddress
+import os
+import socket
+
+# Job webhooks are URLs a caller hands us for the server to POST to, so they
+# are checked like any other request from the outside: https only, and every
+# address the host resolves to must be public, so a webhook can't reach the
+# metadata endpoint, localhost or the private network. The connection goes to
+# the address that was checked (the Host header and TLS name stay the
+# hostname), so a DNS answer that changes between check and send can't slip
+# past. WEBHOOK_ALLOWED_HOSTS, when set, narrows webhooks to those hostnames.
+
+ALLOWED_HOSTS = {
+    host.strip().lower() for host in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip()
+}
+
+
+class WebhookRejected(Exception):
+    pass
+
+
+def check_webhook_url(url: str, allowed_hosts: Optional[Set[str]] = None):
+    # Returns (host, port) for a URL that may be used, before any DNS lookup
+    allowed_hosts = ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+    try:
+        parts = urlsplit(url)
+        port = parts.port or 443
+    except ValueError as e:
+        raise WebhookRejected(f"Invalid webhook URL: {e}")
+    if parts.scheme != "https":
+        raise WebhookRejected("Webhook URL must use https")
+    if not parts.hostname:
+        raise WebhookRejected("Webhook URL has no host")
+    if parts.username or parts.password:
+        raise WebhookRejected("Webhook URL must not carry credentials")
+    host = parts.hostname.lower()
+    if allowed_hosts and host not in allowed_hosts:
+        raise WebhookRejected(f"Webhook host is not allowed: {host}")
+    return host, port
+
+def is_public(address: str) -> bool:
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if getattr(ip, "ipv4_mapped", None) is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+def public_address(host: str, port: int) -> str:
+    # Resolves host and returns an address to connect to; refused if any
+    # address it resolves to is private, loopback, link-local or reserved
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError) as e:
+        raise WebhookRejected(f"Could not resolve webhook host {host}: {e}")
+    addresses = [info[4][0] for info in infos]
+    if not addresses:
+        raise WebhookRejected(f"Could not resolve webhook host {host}")
+    for address in addresses:
+        if not is_public(address):
+            raise WebhookRejected(f"Webhook host {host} resolves to a non-public address: {address}")
+    return addresses[0]
+
+async def resolve_webhook(url: str, allowed_hosts: Optional[Set[str]] = None):
+    # (host, port, address) for a usable webhook URL; raises WebhookRejected
+    host, port = check_webhook_url(url, allowed_hosts)
+    address = await asyncio.get_running_loop().run_in_executor(None, public_address, host, port)
+    return host, port, address
+
+async def post_webhook(client, url: str, body: dict, allowed_hosts: Optional[Set[str]] = None):
+    # POSTs body to url through the address resolve_webhook checked. client is
+    # an httpx.AsyncClient; redirects are never followed.
+    host, port, address = await resolve_webhook(url, allowed_hosts)
+    parts = urlsplit(url)
+    literal = f"[{address}]" if ":" in address else address
+    pinned = parts._replace(netloc=f"{literal}:{port}").geturl()
+    return await client.post(
+        pinned, json=body, follow_redirects=False,
+        headers={"Host": host if port == 443 else f"{host}:{port}"},
+        extensions={"sni_hostname": host},
+    )